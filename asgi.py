@@ -0,0 +1,153 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""
+ASGI entry point of the transform server.
+
+The transforms providing create_entities_async run as coroutines on the event loop,
+the other transforms run their synchronous code on a pool of config.async_transform_threads threads.
+The asynchronous MISP calls go through the circuit breaker, the deadline, the metrics and the call log,
+but not the concurrency limiter, the shared calls or the event batching of the synchronous ones.
+There is no admission control and no /admin endpoint, use project:application when they are needed.
+"""
+
+import asyncio
+import contextvars
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from urllib.parse import unquote
+
+import transforms
+from maltego_trx.maltego import MaltegoMsg
+from maltego_trx.registry import mapping, register_transform_classes
+from maltego_trx.server import get_exception_message
+from utils import config
+from utils.metrics import metrics_output
+from utils.misp_async import close_async_connections
+from utils.tracing import response_headers, trace_scope
+
+register_transform_classes(transforms)
+
+log = logging.getLogger("maltego.server")
+
+# runs the transforms that are not coroutines, the default executor of asyncio is too small for them
+transform_executor = ThreadPoolExecutor(
+    max_workers=config.async_transform_threads, thread_name_prefix="transform"
+)
+
+
+async def run_transform(transform_name: str, body: bytes) -> str:
+    transform = mapping[transform_name]
+    try:
+        request = MaltegoMsg(body)
+        if hasattr(transform, "create_entities_async"):
+            return await transform.run_transform_async(request)
+        # the request context (trace) is passed on to the thread, like asyncio.to_thread does
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            transform_executor, context.run, transform.run_transform, request
+        )
+    except Exception as e:
+        log.error("An exception occurred while executing your transform code.")
+        log.error(e, exc_info=True)
+        return get_exception_message()
+
+
+async def read_body(receive) -> bytes:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+
+async def send_response(
+    send,
+    status: int,
+    text: str,
+    content_type: str = "text/html; charset=utf-8",
+    headers: Optional[list] = None,
+) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode("latin-1"))]
+            + [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers or []
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": text.encode("utf-8")})
+
+
+async def lifespan(receive, send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_async_connections()
+            transform_executor.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send) -> None:
+    """
+    Serves the same routes as the Flask app of maltego_trx.server
+    """
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path = scope["path"]
+    if path == "/":
+        return await send_response(
+            send, 200, "You have reached a Maltego Transform Server."
+        )
+    if path == "/metrics":
+        output, content_type = metrics_output()
+        return await send_response(send, 200, output.decode("utf-8"), content_type)
+    if not path.startswith("/run/"):
+        return await send_response(send, 404, "Not Found")
+
+    transform_name = unquote(path[len("/run/") :].strip("/")).lower()
+    if transform_name not in mapping:
+        log.info("No transform found with the name '%s'." % transform_name)
+        return await send_response(
+            send, 404, "No transform found with the name '%s'." % transform_name
+        )
+    if scope["method"] != "POST":
+        return await send_response(
+            send,
+            200,
+            "Transform found with name '%s', you will need to send a POST request to run it."
+            % transform_name,
+        )
+
+    body = await read_body(receive)
+    request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+    with trace_scope(transform_name, request_id) as trace:
+        output = await run_transform(transform_name, body)
+        return await send_response(send, 200, output, headers=response_headers(trace))
@@ -0,0 +1,575 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""
+Seeded generator of synthetic MISP data, written in the fixtures layout of the MISP stand-in (benchmarks.fake_misp):
+events with their attributes, objects, tags, galaxies and related events, the object templates of the objects
+and a galaxy corpus matching the galaxies of the events.
+
+The attributes are spread over the events with a long tail, a few events hold most of them like on real instances,
+and a share of the values is reused between events so the searches find correlations:
+
+    python -m benchmarks.dataset --output /tmp/misp-fixtures --events 100 --attributes 100000 --seed 1
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import uuid
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone
+from typing import Iterator
+
+org = {"id": "1", "name": "SYNTHETIC", "uuid": "5d8b7a5c-0c6c-4b8e-9a4c-1f1a3c0e0001"}
+themes = (
+    "Phishing campaign",
+    "Ransomware intrusion",
+    "Banking trojan",
+    "Credential harvesting",
+    "Exploit kit landing pages",
+    "Botnet C2 infrastructure",
+    "Supply chain compromise",
+    "Watering hole",
+)
+words = (
+    "invoice",
+    "update",
+    "secure",
+    "login",
+    "portal",
+    "cloud",
+    "mail",
+    "cdn",
+    "files",
+    "support",
+)
+tlds = ("com", "net", "org", "info", "ru", "cn", "io", "biz")
+# (type, category, to_ids) of the generated attributes, with their relative frequency
+attribute_types = (
+    (("ip-dst", "Network activity", True), 12),
+    (("ip-src", "Network activity", True), 4),
+    (("domain", "Network activity", True), 10),
+    (("hostname", "Network activity", True), 6),
+    (("url", "Network activity", True), 8),
+    (("md5", "Payload delivery", True), 8),
+    (("sha1", "Payload delivery", True), 4),
+    (("sha256", "Payload delivery", True), 8),
+    (("filename", "Payload delivery", False), 4),
+    (("filename|md5", "Payload delivery", True), 6),
+    (("filename|sha256", "Payload delivery", True), 4),
+    (("email-src", "Payload delivery", True), 3),
+    (("email-dst", "Payload delivery", False), 2),
+    (("regkey|value", "Persistence mechanism", True), 2),
+    (("AS", "Network activity", False), 1),
+    (("text", "Other", False), 2),
+)
+galaxy_types = (
+    ("threat-actor", "Threat Actor", "user-secret"),
+    ("tool", "Tool", "optin-monster"),
+    ("ransomware", "Ransomware", "btc"),
+    ("mitre-attack-pattern", "Attack Pattern", "map"),
+    ("mitre-malware", "Malware", "optin-monster"),
+)
+# templates of the generated objects: name, meta-category and the (relation, type) of their attributes
+object_kinds = (
+    (
+        "file",
+        "file",
+        (
+            ("filename", "filename"),
+            ("md5", "md5"),
+            ("sha256", "sha256"),
+            ("size-in-bytes", "size-in-bytes"),
+        ),
+    ),
+    (
+        "domain-ip",
+        "network",
+        (("domain", "domain"), ("ip", "ip-dst"), ("first-seen", "datetime")),
+    ),
+    ("url", "network", (("url", "url"), ("domain", "domain"), ("port", "port"))),
+    (
+        "email",
+        "network",
+        (("from", "email-src"), ("subject", "email-subject"), ("to", "email-dst")),
+    ),
+)
+# values kept per attribute type to be reused by other events
+max_shared_values = 10_000
+relationships = (
+    "communicates-with",
+    "drops",
+    "downloaded-from",
+    "related-to",
+    "resolves-to",
+)
+
+
+@dataclass
+class DatasetSpec:
+    seed: int = 1
+    events: int = 10
+    # attributes of all the events, outside of their objects
+    attributes: int = 1000
+    objects_per_event: int = 5
+    # objects reference the next ones in a chain this long, and a few others
+    reference_depth: int = 3
+    # distinct tags, and tags per event
+    tags: int = 100
+    tags_per_event: int = 5
+    # galaxy clusters of the corpus, and clusters per event
+    clusters: int = 200
+    clusters_per_event: int = 3
+    related_events: int = 5
+    # share of the attribute values reused from other events
+    shared_values: float = 0.1
+    # the events are spread over this many days before the end date
+    days: int = 365
+    end_date: str = "2024-06-01"
+
+
+def template_uuid(name: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"misp-object-template:{name}"))
+
+
+def object_templates() -> dict:
+    """
+    Returns the object templates of the generated objects by uuid
+    """
+    return {
+        template_uuid(name): {
+            "ObjectTemplate": {
+                "id": str(i + 1),
+                "uuid": template_uuid(name),
+                "name": name,
+                "version": "1",
+                "meta-category": category,
+                "description": f"Synthetic {name} object",
+                "requirements": {
+                    "requiredOneOf": [relation for relation, _ in elements]
+                },
+            },
+            "ObjectTemplateElement": [
+                {
+                    "object_relation": relation,
+                    "type": type_,
+                    "multiple": False,
+                    "ui-priority": 1,
+                }
+                for relation, type_ in elements
+            ],
+        }
+        for i, (name, category, elements) in enumerate(object_kinds)
+    }
+
+
+class DatasetGenerator:
+    """
+    Generates the events and the galaxy corpus of a DatasetSpec, always the same for the same seed
+    """
+
+    def __init__(self, spec: DatasetSpec):
+        self.spec = spec
+        self.rng = random.Random(spec.seed)
+        self.ids = {"attribute": 0, "object": 0, "reference": 0}
+        self.end = int(
+            datetime.fromisoformat(spec.end_date)
+            .replace(tzinfo=timezone.utc)
+            .timestamp()
+        )
+        self.shared: dict = {}
+        self.clusters = self.galaxy_corpus()
+        self.cluster_ids = {u: str(i + 1) for i, u in enumerate(self.clusters)}
+        self.tags = [
+            {
+                "id": str(i + 1),
+                "name": name,
+                "colour": f"#{self.rng.randrange(1 << 24):06x}",
+            }
+            for i, name in enumerate(self.tag_names())
+        ]
+        self.sizes = self.event_sizes()
+
+    def uuid(self) -> str:
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def next_id(self, kind: str) -> str:
+        self.ids[kind] += 1
+        return str(self.ids[kind])
+
+    def tag_names(self) -> list:
+        names = ["tlp:white", "tlp:green", "tlp:amber", "tlp:red"]
+        for i in range(max(0, self.spec.tags - len(names))):
+            namespace = self.rng.choice(("campaign", "sector", "source", "confidence"))
+            names.append(f'{namespace}:value="{self.rng.choice(words)}-{i}"')
+        return names[: self.spec.tags]
+
+    def galaxy_corpus(self) -> dict:
+        """
+        Returns the galaxy clusters by uuid in the format of the local copy of the galaxies
+        """
+        clusters = {}
+        for i in range(self.spec.clusters):
+            galaxy_type, _, icon = galaxy_types[i % len(galaxy_types)]
+            value = (
+                f"{self.rng.choice(words).title()} {self.rng.choice(words).title()} {i}"
+            )
+            cluster_uuid = self.uuid()
+            clusters[cluster_uuid] = {
+                "uuid": cluster_uuid,
+                "value": value,
+                "type": galaxy_type,
+                "tag_name": f'misp-galaxy:{galaxy_type}="{value}"',
+                "icon": icon,
+                "description": f"Synthetic {galaxy_type} {value}",
+                "meta": {
+                    "synonyms": [
+                        f"{value} alias {n}" for n in range(self.rng.randrange(3))
+                    ]
+                },
+            }
+        uuids = list(clusters)
+        for cluster in clusters.values():
+            related = self.rng.sample(uuids, min(len(uuids), self.rng.randrange(4)))
+            cluster["related"] = [
+                {
+                    "dest-uuid": u,
+                    "type": self.rng.choice(("uses", "similar", "related-to")),
+                }
+                for u in related
+                if u != cluster["uuid"]
+            ]
+        return clusters
+
+    def event_sizes(self) -> list:
+        """
+        Returns the number of attributes of each event, a long tail adding up to the attributes of the spec
+        """
+        if not self.spec.events:
+            return []
+        weights = [self.rng.paretovariate(1.2) for _ in range(self.spec.events)]
+        total = sum(weights)
+        sizes = [int(self.spec.attributes * w / total) for w in weights]
+        for i in range(self.spec.attributes - sum(sizes)):
+            sizes[i % len(sizes)] += 1
+        return sizes
+
+    def value(self, type_: str) -> str:
+        """
+        Returns a value of the attribute type, reusing one of another event for a share of them
+        """
+        pool = self.shared.setdefault(type_, [])
+        if pool and self.rng.random() < self.spec.shared_values:
+            return self.rng.choice(pool)
+        rng = self.rng
+        domain = f"{rng.choice(words)}-{rng.choice(words)}{rng.randrange(10000)}.{rng.choice(tlds)}"
+        digest = hashlib.sha256(rng.getrandbits(64).to_bytes(8, "big"))
+        filename = f"{rng.choice(words)}_{rng.randrange(1000)}.{rng.choice(('exe', 'dll', 'pdf.exe', 'docm', 'js'))}"
+        if type_ in ("ip-dst", "ip-src", "ip"):
+            value = f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+        elif type_ in ("domain", "hostname"):
+            value = domain if type_ == "domain" else f"{rng.choice(words)}.{domain}"
+        elif type_ == "url":
+            value = f"https://{domain}/{rng.choice(words)}/{rng.randrange(100000)}"
+        elif type_ == "md5":
+            value = digest.hexdigest()[:32]
+        elif type_ == "sha1":
+            value = digest.hexdigest()[:40]
+        elif type_ == "sha256":
+            value = digest.hexdigest()
+        elif type_ == "filename":
+            value = filename
+        elif type_ == "filename|md5":
+            value = f"{filename}|{digest.hexdigest()[:32]}"
+        elif type_ == "filename|sha256":
+            value = f"{filename}|{digest.hexdigest()}"
+        elif type_ in ("email-src", "email-dst"):
+            value = f"{rng.choice(words)}{rng.randrange(1000)}@{domain}"
+        elif type_ == "regkey|value":
+            value = f"HKLM\\Software\\Microsoft\\Windows\\CurrentVersion\\Run\\{rng.choice(words)}|{filename}"
+        elif type_ == "AS":
+            value = f"AS{rng.randrange(1, 65000)}"
+        elif type_ == "port":
+            value = str(rng.choice((80, 443, 8080, 8443, 4444)))
+        elif type_ == "size-in-bytes":
+            value = str(rng.randrange(1000, 10_000_000))
+        elif type_ == "datetime":
+            value = datetime.fromtimestamp(
+                self.end - rng.randrange(86400 * 30), timezone.utc
+            ).isoformat()
+        elif type_ == "email-subject":
+            value = (
+                f"{rng.choice(words).title()} {rng.choice(words)} {rng.randrange(1000)}"
+            )
+        else:
+            value = (
+                f"Synthetic note {rng.randrange(1_000_000)} about {rng.choice(words)}"
+            )
+        # a bounded pool keeps the memory flat for the large datasets
+        if len(pool) < max_shared_values:
+            pool.append(value)
+        else:
+            pool[rng.randrange(len(pool))] = value
+        return value
+
+    def attribute(
+        self,
+        event_id: str,
+        timestamp: int,
+        type_: str,
+        category: str,
+        to_ids: bool,
+        object_id: str = "0",
+        relation=None,
+    ) -> dict:
+        attribute = {
+            "id": self.next_id("attribute"),
+            "uuid": self.uuid(),
+            "event_id": event_id,
+            "object_id": object_id,
+            "object_relation": relation,
+            "type": type_,
+            "category": category,
+            "value": self.value(type_),
+            "to_ids": to_ids,
+            "comment": "",
+            "distribution": "5",
+            "timestamp": str(timestamp),
+            "deleted": False,
+            "Tag": [],
+        }
+        if self.rng.random() < 0.05:
+            attribute["comment"] = f"Seen {self.rng.randrange(1, 50)} times"
+        if self.rng.random() < 0.1:
+            attribute["Tag"] = self.rng.sample(self.tags, min(2, len(self.tags)))
+        return attribute
+
+    def galaxies(self, clusters: list) -> list:
+        by_type: dict = {}
+        for cluster in clusters:
+            by_type.setdefault(cluster["type"], []).append(cluster)
+        names = {galaxy_type: name for galaxy_type, name, _ in galaxy_types}
+        return [
+            {
+                "id": str(i + 1),
+                "uuid": str(
+                    uuid.uuid5(uuid.NAMESPACE_URL, f"misp-galaxy:{galaxy_type}")
+                ),
+                "name": names.get(galaxy_type, galaxy_type),
+                "type": galaxy_type,
+                "GalaxyCluster": [
+                    {
+                        "id": self.cluster_ids[c["uuid"]],
+                        **{
+                            k: c[k]
+                            for k in (
+                                "uuid",
+                                "value",
+                                "type",
+                                "tag_name",
+                                "description",
+                                "meta",
+                            )
+                        },
+                    }
+                    for c in type_clusters
+                ],
+            }
+            for i, (galaxy_type, type_clusters) in enumerate(sorted(by_type.items()))
+        ]
+
+    def objects(self, event_id: str, timestamp: int) -> list:
+        objects = []
+        for _ in range(self.spec.objects_per_event):
+            name, _, elements = self.rng.choice(object_kinds)
+            object_id = self.next_id("object")
+            objects.append(
+                {
+                    "id": object_id,
+                    "uuid": self.uuid(),
+                    "name": name,
+                    "meta-category": "network" if name != "file" else "file",
+                    "description": f"Synthetic {name} object",
+                    "template_uuid": template_uuid(name),
+                    "template_version": "1",
+                    "event_id": event_id,
+                    "timestamp": str(timestamp),
+                    "distribution": "5",
+                    "comment": "",
+                    "deleted": False,
+                    "Attribute": [
+                        self.attribute(
+                            event_id,
+                            timestamp,
+                            type_,
+                            "Other",
+                            False,
+                            object_id,
+                            relation,
+                        )
+                        for relation, type_ in elements
+                    ],
+                    "ObjectReference": [],
+                }
+            )
+        # each object references the next ones of the chain, and a few random objects
+        for i, o in enumerate(objects):
+            targets = objects[i + 1 : i + 1 + self.spec.reference_depth]
+            if objects and self.rng.random() < 0.3:
+                targets = targets + [self.rng.choice(objects)]
+            for target in targets:
+                if target is o:
+                    continue
+                o["ObjectReference"].append(
+                    {
+                        "id": self.next_id("reference"),
+                        "uuid": self.uuid(),
+                        "object_id": o["id"],
+                        "event_id": event_id,
+                        "source_uuid": o["uuid"],
+                        "referenced_uuid": target["uuid"],
+                        "referenced_id": target["id"],
+                        "referenced_type": "1",
+                        "relationship_type": self.rng.choice(relationships),
+                        "comment": "",
+                    }
+                )
+        return objects
+
+    def event_info(self, event_id: int) -> str:
+        return f"{themes[event_id % len(themes)]} {event_id}"
+
+    def event_uuid(self, event_id: int) -> str:
+        # known before the event is generated, for the related events
+        return str(
+            uuid.uuid5(
+                uuid.NAMESPACE_URL, f"synthetic-event:{self.spec.seed}:{event_id}"
+            )
+        )
+
+    def events(self) -> Iterator[dict]:
+        """
+        Yields the events one at a time, so large datasets are not held in memory
+        """
+        weights = [w for _, w in attribute_types]
+        kinds = [kind for kind, _ in attribute_types]
+        clusters = list(self.clusters.values())
+        for n, size in enumerate(self.sizes):
+            event_id = str(n + 1)
+            timestamp = self.end - self.rng.randrange(86400 * max(1, self.spec.days))
+            event_clusters = self.rng.sample(
+                clusters, min(len(clusters), self.spec.clusters_per_event)
+            )
+            tags = self.rng.sample(
+                self.tags, min(len(self.tags), self.spec.tags_per_event)
+            )
+            tags += [
+                {
+                    "id": str(len(self.tags) + int(self.cluster_ids[c["uuid"]])),
+                    "name": c["tag_name"],
+                    "colour": "#0088cc",
+                }
+                for c in event_clusters
+            ]
+            attributes = []
+            for kind in self.rng.choices(kinds, weights, k=size):
+                attributes.append(self.attribute(event_id, timestamp, *kind))
+            for a in self.rng.sample(
+                attributes, min(len(attributes), len(event_clusters))
+            ):
+                a["Galaxy"] = self.galaxies([self.rng.choice(event_clusters)])
+            related = self.rng.sample(
+                range(1, self.spec.events + 1),
+                min(self.spec.events, self.spec.related_events + 1),
+            )
+            yield {
+                "id": event_id,
+                "uuid": self.event_uuid(n + 1),
+                "info": self.event_info(n + 1),
+                "date": datetime.fromtimestamp(timestamp, timezone.utc)
+                .date()
+                .isoformat(),
+                "timestamp": str(timestamp),
+                "publish_timestamp": str(timestamp),
+                "published": True,
+                "analysis": "2",
+                "threat_level_id": str(self.rng.randrange(1, 5)),
+                "distribution": "1",
+                "org_id": "1",
+                "orgc_id": "1",
+                "attribute_count": str(size),
+                "Org": org,
+                "Orgc": org,
+                "Tag": tags,
+                "Galaxy": self.galaxies(event_clusters),
+                "Attribute": attributes,
+                "Object": self.objects(event_id, timestamp),
+                "RelatedEvent": [
+                    {
+                        "Event": {
+                            "id": str(r),
+                            "uuid": self.event_uuid(r),
+                            "info": self.event_info(r),
+                            "org_id": "1",
+                            "orgc_id": "1",
+                            "Orgc": org,
+                        }
+                    }
+                    for r in related
+                    if str(r) != event_id
+                ][: self.spec.related_events],
+            }
+
+
+def write_dataset(spec: DatasetSpec, output: str) -> None:
+    """
+    Writes the events, the object templates and the galaxy corpus of the spec in the fixtures layout
+    """
+    generator = DatasetGenerator(spec)
+    for directory in ("events", "object_templates"):
+        os.makedirs(os.path.join(output, directory), exist_ok=True)
+    for event in generator.events():
+        with open(os.path.join(output, "events", f"{event['id']}.json"), "w") as f:
+            json.dump({"Event": event}, f)
+    for template_id, template in object_templates().items():
+        with open(
+            os.path.join(output, "object_templates", f"{template_id}.json"), "w"
+        ) as f:
+            json.dump(template, f, indent=2)
+    with open(os.path.join(output, "galaxy_clusters.json"), "w") as f:
+        json.dump(generator.clusters, f)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", required=True)
+    for f in fields(DatasetSpec):
+        parser.add_argument(
+            "--" + f.name.replace("_", "-"), type=type(f.default), default=f.default
+        )
+    args = parser.parse_args()
+    write_dataset(
+        DatasetSpec(**{f.name: getattr(args, f.name) for f in fields(DatasetSpec)}),
+        args.output,
+    )
+
+
+if __name__ == "__main__":
+    main()
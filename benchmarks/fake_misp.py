@@ -0,0 +1,472 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""
+MISP stand-in server, serving the MISP API calls made by the transforms from fixture files.
+
+The fixtures are a directory of MISP events and object templates in the JSON format of the MISP API:
+
+    <fixtures>/events/<id>.json               {"Event": {... "Attribute": [...], "Object": [...], "Tag": [...]}}
+    <fixtures>/object_templates/<uuid>.json   {"ObjectTemplate": {...}, "ObjectTemplateElement": [...]}
+    <fixtures>/galaxy_clusters.json           {"<uuid>": {"value": ..., "type": ..., "tag_name": ...}}
+
+The galaxy clusters are not served: the transforms read them from a local copy of the MISP galaxies,
+install_galaxies() replaces it with the clusters of the fixtures so they do not download it.
+
+The latency, the size of the responses and the failures are configurable, on the command line or at runtime
+with POST /_fake/config, and GET /_fake/stats counts the calls by endpoint (POST /_fake/reset resets them):
+
+    python -m benchmarks.fake_misp --fixtures benchmarks/fixtures --port 8081 --latency-ms 50 --error-rate 0.01
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import shutil
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Optional
+
+from flask import Flask, jsonify, request
+from pymisp.api import describe_types
+
+misp_version = "2.5.0"
+default_fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+# keys of an event not returned by the event index and the metadata searches
+event_content_keys = ("Attribute", "Object", "ShadowAttribute")
+index_excluded_keys = event_content_keys + ("Tag", "Galaxy", "RelatedEvent")
+time_units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+@dataclass
+class FakeSettings:
+    # API key expected in the Authorization header, any key is accepted when empty
+    key: str = ""
+    # milliseconds added to each response, plus a random jitter up to jitter_ms
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    # share of the calls answered with an HTTP 500 error
+    error_rate: float = 0.0
+    # share of the calls answered after slow_ms instead, to reach the timeouts and deadlines
+    slow_rate: float = 0.0
+    slow_ms: float = 30000.0
+    # bytes of padding added to each returned attribute, to make the responses larger
+    pad_bytes: int = 0
+
+
+class FakeDataset:
+    """
+    Events and object templates of the fixtures, indexed for the searches
+    """
+
+    def __init__(self, fixtures: str):
+        self.events: dict = {}
+        self.templates: dict = {}
+        events_dir = os.path.join(fixtures, "events")
+        for name in sorted(os.listdir(events_dir)):
+            if name.endswith(".json"):
+                with open(os.path.join(events_dir, name)) as f:
+                    event = json.load(f)["Event"]
+                event.setdefault(
+                    "attribute_count", str(len(event.get("Attribute", [])))
+                )
+                self.events[str(event["id"])] = event
+        self.events_by_uuid = {e["uuid"]: e for e in self.events.values()}
+        self.objects = {
+            str(o["id"]): o for e in self.events.values() for o in e.get("Object", [])
+        }
+        templates_dir = os.path.join(fixtures, "object_templates")
+        if os.path.isdir(templates_dir):
+            for name in sorted(os.listdir(templates_dir)):
+                if name.endswith(".json"):
+                    with open(os.path.join(templates_dir, name)) as f:
+                        template = json.load(f)
+                    t = template["ObjectTemplate"]
+                    for key in (t["uuid"], t["name"], str(t.get("id", ""))):
+                        self.templates[key] = template
+        self.tags = {
+            t["name"]: t
+            for e in self.events.values()
+            for a in [e] + e.get("Attribute", [])
+            for t in a.get("Tag", [])
+        }
+
+    def event(self, event_id: str) -> Optional[dict]:
+        return self.events.get(str(event_id)) or self.events_by_uuid.get(event_id)
+
+
+def install_galaxies(fixtures: str) -> None:
+    """
+    Installs the galaxy clusters of the fixtures as the local copy of the galaxies used by the transforms,
+    it is then considered up to date for a day
+    """
+    from utils import galaxy_helper
+
+    shutil.copyfile(
+        os.path.join(fixtures, "galaxy_clusters.json"),
+        galaxy_helper.local_path_uuid_mapping,
+    )
+    galaxy_helper.galaxy_cluster_uuids = None
+
+
+def as_list(value: Any) -> list:
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value]
+    return [str(value)]
+
+
+def like(pattern: str, value: Any) -> bool:
+    """
+    Matches a value like MISP: case-insensitive, % is a wildcard
+    """
+    if value is None:
+        return False
+    if "%" not in pattern:
+        return pattern.casefold() == str(value).casefold()
+    regex = ".*".join(re.escape(part) for part in pattern.split("%"))
+    return re.fullmatch(regex, str(value), re.IGNORECASE | re.DOTALL) is not None
+
+
+def matches_any(patterns: list, values: list) -> bool:
+    return any(like(p, v) for p in patterns for v in values)
+
+
+def since(timestamp: Any) -> Optional[int]:
+    """
+    Returns the epoch of a timestamp filter: an epoch or a relative time like 30d
+    """
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, (list, tuple)):
+        timestamp = timestamp[0]
+    text = str(timestamp)
+    if text[-1:] in time_units and text[:-1].isdigit():
+        return int(time.time()) - int(text[:-1]) * time_units[text[-1]]
+    return int(float(text))
+
+
+def page_of(items: list, query: dict) -> list:
+    limit = int(query.get("limit") or 0)
+    if not limit:
+        return items
+    page = int(query.get("page") or 1)
+    return items[(page - 1) * limit : page * limit]
+
+
+def truthy(value: Any) -> bool:
+    return str(value).lower() in ("1", "true")
+
+
+def attribute_matches(attribute: dict, event: dict, query: dict) -> bool:
+    if query.get("value") is not None:
+        values = [attribute.get("value")] + str(attribute.get("value", "")).split("|")
+        if not matches_any(as_list(query["value"]), values):
+            return False
+    if query.get("type") is not None and attribute.get("type") not in as_list(
+        query["type"]
+    ):
+        return False
+    if query.get("category") is not None and attribute.get("category") not in as_list(
+        query["category"]
+    ):
+        return False
+    if query.get("to_ids") is not None and truthy(attribute.get("to_ids")) != truthy(
+        query["to_ids"]
+    ):
+        return False
+    if query.get("tags") is not None:
+        tags = [t["name"] for t in attribute.get("Tag", []) + event.get("Tag", [])]
+        if not matches_any(as_list(query["tags"]), tags):
+            return False
+    return True
+
+
+def event_matches(event: dict, query: dict) -> bool:
+    if query.get("eventid") is not None and not {
+        str(event["id"]),
+        event["uuid"],
+    } & set(as_list(query["eventid"])):
+        return False
+    if query.get("eventinfo") is not None and not like(
+        str(query["eventinfo"]), event.get("info")
+    ):
+        return False
+    if query.get("tags") is not None and not matches_any(
+        as_list(query["tags"]), [t["name"] for t in event.get("Tag", [])]
+    ):
+        return False
+    start = since(query.get("timestamp"))
+    if start is not None and int(event.get("timestamp", 0)) < start:
+        return False
+    return True
+
+
+def attribute_filters(query: dict) -> dict:
+    """
+    Returns the filters of an events search applying to the attributes of the events
+    """
+    return {
+        k: query[k]
+        for k in ("value", "type", "category", "to_ids")
+        if query.get(k) is not None
+    }
+
+
+def create_app(dataset: FakeDataset, settings: Optional[FakeSettings] = None) -> Flask:
+    """
+    Returns the Flask application of the MISP stand-in
+    """
+    settings = settings or FakeSettings()
+    app = Flask(__name__)
+    stats = Counter()
+    stats_lock = threading.Lock()
+
+    def padded(attribute: dict) -> dict:
+        if settings.pad_bytes:
+            attribute = {**attribute, "x_padding": "x" * settings.pad_bytes}
+        return attribute
+
+    def event_output(event: dict, query: dict) -> dict:
+        if truthy(query.get("metadata")):
+            return {k: v for k, v in event.items() if k not in event_content_keys}
+        filters = attribute_filters(query)
+        event = copy.copy(event)
+        event["Attribute"] = [
+            padded(a)
+            for a in event.get("Attribute", [])
+            if attribute_matches(a, event, filters)
+        ]
+        event["Object"] = [
+            {**o, "Attribute": [padded(a) for a in o.get("Attribute", [])]}
+            for o in event.get("Object", [])
+        ]
+        return event
+
+    def event_reference(event: dict) -> dict:
+        return {
+            k: event.get(k) for k in ("id", "uuid", "info", "orgc_id", "distribution")
+        }
+
+    @app.before_request
+    def misp_behaviour():
+        if request.path.startswith("/_fake/"):
+            return None
+        with stats_lock:
+            # the endpoints are counted without their ids
+            stats[re.sub(r"/view/[^/]+$", "/view", request.path)] += 1
+        if settings.key and request.headers.get("Authorization") != settings.key:
+            return jsonify(
+                {"name": "Authentication failed", "message": "Forbidden"}
+            ), 403
+        delay = settings.latency_ms + random.uniform(0, settings.jitter_ms)
+        if settings.slow_rate and random.random() < settings.slow_rate:
+            delay = settings.slow_ms
+        if delay:
+            time.sleep(delay / 1000)
+        if settings.error_rate and random.random() < settings.error_rate:
+            return jsonify(
+                {"name": "Internal error", "message": "Injected failure"}
+            ), 500
+        return None
+
+    def query_body() -> dict:
+        return request.get_json(silent=True) or {}
+
+    @app.route("/servers/getVersion", methods=["GET"])
+    def get_version():
+        return jsonify(
+            {"version": misp_version, "pymisp_recommended_version": misp_version}
+        )
+
+    @app.route("/servers/getPyMISPVersion.json", methods=["GET"])
+    def get_pymisp_version():
+        return jsonify({"version": misp_version})
+
+    @app.route("/users/view/me", methods=["GET"])
+    def get_user():
+        return jsonify(
+            {
+                "User": {
+                    "id": "1",
+                    "email": "admin@fake.misp",
+                    "org_id": "1",
+                    "role_id": "1",
+                },
+                "Role": {"id": "1", "name": "admin", "perm_site_admin": True},
+                "UserSetting": {},
+            }
+        )
+
+    @app.route("/attributes/describeTypes.json", methods=["GET"])
+    def get_describe_types():
+        return jsonify({"result": describe_types})
+
+    @app.route("/events/restSearch", methods=["POST"])
+    def search_events():
+        query = query_body()
+        events = []
+        filters = attribute_filters(query)
+        for event in dataset.events.values():
+            if not event_matches(event, query):
+                continue
+            # events are found by their attributes, like MISP
+            if filters and not any(
+                attribute_matches(a, event, filters) for a in event.get("Attribute", [])
+            ):
+                continue
+            events.append(event)
+        return jsonify(
+            {
+                "response": [
+                    {"Event": event_output(e, query)} for e in page_of(events, query)
+                ]
+            }
+        )
+
+    @app.route("/attributes/restSearch", methods=["POST"])
+    def search_attributes():
+        query = query_body()
+        event_query = {k: query[k] for k in ("eventid", "timestamp") if k in query}
+        attributes = []
+        for event in dataset.events.values():
+            if not event_matches(event, event_query):
+                continue
+            reference = event_reference(event)
+            for a in event.get("Attribute", []):
+                if attribute_matches(a, event, query):
+                    attributes.append({**padded(a), "Event": reference})
+            for o in event.get("Object", []):
+                for a in o.get("Attribute", []):
+                    if attribute_matches(a, event, query):
+                        attributes.append({**padded(a), "Event": reference})
+        return jsonify({"response": {"Attribute": page_of(attributes, query)}})
+
+    @app.route("/objects/restSearch", methods=["POST"])
+    def search_objects():
+        query = query_body()
+        objects = [
+            {"Object": {**o, "Attribute": [padded(a) for a in o.get("Attribute", [])]}}
+            for event in dataset.events.values()
+            if event_matches(event, {k: query[k] for k in ("eventid",) if k in query})
+            for o in event.get("Object", [])
+        ]
+        return jsonify({"response": page_of(objects, query)})
+
+    @app.route("/events/index", methods=["POST"])
+    def search_index():
+        query = query_body()
+        index = [
+            {
+                **{k: v for k, v in e.items() if k not in index_excluded_keys},
+                "EventTag": [{"Tag": t} for t in e.get("Tag", [])],
+            }
+            for e in dataset.events.values()
+            if event_matches(e, query)
+        ]
+        return jsonify(page_of(index, query))
+
+    @app.route("/events/view/<event_id>", methods=["GET", "POST"])
+    def get_event(event_id: str):
+        event = dataset.event(event_id)
+        if event is None:
+            return jsonify({"name": "Invalid event", "message": "Invalid event"}), 404
+        return jsonify({"Event": event_output(event, query_body())})
+
+    @app.route("/objects/view/<object_id>", methods=["GET"])
+    def get_object(object_id: str):
+        o = dataset.objects.get(object_id)
+        if o is None:
+            return jsonify({"name": "Invalid object", "message": "Invalid object"}), 404
+        return jsonify({"Object": o})
+
+    @app.route("/objectTemplates/view/<template_id>", methods=["GET"])
+    def get_object_template(template_id: str):
+        template = dataset.templates.get(template_id)
+        if template is None:
+            return jsonify(
+                {
+                    "name": "Invalid object template",
+                    "message": "Invalid object template",
+                }
+            ), 404
+        return jsonify(template)
+
+    @app.route("/tags/search", methods=["POST"])
+    def search_tags():
+        name = str(query_body().get("name", ""))
+        return jsonify(
+            [{"Tag": t} for tag_name, t in dataset.tags.items() if like(name, tag_name)]
+        )
+
+    @app.route("/_fake/config", methods=["GET", "POST"])
+    def fake_config():
+        if request.method == "POST":
+            names = {f.name for f in fields(FakeSettings)}
+            changes = {}
+            for name, value in query_body().items():
+                if name in names:
+                    try:
+                        changes[name] = type(getattr(settings, name))(value)
+                    except (TypeError, ValueError):
+                        return jsonify(
+                            {"name": "Invalid setting", "message": f"{name}: {value!r}"}
+                        ), 400
+            for name, value in changes.items():
+                setattr(settings, name, value)
+        return jsonify(asdict(settings))
+
+    @app.route("/_fake/stats", methods=["GET"])
+    def fake_stats():
+        with stats_lock:
+            return jsonify(dict(stats))
+
+    @app.route("/_fake/reset", methods=["POST"])
+    def fake_reset():
+        with stats_lock:
+            stats.clear()
+        return jsonify({})
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--fixtures", default=default_fixtures)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    for f in fields(FakeSettings):
+        parser.add_argument(
+            "--" + f.name.replace("_", "-"), type=type(f.default), default=f.default
+        )
+    args = parser.parse_args()
+    settings = FakeSettings(
+        **{f.name: getattr(args, f.name) for f in fields(FakeSettings)}
+    )
+    app = create_app(FakeDataset(args.fixtures), settings)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
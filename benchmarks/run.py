@@ -0,0 +1,530 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""
+End-to-end benchmark of the transforms: starts the MISP stand-in and the transform server (gunicorn, with each of
+the worker models to compare), then sends each registered transform concurrent requests through HTTP and reports
+its throughput, latency percentiles, MISP calls and entities per request, and the peak memory of the workers:
+
+    python -m benchmarks.run --attributes 100000 --events 100 --concurrency 16 --requests 200 --models sync,gthread,gevent
+
+The gunicorn worker models need gunicorn (and gevent), as installed in the Docker image.
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, fields
+from typing import Optional
+from xml.sax.saxutils import escape
+
+import requests
+
+from benchmarks.dataset import DatasetSpec, write_dataset
+from benchmarks.fake_misp import default_fixtures
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# gunicorn options of each worker model, and the modules it needs
+worker_models = {
+    "sync": (["-k", "sync"], ("gunicorn",)),
+    "gthread": (["-k", "gthread", "--threads", "8"], ("gunicorn",)),
+    "gevent": (["-k", "gevent"], ("gunicorn", "gevent")),
+}
+# input entity of the transforms accepting any entity
+input_overrides = {
+    "searchinmisp": "maltego.misp.MISPEvent",
+    "attributetoevent": "maltego.IPv4Address",
+}
+# events, attributes, objects and clusters of the fixtures the transforms are run on
+sample_size = 20
+
+
+@dataclass
+class TransformResult:
+    transform: str
+    requests: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    latencies: list = field(default_factory=list, repr=False)
+    misp_calls: int = 0
+    entities: int = 0
+    peak_rss_mb: Optional[float] = None
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(
+                latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1
+            )
+
+        return {
+            "transform": self.transform,
+            "requests": self.requests,
+            "errors": self.errors,
+            "throughput": round(self.requests / self.seconds, 2)
+            if self.seconds
+            else None,
+            "p50_ms": percentile(0.50),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "misp_calls": round(self.misp_calls / self.requests, 2)
+            if self.requests
+            else None,
+            "entities": round(self.entities / self.requests, 1)
+            if self.requests
+            else None,
+            "peak_rss_mb": self.peak_rss_mb,
+        }
+
+
+class FixtureSample:
+    """
+    Values of the fixtures to run the transforms on
+    """
+
+    def __init__(self, fixtures: str):
+        names = sorted(
+            (
+                n
+                for n in os.listdir(os.path.join(fixtures, "events"))
+                if n.endswith(".json")
+            ),
+            key=lambda n: int(n[:-5]) if n[:-5].isdigit() else 0,
+        )
+        step = max(1, len(names) // sample_size)
+        self.events, self.ips, self.objects = [], [], []
+        for name in names[::step][:sample_size]:
+            with open(os.path.join(fixtures, "events", name)) as f:
+                event = json.load(f)["Event"]
+            self.events.append(event["id"])
+            self.ips += [
+                a["value"] for a in event.get("Attribute", []) if a["type"] == "ip-dst"
+            ][:1]
+            self.objects += [
+                {"event_id": event["id"], "uuid": o["uuid"], "name": o["name"]}
+                for o in event.get("Object", [])[:1]
+            ]
+        with open(os.path.join(fixtures, "galaxy_clusters.json")) as f:
+            self.clusters = list(json.load(f).values())[:sample_size]
+
+    def entities(self, input_entity: str) -> list:
+        """
+        Returns the (entity type, value, properties) the transforms of the input entity are run on
+        """
+        if input_entity == "maltego.misp.MISPEvent":
+            return [(input_entity, event_id, {}) for event_id in self.events]
+        if input_entity == "maltego.misp.MISPGalaxy":
+            return [
+                (
+                    input_entity,
+                    c["value"],
+                    {"uuid": c["uuid"], "tag": c["tag_name"], "name": c["value"]},
+                )
+                for c in self.clusters
+            ]
+        if input_entity == "maltego.misp.MISPObject":
+            return [(input_entity, o["name"], o) for o in self.objects]
+        return [(input_entity, ip, {}) for ip in self.ips]
+
+
+def transform_request(entity: tuple, misp_url: str, limit: int) -> str:
+    """
+    Returns the Maltego request XML of a transform run on the entity
+    """
+    entity_type, value, properties = entity
+    fields_xml = "".join(
+        f'<Field Name="{escape(k)}">{escape(str(v))}</Field>'
+        for k, v in properties.items()
+    )
+    return (
+        "<MaltegoMessage><MaltegoTransformRequestMessage><Entities>"
+        f'<Entity Type="{entity_type}"><Genealogy><Type Name="{entity_type}"/></Genealogy>'
+        f"<Value>{escape(str(value))}</Value><Weight>100</Weight>"
+        f"<AdditionalFields>{fields_xml}</AdditionalFields></Entity></Entities>"
+        f'<Limits SoftLimit="{limit}" HardLimit="{limit}"/><TransformFields>'
+        f'<Field Name="global#misp_instance_url">{escape(misp_url)}</Field>'
+        '<Field Name="global#misp_api_key">benchmark</Field>'
+        "</TransformFields></MaltegoTransformRequestMessage></MaltegoMessage>"
+    )
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url: str, process: subprocess.Popen, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(
+                f"{' '.join(process.args)} exited with {process.returncode}"
+            )
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not answer within {timeout} seconds")
+
+
+def stop(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def children(pid: int) -> list:
+    pids = []
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    # the parent pid follows the command name, which may contain spaces
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return pids
+
+
+def rss_mb(pids: list) -> float:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total / 1024
+
+
+class RssSampler:
+    """
+    Samples the memory of the workers of the transform server while a transform is benchmarked (Linux only)
+    """
+
+    def __init__(self, server_pid: int):
+        self.server_pid = server_pid
+        self.peak: Optional[float] = None
+        self.running = False
+
+    def __enter__(self):
+        if os.path.isdir("/proc"):
+            self.running = True
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.running:
+            self.running = False
+            self.thread.join()
+
+    def sample(self) -> None:
+        while self.running:
+            rss = rss_mb(children(self.server_pid))
+            self.peak = max(self.peak or 0, rss)
+            time.sleep(0.1)
+
+
+def benchmark_transform(
+    server_url: str,
+    misp_url: str,
+    server_pid: int,
+    name: str,
+    entities: list,
+    args: argparse.Namespace,
+) -> TransformResult:
+    """
+    Sends the requests of the transform, args.concurrency at a time, and measures them
+    """
+    result = TransformResult(name)
+    session = requests.Session()
+    session.mount(
+        "http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    )
+    bodies = [transform_request(e, misp_url, args.limit) for e in entities]
+    lock = threading.Lock()
+
+    def send(i: int, measured: bool = True) -> None:
+        start = time.perf_counter()
+        try:
+            response = session.post(
+                f"{server_url}run/{name}/",
+                data=bodies[i % len(bodies)],
+                timeout=args.timeout,
+            )
+            output = response.text
+            failed = (
+                response.status_code != 200 or 'MessageType="PartialError"' in output
+            )
+        except requests.RequestException:
+            output, failed = "", True
+        if measured:
+            with lock:
+                result.latencies.append(time.perf_counter() - start)
+                result.requests += 1
+                result.errors += failed
+                result.entities += output.count("<Entity ")
+
+    for i in range(args.warmup):
+        send(i, measured=False)
+    requests.post(f"{misp_url}_fake/reset")
+    with (
+        RssSampler(server_pid) as sampler,
+        ThreadPoolExecutor(args.concurrency) as pool,
+    ):
+        start = time.perf_counter()
+        list(pool.map(send, range(args.requests)))
+        result.seconds = time.perf_counter() - start
+    result.misp_calls = sum(requests.get(f"{misp_url}_fake/stats").json().values())
+    result.peak_rss_mb = round(sampler.peak, 1) if sampler.peak is not None else None
+    return result
+
+
+def benchmark_model(
+    model: str, fixtures: str, misp_url: str, cases: dict, args: argparse.Namespace
+) -> list:
+    """
+    Runs the transform server with the worker model and benchmarks each transform
+    """
+    options, _ = worker_models[model]
+    port = free_port()
+    metrics_dir = tempfile.mkdtemp(prefix="misp-benchmark-metrics-")
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            *options,
+            "--workers",
+            str(args.workers),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--timeout",
+            str(int(args.timeout)),
+            "project:application",
+        ],
+        cwd=root_dir,
+        env={**os.environ, "PROMETHEUS_MULTIPROC_DIR": metrics_dir},
+        stdout=subprocess.DEVNULL,
+        stderr=None if args.verbose else subprocess.DEVNULL,
+    )
+    server_url = f"http://127.0.0.1:{port}/"
+    try:
+        wait_for(server_url, server)
+        results = []
+        for name, entities in cases.items():
+            result = benchmark_transform(
+                server_url, misp_url, server.pid, name, entities, args
+            )
+            results.append({"model": model, **result.summary()})
+            print_row(results[-1])
+        return results
+    finally:
+        stop(server)
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+columns = (
+    ("model", 8),
+    ("transform", 26),
+    ("throughput", 10),
+    ("p50_ms", 9),
+    ("p95_ms", 9),
+    ("p99_ms", 9),
+    ("errors", 6),
+    ("misp_calls", 10),
+    ("entities", 8),
+    ("peak_rss_mb", 11),
+)
+
+
+def print_row(row: dict) -> None:
+    print(
+        "  ".join(
+            str(row[name] if row[name] is not None else "-").rjust(width)
+            for name, width in columns
+        ),
+        flush=True,
+    )
+
+
+def transform_cases(fixtures: str, selected: Optional[set]) -> dict:
+    """
+    Returns the entities to run each registered transform on
+    """
+    import transforms
+    from extensions import registry
+    from maltego_trx.registry import register_transform_classes
+
+    register_transform_classes(transforms)
+    sample = FixtureSample(fixtures)
+    cases = {}
+    for name, meta in sorted(registry.transform_metas.items()):
+        if selected and name not in selected:
+            continue
+        entities = sample.entities(input_overrides.get(name, meta.input_entity))
+        if entities:
+            cases[name] = entities
+    return cases
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--fixtures",
+        help="fixtures directory, generated from the dataset options when not set",
+    )
+    parser.add_argument(
+        "--models",
+        default=",".join(worker_models),
+        help=f"comma separated gunicorn worker models, of {', '.join(worker_models)}",
+    )
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument(
+        "--transforms", help="comma separated transform names, all of them when not set"
+    )
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--requests", type=int, default=50, help="measured requests per transform"
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=4, help="requests per transform before measuring"
+    )
+    parser.add_argument(
+        "--limit", type=int, default=256, help="slider limit of the requests"
+    )
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument(
+        "--latency-ms", type=float, default=20, help="latency of the MISP stand-in"
+    )
+    parser.add_argument("--output", help="JSON file the results are written to")
+    parser.add_argument(
+        "--verbose", action="store_true", help="show the logs of the servers"
+    )
+    for f in fields(DatasetSpec):
+        parser.add_argument(
+            "--" + f.name.replace("_", "-"), type=type(f.default), default=None
+        )
+    args = parser.parse_args()
+    models = [m for m in args.models.split(",") if m]
+    unknown = [m for m in models if m not in worker_models]
+    if unknown:
+        parser.error(
+            f"unknown worker models {', '.join(unknown)}, "
+            f"choose from {', '.join(worker_models)}"
+        )
+
+    dataset_options = {
+        f.name: getattr(args, f.name)
+        for f in fields(DatasetSpec)
+        if getattr(args, f.name) is not None
+    }
+    fixtures = args.fixtures or default_fixtures
+    generated = None
+    if dataset_options and not args.fixtures:
+        generated = fixtures = tempfile.mkdtemp(prefix="misp-benchmark-fixtures-")
+        print(f"Generating the dataset {dataset_options} in {fixtures}", flush=True)
+        write_dataset(DatasetSpec(**dataset_options), fixtures)
+
+    for model in list(models):
+        missing = [
+            m for m in worker_models[model][1] if importlib.util.find_spec(m) is None
+        ]
+        if missing:
+            print(
+                f"Skipping the {model} workers, {', '.join(missing)} is not installed",
+                flush=True,
+            )
+            models.remove(model)
+
+    from utils import galaxy_helper
+    from benchmarks.fake_misp import install_galaxies
+
+    # the local copy of the galaxies is replaced by the fixture clusters during the benchmark,
+    # and restored (or removed when there was none) afterwards so the transforms do not use the fixtures
+    saved_galaxies = None
+    if os.path.exists(galaxy_helper.local_path_uuid_mapping):
+        saved_galaxies = galaxy_helper.local_path_uuid_mapping + ".benchmark"
+        shutil.copy2(galaxy_helper.local_path_uuid_mapping, saved_galaxies)
+    install_galaxies(fixtures)
+
+    misp_port = free_port()
+    misp_url = f"http://127.0.0.1:{misp_port}/"
+    misp = None
+    results = []
+    try:
+        misp = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.fake_misp",
+                "--fixtures",
+                fixtures,
+                "--port",
+                str(misp_port),
+                "--latency-ms",
+                str(args.latency_ms),
+            ],
+            cwd=root_dir,
+            stdout=subprocess.DEVNULL,
+            stderr=None if args.verbose else subprocess.DEVNULL,
+        )
+        wait_for(misp_url + "servers/getVersion", misp)
+        cases = transform_cases(
+            fixtures, set(args.transforms.split(",")) if args.transforms else None
+        )
+        print("  ".join(name.rjust(width) for name, width in columns), flush=True)
+        for model in models:
+            results += benchmark_model(model, fixtures, misp_url, cases, args)
+    finally:
+        if misp is not None:
+            stop(misp)
+        if saved_galaxies:
+            shutil.move(saved_galaxies, galaxy_helper.local_path_uuid_mapping)
+        elif os.path.exists(galaxy_helper.local_path_uuid_mapping):
+            os.remove(galaxy_helper.local_path_uuid_mapping)
+        if generated:
+            shutil.rmtree(generated, ignore_errors=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,51 @@ api_global_setting = TransformSetting(
     global_setting=True,
 )
 
+# attribute filters pushed down to the MISP search when expanding an event to attributes
+attribute_types_setting = TransformSetting(
+    "attribute_types",
+    "Attribute types (comma separated)",
+    setting_type="string",
+    default_value="",
+    optional=True,
+)
+attribute_categories_setting = TransformSetting(
+    "attribute_categories",
+    "Attribute categories (comma separated)",
+    setting_type="string",
+    default_value="",
+    optional=True,
+)
+to_ids_only_setting = TransformSetting(
+    "to_ids_only",
+    "Only attributes with the IDS flag",
+    setting_type="boolean",
+    default_value="false",
+    optional=True,
+)
+exclude_decayed_setting = TransformSetting(
+    "exclude_decayed",
+    "Exclude decayed attributes",
+    setting_type="boolean",
+    default_value="false",
+    optional=True,
+)
+attribute_filter_settings = [
+    attribute_types_setting,
+    attribute_categories_setting,
+    to_ids_only_setting,
+    exclude_decayed_setting,
+]
+
+# restricts the MISP searches to recent data, e.g. "30d", "12h", "2w" or a date like "2024-01-31"
+time_window_setting = TransformSetting(
+    "time_window",
+    "Only search data from the last (e.g. 30d) or since (YYYY-MM-DD)",
+    setting_type="string",
+    default_value="",
+    optional=True,
+)
+
 registry = TransformRegistry(
     owner="Maltego Technologies GmbH",
     author="Sangeeth <sb@maltego.com>",
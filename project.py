@@ -23,9 +23,20 @@ from extensions import registry
 from maltego_trx.handler import handle_run
 from maltego_trx.registry import register_transform_classes
 from maltego_trx.server import app as application
+from utils.admission import admission_middleware
+from utils.memory import register_memory_endpoints
+from utils.metrics import register_metrics_endpoint
+from utils.tracing import TracingMiddleware
 
 register_transform_classes(transforms)
 
+# transforms beyond the capacity of the worker are queued for a while, then rejected
+application.wsgi_app = admission_middleware(application.wsgi_app)
+# outermost, the time spent queued is part of the trace of the transform
+application.wsgi_app = TracingMiddleware(application.wsgi_app)
+register_metrics_endpoint(application)
+register_memory_endpoints(application)
+
 registry.write_transforms_config(include_output_entities=True)
 registry.write_settings_config()
 
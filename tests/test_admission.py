@@ -0,0 +1,93 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import threading
+import time
+
+from utils.admission import AdmissionController
+
+interactive = 1
+
+
+def queue_in_background(controller: AdmissionController, flow_key: tuple) -> list:
+    """
+    Runs admit in a thread, returns the list its result is appended to
+    """
+    result: list = []
+    threading.Thread(
+        target=lambda: result.append(controller.admit(flow_key, interactive)),
+        daemon=True,
+    ).start()
+    return result
+
+
+def wait_for_queued(controller: AdmissionController, queued: int) -> None:
+    deadline = time.monotonic() + 5
+    while controller.queued != queued:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_rejected_request_leaves_no_flow_and_slots_are_released():
+    controller = AdmissionController(1, 0, 0.1)
+    assert controller.admit(("a", "interactive"), interactive)
+    assert not controller.admit(("b", "interactive"), interactive)
+    assert not controller.flows
+
+    controller.release()
+    assert controller.in_flight == 0
+    assert controller.admit(("b", "interactive"), interactive)
+
+
+def test_queue_is_bounded_across_flows():
+    controller = AdmissionController(1, 2, 5, max_queued_per_flow=2)
+    assert controller.admit(("a", "interactive"), interactive)
+    first = queue_in_background(controller, ("b", "interactive"))
+    second = queue_in_background(controller, ("c", "interactive"))
+    wait_for_queued(controller, 2)
+
+    # the worker-wide bound applies even though this flow has nothing queued
+    assert not controller.admit(("d", "interactive"), interactive)
+
+    controller.release()
+    controller.release()
+    deadline = time.monotonic() + 5
+    while not (first and second):
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    assert first == [True] and second == [True]
+    assert controller.queued == 0
+
+
+def test_queue_is_bounded_per_flow():
+    controller = AdmissionController(1, 10, 5, max_queued_per_flow=1)
+    assert controller.admit(("a", "interactive"), interactive)
+    queued = queue_in_background(controller, ("b", "interactive"))
+    wait_for_queued(controller, 1)
+
+    assert not controller.admit(("b", "interactive"), interactive)
+    other = queue_in_background(controller, ("c", "interactive"))
+    wait_for_queued(controller, 2)
+
+    controller.release()
+    controller.release()
+    deadline = time.monotonic() + 5
+    while not (queued and other):
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    assert queued == [True] and other == [True]
@@ -0,0 +1,123 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import threading
+import time
+
+from utils.batching import BatchLoader
+from utils.request_context import check_deadline, request_scope
+from utils.resilience import MISPRequestError, MISPUnavailable
+
+
+def run_in_thread(function, deadline: float) -> list:
+    """
+    Runs the function in a thread within a request context with the deadline (seconds from now),
+    returns the list its result or exception is appended to
+    """
+    outcome: list = []
+
+    def run():
+        with request_scope(time.monotonic() + deadline):
+            try:
+                outcome.append(function())
+            except Exception as e:
+                outcome.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    outcome.append(thread)
+    return outcome
+
+
+def fetch_events(ids: list) -> dict:
+    time.sleep(0.05)
+    check_deadline()
+    return {event_id: {"Event": {"id": event_id}} for event_id in ids}
+
+
+def test_concurrent_lookups_are_fetched_in_one_call():
+    loader = BatchLoader("test", 0.05, 10)
+    fetched = []
+
+    def fetch(ids):
+        fetched.append(sorted(ids))
+        return fetch_events(ids)
+
+    first = run_in_thread(lambda: loader.load(("misp",), "1", fetch), 60)
+    second = run_in_thread(lambda: loader.load(("misp",), "2", fetch), 60)
+    first[0].join()
+    second[0].join()
+
+    assert fetched == [["1", "2"]]
+    assert first[1] == {"Event": {"id": "1"}}
+    assert second[1] == {"Event": {"id": "2"}}
+
+
+def test_follower_does_not_get_the_deadline_of_the_leader():
+    loader = BatchLoader("test", 0.05, 10)
+
+    leader = run_in_thread(lambda: loader.load(("misp",), "1", fetch_events), 0.001)
+    while ("misp",) not in loader.pending:
+        time.sleep(0.001)
+    follower = run_in_thread(lambda: loader.load(("misp",), "2", fetch_events), 60)
+    leader[0].join()
+    follower[0].join()
+
+    assert follower[1] == {"Event": {"id": "2"}}
+
+
+def test_a_rejected_batch_is_fetched_again_one_id_at_a_time():
+    loader = BatchLoader("test", 0.05, 10)
+    fetched = []
+
+    def fetch(ids):
+        fetched.append(sorted(ids))
+        if "bad" in ids:
+            raise MISPRequestError((403, {"message": "Invalid event id"}))
+        return fetch_events(ids)
+
+    good = run_in_thread(lambda: loader.load(("misp",), "1", fetch), 60)
+    while ("misp",) not in loader.pending:
+        time.sleep(0.001)
+    bad = run_in_thread(lambda: loader.load(("misp",), "bad", fetch), 60)
+    good[0].join()
+    bad[0].join()
+
+    assert good[1] == {"Event": {"id": "1"}}
+    assert isinstance(bad[1], MISPRequestError)
+    assert sorted(fetched) == [["1"], ["1", "bad"], ["bad"]]
+
+
+def test_an_unavailable_misp_fails_the_batch_without_fetching_again():
+    loader = BatchLoader("test", 0.05, 10)
+    fetched = []
+
+    def fetch(ids):
+        fetched.append(sorted(ids))
+        raise MISPUnavailable("MISP is unavailable")
+
+    first = run_in_thread(lambda: loader.load(("misp",), "1", fetch), 60)
+    while ("misp",) not in loader.pending:
+        time.sleep(0.001)
+    second = run_in_thread(lambda: loader.load(("misp",), "2", fetch), 60)
+    first[0].join()
+    second[0].join()
+
+    assert isinstance(first[1], MISPUnavailable)
+    assert isinstance(second[1], MISPUnavailable)
+    assert fetched == [["1", "2"]]
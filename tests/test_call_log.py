@@ -0,0 +1,29 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+from utils.call_log import normalized_filters
+
+
+def test_ids_given_as_numbers_or_strings_have_the_same_filters():
+    assert normalized_filters((), {"eventid": 1, "limit": 10}) == normalized_filters(
+        (), {"eventid": "1", "limit": "10"}
+    )
+    assert normalized_filters((), {"eventid": 1, "limit": 10}) == {
+        "eventid": "?",
+        "limit": "10",
+    }
@@ -0,0 +1,66 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import time
+
+import pytest
+
+from utils.concurrency import gen_responses_parallel
+from utils.misp_transform import MISPResponse
+from utils.request_context import BudgetExceeded, budget_message, request_scope
+
+
+def add_entities(response, prefix: str, count: int, delay: float = 0) -> None:
+    time.sleep(delay)
+    for i in range(count):
+        response.addEntity("maltego.Phrase", f"{prefix}{i}")
+
+
+def test_parallel_helpers_are_merged_in_the_order_of_the_calls():
+    response = MISPResponse()
+    with request_scope():
+        gen_responses_parallel(
+            response,
+            0,
+            (add_entities, {"prefix": "a", "count": 2, "delay": 0.05}),
+            (add_entities, {"prefix": "b", "count": 2}),
+        )
+    assert [e.value for e in response.entities] == ["a0", "a1", "b0", "b1"]
+
+
+def test_parallel_helpers_stop_at_the_slider_limit():
+    response = MISPResponse()
+    with request_scope():
+        gen_responses_parallel(
+            response,
+            3,
+            (add_entities, {"prefix": "a", "count": 2}),
+            (add_entities, {"prefix": "b", "count": 5, "delay": 0.05}),
+        )
+    assert [e.value for e in response.entities] == ["a0", "a1", "b0"]
+
+
+def test_entity_budget_stops_the_transform():
+    response = MISPResponse()
+    with request_scope() as context:
+        context.max_entities = 2
+        add_entities(response, "a", 2)
+        with pytest.raises(BudgetExceeded):
+            response.addEntity("maltego.Phrase", "a2")
+    assert len(response.entities) == 2
+    assert context.truncation == budget_message
@@ -0,0 +1,54 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import time
+
+import pytest
+
+from utils.limiter import AdaptiveLimiter
+from utils.request_context import DeadlineExceeded, deadline_message, request_scope
+
+
+def test_failed_calls_halve_the_limit():
+    limiter = AdaptiveLimiter(8, 32)
+    with pytest.raises(ConnectionError), limiter.slot("search"):
+        raise ConnectionError()
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_calls_stopped_by_the_deadline_leave_the_limit_unchanged():
+    limiter = AdaptiveLimiter(8, 32)
+    with pytest.raises(DeadlineExceeded), limiter.slot("search"):
+        raise DeadlineExceeded(deadline_message)
+    assert limiter.limit == 8
+    assert limiter.in_flight == 0
+
+
+def test_waiting_for_a_slot_stops_at_the_deadline():
+    limiter = AdaptiveLimiter(1, 1)
+    with limiter.slot("search"):
+        start = time.monotonic()
+        with (
+            request_scope(time.monotonic() + 0.05),
+            pytest.raises(DeadlineExceeded),
+            limiter.slot("search"),
+        ):
+            pass
+        assert time.monotonic() - start < 1
+    assert limiter.in_flight == 0
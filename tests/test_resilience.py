@@ -0,0 +1,63 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import time
+
+import pytest
+
+from utils.resilience import CircuitBreaker, MISPUnavailable
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("http://misp", max_failures=2, reset_seconds=60)
+    breaker.record_failure()
+    assert breaker.check() is None
+    breaker.record_failure()
+    with pytest.raises(MISPUnavailable):
+        breaker.check()
+
+
+def test_half_open_breaker_lets_a_single_trial_through():
+    breaker = CircuitBreaker("http://misp", max_failures=1, reset_seconds=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.check() is not None
+    with pytest.raises(MISPUnavailable):
+        breaker.check()
+    breaker.record_success()
+    assert breaker.check() is None
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = CircuitBreaker("http://misp", max_failures=1, reset_seconds=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    with breaker.guard():
+        breaker.record_failure()
+    with pytest.raises(MISPUnavailable):
+        breaker.check()
+
+
+def test_trial_stopped_by_an_unrelated_error_is_released():
+    breaker = CircuitBreaker("http://misp", max_failures=1, reset_seconds=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    with pytest.raises(KeyError), breaker.guard():
+        raise KeyError("id")
+    # the next call is the trial instead of the breaker staying half open forever
+    assert breaker.check() is not None
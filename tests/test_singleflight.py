@@ -0,0 +1,110 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import threading
+import time
+
+import pytest
+
+from utils.request_context import DeadlineExceeded, check_deadline, request_scope
+from utils.singleflight import SingleFlight, call_key
+
+
+def slow_call(delay: float = 0.05) -> dict:
+    time.sleep(delay)
+    check_deadline()
+    return {"Event": {"id": "1"}}
+
+
+def run_in_thread(function, deadline: float) -> list:
+    """
+    Runs the function in a thread within a request context with the deadline (seconds from now),
+    returns the list its result or exception is appended to
+    """
+    outcome: list = []
+
+    def run():
+        with request_scope(time.monotonic() + deadline):
+            try:
+                outcome.append(function())
+            except Exception as e:
+                outcome.append(e)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    outcome.append(thread)
+    return outcome
+
+
+def test_identical_calls_share_one_call_and_get_their_own_copy():
+    shared = SingleFlight("test")
+    key = call_key("http://misp", "key", "search", (), {"eventid": 1})
+    calls = []
+
+    def call():
+        calls.append(1)
+        return slow_call()
+
+    first = run_in_thread(lambda: shared.do(key, call), 60)
+    while key not in shared.calls:
+        time.sleep(0.001)
+    second = run_in_thread(lambda: shared.do(key, call), 60)
+    first[0].join()
+    second[0].join()
+
+    assert calls == [1]
+    assert first[1] == second[1] == {"Event": {"id": "1"}}
+    assert first[1] is not second[1]
+
+
+def test_follower_does_not_get_the_deadline_of_the_leader():
+    shared = SingleFlight("test")
+    key = call_key("http://misp", "key", "search", (), {"eventid": 1})
+
+    leader = run_in_thread(lambda: shared.do(key, slow_call), 0.001)
+    while key not in shared.calls:
+        time.sleep(0.001)
+    follower = run_in_thread(lambda: shared.do(key, slow_call), 60)
+    leader[0].join()
+    follower[0].join()
+
+    assert isinstance(leader[1], DeadlineExceeded)
+    assert follower[1] == {"Event": {"id": "1"}}
+
+
+def test_follower_stops_waiting_at_its_own_deadline():
+    shared = SingleFlight("test")
+    key = call_key("http://misp", "key", "search", (), {"eventid": 1})
+
+    leader = run_in_thread(lambda: shared.do(key, lambda: slow_call(0.5)), 60)
+    while key not in shared.calls:
+        time.sleep(0.001)
+    start = time.monotonic()
+    with request_scope(time.monotonic() + 0.05), pytest.raises(DeadlineExceeded):
+        shared.do(key, slow_call)
+    assert time.monotonic() - start < 0.4
+    leader[0].join()
+
+
+def test_ids_given_as_numbers_or_strings_are_the_same_call():
+    assert call_key("http://misp", "key", "search", (), {"eventid": 1}) == call_key(
+        "http://misp", "key", "search", (), {"eventid": "1"}
+    )
+    assert call_key("http://misp", "key", "search", (), {"eventid": [1, 2]}) == (
+        call_key("http://misp", "key", "search", (), {"eventid": ["1", "2"]})
+    )
@@ -16,13 +16,13 @@
  along with this program.  If not, see <https://www.gnu.org/licenses/>.
  """
 
-from extensions import registry
+from extensions import registry, time_window_setting
 
 from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
 
 from utils.attribute_to_event_helper import determine_run_type
-from maltego_trx.transform import DiscoverableTransform
-from utils.misp_connection import get_credentials_from_user
+from utils.misp_transform import MISPTransform
+from utils.misp_connection import get_credentials_from_user, get_time_window_from_user
 
 
 @registry.register_transform(
@@ -30,8 +30,9 @@ from utils.misp_connection import get_credentials_from_user
     input_entity="maltego.Unknown",
     description="Finds events based on attributes",
     output_entities=["maltego.misp.MISPEvent", "maltego.misp.MISPObject"],
+    settings=[time_window_setting],
 )
-class AttributeToEvent(DiscoverableTransform):
+class AttributeToEvent(MISPTransform):
     """This transform searches MISP Instance
     for a given attribute and returns events"""
 
@@ -44,6 +45,7 @@ class AttributeToEvent(DiscoverableTransform):
 
         # call the helper function to get the API_URL and API_KEY values
         api_url, api_key = get_credentials_from_user(request=request)
+        time_window = get_time_window_from_user(request=request, response=response)
 
         entity_type = request.Genealogy
 
@@ -56,4 +58,5 @@ class AttributeToEvent(DiscoverableTransform):
                 limit=limit,
                 api_url=api_url,
                 api_key=api_key,
+                time_window=time_window,
             )
@@ -16,12 +16,16 @@
  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from extensions import registry
+from extensions import registry, attribute_filter_settings
 
 from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
 
-from maltego_trx.transform import DiscoverableTransform
-from utils.misp_connection import get_credentials_from_user
+from utils.misp_transform import MISPTransform
+from utils.misp_connection import (
+    get_credentials_from_user,
+    get_attribute_filters_from_user,
+)
+from utils.concurrency import gen_responses_parallel
 from utils.event_to_attributes_helper import (
     gen_response_attributes,
     gen_response_objects,
@@ -35,11 +39,15 @@ from utils.event_to_attributes_helper import (
     input_entity="maltego.misp.MISPEvent",
     description="Expands an Event to Attributes, Objects, Tags, Galaxies",
     output_entities=["maltego.Unknown"],
+    settings=attribute_filter_settings,
 )
-class EventToAll(DiscoverableTransform):
+class EventToAll(MISPTransform):
     """This transform searches MISP Instance
     for a given event and returns tags, galaxies, attributes, and objects"""
 
+    # expands a whole event
+    priority = "bulk"
+
     @classmethod
     def create_entities(cls, request: MaltegoMsg, response: MaltegoTransform):
         # Get the value from the request
@@ -48,14 +56,33 @@ class EventToAll(DiscoverableTransform):
 
         # call the helper function to get the API_URL and API_KEY values
         api_url, api_key = get_credentials_from_user(request=request)
+        attribute_filters = get_attribute_filters_from_user(request=request)
 
-        gen_response_tags(input_val, limit, response, api_url=api_url, api_key=api_key)
-        gen_response_galaxies(
-            input_val, limit, response, api_url=api_url, api_key=api_key
-        )
-        gen_response_attributes(
-            input_val, limit, response, api_url=api_url, api_key=api_key
-        )
-        gen_response_objects(
-            input_val, limit, response, api_url=api_url, api_key=api_key
+        credentials = {"api_url": api_url, "api_key": api_key}
+
+        # the steps are independent, run their MISP calls concurrently
+        gen_responses_parallel(
+            response,
+            limit,
+            (
+                gen_response_tags,
+                {"input_val": input_val, "limit": limit, **credentials},
+            ),
+            (
+                gen_response_galaxies,
+                {"input_val": input_val, "limit": limit, **credentials},
+            ),
+            (
+                gen_response_attributes,
+                {
+                    "input_val": input_val,
+                    "limit": limit,
+                    "attribute_filters": attribute_filters,
+                    **credentials,
+                },
+            ),
+            (
+                gen_response_objects,
+                {"input_val": input_val, "limit": limit, **credentials},
+            ),
         )
@@ -20,9 +20,13 @@ from extensions import registry
 
 from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
 
-from maltego_trx.transform import DiscoverableTransform
+from utils.misp_transform import MISPTransform
 from utils.misp_connection import get_credentials_from_user
-from utils.event_to_attributes_helper import gen_response_galaxies
+from utils.event_to_attributes_helper import (
+    event_galaxies_to_entities,
+    gen_response_galaxies,
+    get_event_metadata_async,
+)
 
 
 @registry.register_transform(
@@ -31,7 +35,7 @@ from utils.event_to_attributes_helper import gen_response_galaxies
     description="From a MISPEvent to MISPGalaxies",
     output_entities=["maltego.Unknown"],
 )
-class EventToGalaxies(DiscoverableTransform):
+class EventToGalaxies(MISPTransform):
     """This transform searches MISP Instance
     for a given event and returns galaxies"""
 
@@ -47,3 +51,19 @@ class EventToGalaxies(DiscoverableTransform):
         gen_response_galaxies(
             input_val, limit, response, api_url=api_url, api_key=api_key
         )
+
+    @classmethod
+    async def create_entities_async(
+        cls, request: MaltegoMsg, response: MaltegoTransform
+    ):
+        # run as a coroutine by the ASGI entry point (asgi.py)
+        input_val = request.Value
+        limit = request.Slider
+
+        api_url, api_key = get_credentials_from_user(request=request)
+
+        event = await get_event_metadata_async(
+            input_val, limit, api_url=api_url, api_key=api_key
+        )
+        if event:
+            event_galaxies_to_entities(event, response)
@@ -20,7 +20,7 @@ from extensions import registry
 
 from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
 
-from maltego_trx.transform import DiscoverableTransform
+from utils.misp_transform import MISPTransform
 from utils.misp_connection import get_credentials_from_user
 from utils.event_to_attributes_helper import gen_response_objects
 
@@ -31,10 +31,13 @@ from utils.event_to_attributes_helper import gen_response_objects
     description="From a MISPEvent to MISPObjects",
     output_entities=["maltego.misp.MISPObject"],
 )
-class EventToObject(DiscoverableTransform):
+class EventToObject(MISPTransform):
     """This transform searches MISP Instance
     for a given event and returns objects"""
 
+    # expands a whole event
+    priority = "bulk"
+
     @classmethod
     def create_entities(cls, request: MaltegoMsg, response: MaltegoTransform):
         # Get the value from the request
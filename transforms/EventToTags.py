@@ -20,9 +20,16 @@ from extensions import registry
 
 from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
 
-from maltego_trx.transform import DiscoverableTransform
+from utils.misp_transform import MISPTransform
 from utils.misp_connection import get_credentials_from_user
-from utils.event_to_attributes_helper import gen_response_galaxies, gen_response_tags
+from utils.concurrency import gen_responses_parallel
+from utils.event_to_attributes_helper import (
+    event_galaxies_to_entities,
+    event_tags_to_entities,
+    gen_response_galaxies,
+    gen_response_tags,
+    get_event_metadata_async,
+)
 
 
 @registry.register_transform(
@@ -31,7 +38,7 @@ from utils.event_to_attributes_helper import gen_response_galaxies, gen_response
     description="Expands an Event to Tags and Galaxies",
     output_entities=["maltego.Unknown"],
 )
-class EventToTags(DiscoverableTransform):
+class EventToTags(MISPTransform):
     """This transform searches MISP Instance
     for a given event and returns tags"""
 
@@ -44,7 +51,36 @@ class EventToTags(DiscoverableTransform):
         # call the helper function to get the API_URL and API_KEY values
         api_url, api_key = get_credentials_from_user(request=request)
 
-        gen_response_galaxies(
-            input_val, limit, response, api_url=api_url, api_key=api_key
+        credentials = {"api_url": api_url, "api_key": api_key}
+
+        # the steps are independent, run their MISP calls concurrently
+        gen_responses_parallel(
+            response,
+            limit,
+            (
+                gen_response_galaxies,
+                {"input_val": input_val, "limit": limit, **credentials},
+            ),
+            (
+                gen_response_tags,
+                {"input_val": input_val, "limit": limit, **credentials},
+            ),
+        )
+
+    @classmethod
+    async def create_entities_async(
+        cls, request: MaltegoMsg, response: MaltegoTransform
+    ):
+        # run as a coroutine by the ASGI entry point (asgi.py)
+        input_val = request.Value
+        limit = request.Slider
+
+        api_url, api_key = get_credentials_from_user(request=request)
+
+        event = await get_event_metadata_async(
+            input_val, limit, api_url=api_url, api_key=api_key
         )
-        gen_response_tags(input_val, limit, response, api_url=api_url, api_key=api_key)
+        if event:
+            # a single metadata call gives both the galaxies and the tags
+            event_galaxies_to_entities(event, response)
+            event_tags_to_entities(event, response)
@@ -19,7 +19,7 @@
 from extensions import registry
 
 from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
-from maltego_trx.transform import DiscoverableTransform
+from utils.misp_transform import MISPTransform
 
 from utils.galaxy_helper import galaxy_to_transform
 
@@ -30,7 +30,7 @@ from utils.galaxy_helper import galaxy_to_transform
     description="Expands a Galaxy to Malware/Software/Tools",
     output_entities=["maltego.Software"],
 )
-class GalaxyToSoftware(DiscoverableTransform):
+class GalaxyToSoftware(MISPTransform):
     """This transform searches MISP Instance
     for a given galaxy and returns Malware/Software/Tools"""
 
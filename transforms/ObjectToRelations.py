@@ -21,7 +21,7 @@ from extensions import registry
 from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
 
 from utils.misp_data import object_to_attributes_helper
-from maltego_trx.transform import DiscoverableTransform
+from utils.misp_transform import MISPTransform
 from utils.misp_connection import get_credentials_from_user
 
 
@@ -31,7 +31,7 @@ from utils.misp_connection import get_credentials_from_user
     description="From MISP Object To Related Objects",
     output_entities=["maltego.Unknown"],
 )
-class ObjectToRelations(DiscoverableTransform):
+class ObjectToRelations(MISPTransform):
     """This transform searches MISP Instance
     for a given object and returns relations"""
 
@@ -16,13 +16,13 @@
  along with this program.  If not, see <https://www.gnu.org/licenses/>.
  """
 
-from extensions import registry
+from extensions import registry, time_window_setting
 
 from maltego_trx.maltego import MaltegoMsg, MaltegoTransform
 
 from utils.misp_data import misp_events_idinfo, misp_events_galaxy
-from maltego_trx.transform import DiscoverableTransform
-from utils.misp_connection import get_credentials_from_user
+from utils.misp_transform import MISPTransform
+from utils.misp_connection import get_credentials_from_user, get_time_window_from_user
 
 
 @registry.register_transform(
@@ -30,8 +30,9 @@ from utils.misp_connection import get_credentials_from_user
     input_entity="maltego.Unknown",
     description="Use % at the front/end for wildcard search",
     output_entities=["maltego.Unknown"],
+    settings=[time_window_setting],
 )
-class SearchInMISP(DiscoverableTransform):
+class SearchInMISP(MISPTransform):
     """This is a transform that searches MISP Instance for a given value
     It works for event ids, event infos, misp galaxy objects"""
 
@@ -49,6 +50,7 @@ class SearchInMISP(DiscoverableTransform):
 
         # call the helper function to get the API_URL and API_KEY values
         api_url, api_key = get_credentials_from_user(request=request)
+        time_window = get_time_window_from_user(request=request, response=response)
 
         # Gets the entity type in following format [{"Name": entity_type_name, "OldName": entity_type_old_name if entity_type_old_name else None}]
         entity_type = request.Genealogy
@@ -61,6 +63,7 @@ class SearchInMISP(DiscoverableTransform):
                 response=response,
                 api_url=api_url,
                 api_key=api_key,
+                time_window=time_window,
             )
         elif "MISPGalaxy" in entity_type[0].get(
             "Name", None
@@ -74,6 +77,7 @@ class SearchInMISP(DiscoverableTransform):
                         response=response,
                         api_url=api_url,
                         api_key=api_key,
+                        time_window=time_window,
                     )
                 if "hashtag" in entity_type[0].get("Name", None) or keyword:
                     misp_events_galaxy(
@@ -83,6 +87,7 @@ class SearchInMISP(DiscoverableTransform):
                         response=response,
                         api_url=api_url,
                         api_key=api_key,
+                        time_window=time_window,
                     )
             else:
                 misp_events_galaxy(
@@ -92,4 +97,5 @@ class SearchInMISP(DiscoverableTransform):
                     response=response,
                     api_url=api_url,
                     api_key=api_key,
+                    time_window=time_window,
                 )
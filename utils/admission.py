@@ -0,0 +1,234 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the admission control and fair scheduling of the transform requests of a worker"""
+
+import hashlib
+import io
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+from maltego_trx.maltego import MaltegoMsg
+from maltego_trx.registry import mapping
+from maltego_trx.server import get_exception_message
+
+from extensions import api_global_setting
+from utils import config
+from utils.metrics import transform_requests
+from utils.request_context import request_started
+from utils.tracing import span
+
+overloaded_message = (
+    "The transform server is overloaded, the transform was not run. "
+    "Please try again in a moment."
+)
+
+# share of the free slots given to a queue of each priority class of transforms
+priority_weights = {
+    "interactive": config.interactive_weight,
+    "bulk": config.bulk_weight,
+}
+
+
+class Ticket:
+    """
+    A queued transform request, granted once the scheduler gives it a slot
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class Flow:
+    """
+    The queued requests of an API key for a priority class
+    """
+
+    def __init__(self, weight: int, start: float):
+        self.weight = max(weight, 1)
+        self.waiters: deque = deque()
+        # virtual time of the next request of the flow, the flow with the lowest is served first
+        self.finish = start
+
+
+class AdmissionController:
+    """
+    Lets a bounded number of transforms run at once and queues the others by flow
+    (API key and priority class), a bounded number of requests in all and in each flow, for a bounded time.
+    Free slots are shared between the queued flows by weighted fair queuing:
+    every flow gets slots in proportion to the weight of its class, whatever the number of requests it sends,
+    so a machine running over thousands of entities does not starve the interactive transforms of the others.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queued: int,
+        max_wait: float,
+        max_queued_per_flow: Optional[int] = None,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.max_queued_per_flow = (
+            max_queued if max_queued_per_flow is None else max_queued_per_flow
+        )
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        # requests waiting in all the flows
+        self.queued = 0
+        self.flows: dict = {}
+        self.virtual_time = 0.0
+
+    def admit(self, flow_key: tuple, weight: int) -> bool:
+        """
+        Waits for a slot to run a transform, returns False when the request must be rejected
+        """
+        with self.lock:
+            if self.in_flight < self.max_in_flight and not self.flows:
+                self.in_flight += 1
+                return True
+            flow = self.flows.get(flow_key)
+            flow_queued = len(flow.waiters) if flow is not None else 0
+            # the flow is only created once the request is queued, a rejected request leaves no flow behind
+            if (
+                self.queued >= self.max_queued
+                or flow_queued >= self.max_queued_per_flow
+            ):
+                return False
+            if flow is None:
+                # a flow starts at the current virtual time, idle time is not saved up as credit
+                flow = self.flows[flow_key] = Flow(weight, self.virtual_time)
+            ticket = Ticket()
+            flow.waiters.append(ticket)
+            self.queued += 1
+            self.dispatch()
+
+        ticket.event.wait(self.max_wait)
+        with self.lock:
+            if ticket.granted:
+                return True
+            flow.waiters.remove(ticket)
+            self.queued -= 1
+            if not flow.waiters and self.flows.get(flow_key) is flow:
+                del self.flows[flow_key]
+            return False
+
+    def release(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            self.dispatch()
+
+    def dispatch(self) -> None:
+        """
+        Gives the free slots to the queued requests, called with the lock held
+        """
+        while self.in_flight < self.max_in_flight and self.flows:
+            flow_key, flow = min(self.flows.items(), key=lambda item: item[1].finish)
+            if not flow.waiters:
+                del self.flows[flow_key]
+                continue
+            ticket = flow.waiters.popleft()
+            self.queued -= 1
+            self.virtual_time = flow.finish
+            flow.finish += 1 / flow.weight
+            if not flow.waiters:
+                del self.flows[flow_key]
+            ticket.granted = True
+            self.in_flight += 1
+            ticket.event.set()
+
+
+def request_flow(transform_name: str, body: bytes) -> tuple[tuple, int]:
+    """
+    Takes the transform name and the Maltego request, and returns the flow of the request
+    (hash of the API key from the transform settings, priority class) and its weight
+    """
+    try:
+        api_key = MaltegoMsg(body).getTransformSetting(api_global_setting.id) or ""
+    except Exception:
+        api_key = ""
+    key_scope = hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+    transform = mapping.get(transform_name)
+    priority = getattr(transform, "priority", "interactive")
+    return (key_scope, priority), priority_weights.get(priority, 1)
+
+
+class AdmissionMiddleware:
+    """
+    WSGI middleware running the transform requests (POST /run/...) through the admission controller,
+    the rejected requests get a Maltego message instead of waiting until they time out
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if environ.get("REQUEST_METHOD") != "POST" or not path.startswith("/run/"):
+            return self.app(environ, start_response)
+
+        token = request_started.set(time.monotonic())
+        try:
+            # the request is read here to find its API key, the application reads it again
+            length = environ.get("CONTENT_LENGTH")
+            body = environ["wsgi.input"].read(int(length) if length else -1)
+            environ["wsgi.input"] = io.BytesIO(body)
+            transform_name = path[len("/run/") :].strip("/").lower()
+            flow_key, weight = request_flow(transform_name, body)
+
+            with span("queue", flow=flow_key[1]):
+                admitted = self.controller.admit(flow_key, weight)
+            if not admitted:
+                if transform_name in mapping:
+                    transform_requests.labels(transform_name, "rejected").inc()
+                body = get_exception_message(overloaded_message).encode("utf-8")
+                start_response(
+                    "200 OK",
+                    [
+                        ("Content-Type", "text/html; charset=utf-8"),
+                        ("Content-Length", str(len(body))),
+                    ],
+                )
+                return [body]
+            try:
+                # the Flask response of a transform is built before it is returned
+                return self.app(environ, start_response)
+            finally:
+                self.controller.release()
+        finally:
+            request_started.reset(token)
+
+
+def admission_middleware(app) -> AdmissionMiddleware:
+    """
+    Wraps a WSGI application with the admission control configured for the worker
+    """
+    return AdmissionMiddleware(
+        app,
+        AdmissionController(
+            config.max_in_flight,
+            config.max_queued,
+            config.max_queue_wait,
+            config.max_queued_per_flow,
+        ),
+    )
@@ -19,17 +19,16 @@
 
 # Code blocks used with permission from here: https://github.com/MISP/MISP-maltego/blob/master/src/MISP_maltego/transforms/common/util.py
 # Courtesy Christophe Vandeplas
-from typing import Optional, List, Dict
+from datetime import datetime
+from typing import Optional, List, Dict, Union
 
 from maltego_trx.maltego import MaltegoTransform
 
-from utils.misp_query import MISPQuery
+from utils.misp_query import MISPQuery, generate_entity_details_idinfo
 from utils.misp_data import (
     event_to_entity,
     misp_events_idinfo,
-    get_attribute_in_event,
-    get_attribute_in_object,
-    object_to_entity_result,
+    object_to_entity,
     parse_output,
 )
 
@@ -42,6 +41,7 @@ def determine_run_type(
     limit: int,
     api_url: str,
     api_key: str,
+    time_window: Optional[Union[str, datetime]] = None,
 ) -> None:
     """
     Helper function takes inputs from the main transform entry file,
@@ -61,6 +61,7 @@ def determine_run_type(
             limit=limit,
             api_url=api_url,
             api_key=api_key,
+            time_window=time_window,
         )
     elif "MISPObject" in entity_type:
         object_name = property_val.get("mispobject") or input_val
@@ -75,6 +76,7 @@ def determine_run_type(
             limit=limit,
             api_url=api_url,
             api_key=api_key,
+            time_window=time_window,
         )
     elif "hashtag" in entity_type:
         hashtag_or_temp = property_val.get("temp") or input_val
@@ -86,6 +88,7 @@ def determine_run_type(
             limit=limit,
             api_url=api_url,
             api_key=api_key,
+            time_window=time_window,
         )
     else:
         attribute_to_event(
@@ -96,6 +99,7 @@ def determine_run_type(
             limit=limit,
             api_url=api_url,
             api_key=api_key,
+            time_window=time_window,
         )
 
 
@@ -107,6 +111,7 @@ def attribute_to_event(
     limit: int,
     api_url: str,
     api_key: str,
+    time_window: Optional[Union[str, datetime]] = None,
 ) -> Optional[MaltegoTransform]:
     """
     Takes the inputs from the main helper function, invokes the data helpers.
@@ -122,6 +127,7 @@ def attribute_to_event(
             limit=limit,
             api_url=api_url,
             api_key=api_key,
+            time_window=time_window,
         )
 
     # from Object
@@ -134,6 +140,7 @@ def attribute_to_event(
                     response=response,
                     api_url=api_url,
                     api_key=api_key,
+                    time_window=time_window,
                 )
         except ValueError:
             return misp_events_idinfo(
@@ -142,6 +149,7 @@ def attribute_to_event(
                 response=response,
                 api_url=api_url,
                 api_key=api_key,
+                time_window=time_window,
             )
 
     # from Hashtag
@@ -154,25 +162,43 @@ def attribute_to_event(
                 limit=limit,
                 api_url=api_url,
                 api_key=api_key,
+                time_window=time_window,
             )
 
     # standard Entities (normal attributes)
     else:
-        misp_query = MISPQuery(api_url=api_url, api_key=api_key)
-        events_json = misp_query.misp_value(
-            event_type="value", event_val=input_val, limit=limit
+        misp_query = MISPQuery(
+            api_url=api_url, api_key=api_key, time_window=time_window
         )
+        # search the attributes instead of the events, only the event and object ids
+        # of the matching attributes are needed, not the full events
+        event_ids = []
+        # object id -> event id
+        object_ids = {}
+        for a in misp_query.attribute_search(input_val, limit=0):
+            # stop requesting pages once there are enough events and objects for the slider
+            if limit and len(event_ids) + len(object_ids) >= limit:
+                break
+            # the value is part of an object
+            if a.get("object_id", "0") != "0":
+                if a["object_id"] not in object_ids:
+                    object_ids[a["object_id"]] = a["event_id"]
+            # the value is an attribute of the event
+            elif a["event_id"] not in event_ids:
+                event_ids.append(a["event_id"])
 
         # return the MISPEvent or MISPObject of the attribute
-        for e in events_json:
-            # find the value as attribute
-            attr = get_attribute_in_event(e, input_val)
-            if attr:
-                event_to_entity(result=e, response=response)
-            # find the value as object
-            if "Object" in e["Event"]:
-                for o in e["Event"]["Object"]:
-                    if get_attribute_in_object(o=o, attribute_value=input_val).get(
-                        "value"
-                    ):
-                        object_to_entity_result(o=o, api_url=api_url, api_key=api_key)
+        if event_ids:
+            events_json = misp_query.event_metadata(
+                input_val=event_ids, limit=len(event_ids)
+            )
+            for row in generate_entity_details_idinfo(events_json):
+                event_to_entity(result=row, response=response)
+        if object_ids:
+            for o in misp_query.objects_by_id(object_ids, value=input_val):
+                object_to_entity(
+                    input_val=o,
+                    response=response,
+                    api_url=api_url,
+                    api_key=api_key,
+                )
@@ -0,0 +1,124 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the loader batching the event lookups of concurrent requests"""
+
+import copy
+import threading
+from typing import Any, Callable
+
+from utils import config
+from utils.metrics import count_cache
+from utils.request_context import OutputTruncated, wait_within_deadline
+from utils.resilience import MISPUnavailable, transient_errors
+
+
+class PendingBatch:
+    """
+    The ids requested during the window of a batch, and the results once it is fetched
+    """
+
+    def __init__(self):
+        # id -> number of callers waiting for it
+        self.ids: dict = {}
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results: dict = {}
+        self.error: BaseException | None = None
+
+
+class BatchLoader:
+    """
+    Collects the ids looked up by concurrent calls with the same group (instance, API key and parameters)
+    during a short window, and fetches them with a single call.
+    The first caller of a batch waits for the window and fetches it, the others wait for its results
+    within their own deadline, and fetch their id themselves if the first caller ran out of time or budget.
+    When MISP rejects a batch of several ids, each caller fetches its id alone so only the callers
+    of the id causing the error get it.
+    """
+
+    def __init__(self, name: str, window: float, max_batch_size: int):
+        # name of the loader in the cache metrics
+        self.name = name
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.lock = threading.Lock()
+        self.pending: dict = {}
+
+    def load(self, group: tuple, item_id: str, fetch: Callable[[list], dict]) -> Any:
+        """
+        Takes the group of the lookup, an id and the function fetching a list of ids
+        (returning a dictionary of results by id), and returns the result for the id, or None
+        """
+        with self.lock:
+            batch = self.pending.get(group)
+            leader = batch is None
+            if leader:
+                batch = self.pending[group] = PendingBatch()
+            batch.ids[item_id] = batch.ids.get(item_id, 0) + 1
+            if len(batch.ids) >= self.max_batch_size:
+                # the next lookups start a new batch
+                del self.pending[group]
+                batch.full.set()
+        count_cache(self.name, hit=not leader)
+
+        if leader:
+            self.dispatch(group, batch, fetch)
+        else:
+            wait_within_deadline(batch.done)
+        if batch.error is not None:
+            if self.fetch_alone(batch, leader):
+                return fetch([item_id]).get(item_id)
+            raise batch.error
+        result = batch.results.get(item_id)
+        # the helpers modify the results, callers of the same id get their own copy
+        if batch.ids[item_id] > 1:
+            return copy.deepcopy(result)
+        return result
+
+    def fetch_alone(self, batch: PendingBatch, leader: bool) -> bool:
+        """
+        Tells whether a caller of a failed batch fetches its id by itself
+        """
+        if isinstance(batch.error, OutputTruncated):
+            # the time or budget of the first caller ran out, the others have their own
+            return not leader
+        # MISP being down fails every id, fetching them one by one would only add load
+        if isinstance(batch.error, (MISPUnavailable,) + transient_errors):
+            return False
+        return isinstance(batch.error, Exception) and len(batch.ids) > 1
+
+    def dispatch(
+        self, group: tuple, batch: PendingBatch, fetch: Callable[[list], dict]
+    ) -> None:
+        batch.full.wait(self.window)
+        with self.lock:
+            if self.pending.get(group) is batch:
+                del self.pending[group]
+        try:
+            batch.results = fetch(list(batch.ids))
+        except BaseException as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+
+# shared by all the requests of the worker
+event_loader = BatchLoader(
+    "event_batch", config.batch_window_ms / 1000, config.batch_max_size
+)
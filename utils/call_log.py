@@ -0,0 +1,156 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the accounting of the MISP calls: each call made by MISPQuery is appended as a JSON line
+to MISP_CALL_LOG with its filters, HTTP status, response size, server and decoding times and number of results.
+
+The filters are normalized, the searched values are replaced by "?" so the calls can be grouped by the shape
+of their search. The slow calls (MISP_SLOW_CALL_MS) are logged with all their parameters.
+"""
+
+import json
+import logging
+import threading
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+from utils import config
+from utils.singleflight import normalized_param
+from utils.tracing import current_trace
+
+log = logging.getLogger(__name__)
+
+# filters whose values have few possible values, they are kept to tell the searches apart
+literal_filters = {
+    "controller",
+    "type_attribute",
+    "category",
+    "return_format",
+    "metadata",
+    "published",
+    "to_ids",
+    "with_attachments",
+    "include_decay_score",
+    "exclude_decayed",
+    "limit",
+    "page",
+    "last",
+}
+
+
+@dataclass
+class CallStats:
+    # HTTP status of the last response of the call
+    status: Optional[int] = None
+    bytes: int = 0
+    # seconds until MISP sent the headers of its responses, then to decode their JSON
+    server_time: float = 0.0
+    decode_time: float = 0.0
+
+
+# stats of the MISP call being made, filled by the PyMISP client
+current_call: ContextVar[Optional[CallStats]] = ContextVar(
+    "current_misp_call", default=None
+)
+call_log_lock = threading.Lock()
+
+
+def normalized_value(name: str, value: Any) -> Any:
+    # ids given as numbers or strings are the same filter, like for the shared calls
+    value = normalized_param(value)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (list, tuple, set)):
+        if name in literal_filters:
+            return sorted(str(v) for v in value)
+        return f"?[{len(value)}]"
+    return str(value) if name in literal_filters else "?"
+
+
+def normalized_filters(args: tuple, kwargs: dict) -> dict:
+    """
+    Returns the filters of a call without the searched values
+    """
+    filters = {
+        name: normalized_value(name, value)
+        for name, value in sorted(kwargs.items())
+        if value is not None
+    }
+    if args:
+        filters["args"] = f"?[{len(args)}]"
+    return filters
+
+
+def result_count(result: Any) -> int:
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        if "errors" in result:
+            return 0
+        # attribute searches wrap their results
+        if isinstance(result.get("Attribute"), list):
+            return len(result["Attribute"])
+        return 1
+    return 0
+
+
+def log_call(
+    method: str,
+    args: tuple,
+    kwargs: dict,
+    outcome: str,
+    duration: float,
+    stats: CallStats,
+    result: Any,
+) -> None:
+    """
+    Appends the call to the MISP call log
+    """
+    if not config.misp_call_log:
+        return
+    trace = current_trace.get()
+    slow = duration * 1000 >= config.slow_call_ms
+    record = {
+        "time": datetime.now(timezone.utc).isoformat(),
+        "request_id": trace.request_id if trace is not None else None,
+        "transform": trace.transform if trace is not None else None,
+        "method": method,
+        "controller": kwargs.get("controller"),
+        "filters": normalized_filters(args, kwargs),
+        "status": stats.status,
+        "outcome": outcome,
+        "bytes": stats.bytes,
+        "duration_ms": round(duration * 1000, 1),
+        "server_ms": round(stats.server_time * 1000, 1),
+        "decode_ms": round(stats.decode_time * 1000, 1),
+        "results": result_count(result),
+        "slow": slow,
+    }
+    if slow:
+        record["params"] = {
+            "args": normalized_param(args),
+            "kwargs": normalized_param(kwargs),
+        }
+    line = json.dumps(record, default=str) + "\n"
+    try:
+        with call_log_lock, open(config.misp_call_log, "a") as f:
+            f.write(line)
+    except OSError as e:
+        log.warning("Could not write the MISP call log %s: %s", config.misp_call_log, e)
@@ -0,0 +1,117 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides helpers to run the independent MISP calls of a transform concurrently"""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from maltego_trx.maltego import MaltegoTransform
+
+from utils import config
+from utils.misp_transform import MISPResponse
+from utils.profiling import run_profiled
+from utils.request_context import OutputTruncated
+
+# With the gevent workers (gunicorn -k gevent) the threading module is monkey patched,
+# so the threads of this pool are greenlets and the MISP calls cooperate with the event loop.
+# The calls run on the pool must not submit to it again, nested waits could exhaust it.
+executor = ThreadPoolExecutor(
+    max_workers=config.fan_out_workers, thread_name_prefix="misp-fan-out"
+)
+
+
+def run_parallel(*calls: tuple[Callable, dict]) -> list:
+    """
+    Takes (function, kwargs) pairs, runs them concurrently and returns their results
+    in the same order as the calls. The first exception raised by a call is raised again.
+    The calls run with a copy of the context of the request (its deadline), and under its profiler.
+    """
+    futures = [
+        executor.submit(
+            contextvars.copy_context().run, run_profiled, function, **kwargs
+        )
+        for function, kwargs in calls
+    ]
+    return [future.result() for future in futures]
+
+
+class SliderLimitReached(OutputTruncated):
+    """
+    Raised to stop a helper run by gen_responses_parallel whose further entities would be dropped
+    """
+
+
+class PartResponse(MISPResponse):
+    """
+    Response of a helper run by gen_responses_parallel. The helper is stopped once its entities and
+    those of the helpers before it fill the slider: the helpers before it only add entities, so its
+    further entities would be dropped from the merged output anyway
+    """
+
+    def __init__(self, limit: int, before: list):
+        super().__init__()
+        self.limit = limit
+        self.before = before
+
+    def addEntity(self, type=None, value=None):
+        if self.limit and (
+            len(self.entities) + sum(len(part.entities) for part in self.before)
+            >= self.limit
+        ):
+            raise SliderLimitReached()
+        return super().addEntity(type, value)
+
+
+def gen_responses_parallel(
+    response: MaltegoTransform, limit: int, *calls: tuple[Callable, dict]
+) -> None:
+    """
+    Takes the response and (helper, kwargs) pairs of gen_response helpers,
+    runs each helper with a response of its own and merges them into the response in the order of the calls,
+    so the output does not depend on which MISP call returned first.
+    Entities above the slider limit are dropped, like the helpers do when they run one after another,
+    and a helper stops once the entities before it fill the slider.
+    A helper running out of time or budget keeps the entities it built, the transform reports the truncation.
+    """
+    parts: list = []
+    for _ in calls:
+        parts.append(PartResponse(limit, list(parts)))
+    run_parallel(
+        *[
+            (run_until_truncated, {**kwargs, "helper": helper, "response": part})
+            for (helper, kwargs), part in zip(calls, parts, strict=True)
+        ]
+    )
+    for part in parts:
+        response.entities.extend(part.entities)
+        response.UIMessages.extend(part.UIMessages)
+        response.exceptions.extend(part.exceptions)
+    if limit:
+        del response.entities[limit:]
+
+
+def run_until_truncated(helper: Callable, **kwargs) -> None:
+    """
+    Runs a gen_response helper, stopping it without an error when the transform runs out of time or budget
+    """
+    try:
+        helper(**kwargs)
+    except OutputTruncated:
+        pass
@@ -0,0 +1,109 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the transform server tuning options, read from the environment or the .env file"""
+
+import os
+
+from dotenv import load_dotenv  # Import for loading environment variables
+
+load_dotenv()
+
+
+def env_int(name: str, default: int) -> int:
+    """
+    Returns the environment variable as an int, or the default when it is not set or invalid
+    """
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def env_float(name: str, default: float) -> float:
+    """
+    Returns the environment variable as a float, or the default when it is not set or invalid
+    """
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# events with more attributes than this are fetched page by page instead of at once
+large_event_threshold: int = env_int("MISP_LARGE_EVENT_THRESHOLD", 5000)
+# number of attributes or objects requested per page for those large events
+large_event_page_size: int = env_int("MISP_LARGE_EVENT_PAGE_SIZE", 1000)
+# maximum number of MISP calls of a single worker running concurrently for the multi-step transforms
+fan_out_workers: int = env_int("MISP_FAN_OUT_WORKERS", 32)
+# connections kept open to each MISP instance by the asyncio client of the ASGI entry point
+async_max_connections: int = env_int("MISP_ASYNC_MAX_CONNECTIONS", 100)
+# threads of the ASGI entry point running the transforms without a coroutine, like gunicorn --threads
+async_transform_threads: int = env_int("MISP_ASYNC_TRANSFORM_THREADS", 25)
+# event lookups arriving within this window are fetched together, 0 disables the batching
+batch_window_ms: int = env_int("MISP_BATCH_WINDOW_MS", 5)
+# maximum number of event ids fetched by one batch
+batch_max_size: int = env_int("MISP_BATCH_MAX_SIZE", 100)
+# concurrent MISP calls of a worker per MISP instance, adjusted between 1 and the maximum by the observed latency and errors
+initial_concurrency: int = env_int("MISP_INITIAL_CONCURRENCY", 8)
+max_concurrency: int = env_int("MISP_MAX_CONCURRENCY", 32)
+# PyMISP connections (one per MISP instance and API key) a worker keeps for reuse, the least recently used are dropped
+max_connections: int = env_int("MISP_MAX_CONNECTIONS", 32)
+# seconds to wait for MISP to accept a connection, and for each read of its response
+connect_timeout: float = env_float("MISP_CONNECT_TIMEOUT", 5.0)
+read_timeout: float = env_float("MISP_READ_TIMEOUT", 60.0)
+# times a search or lookup is retried after a connection error, a timeout or a MISP server error
+retries: int = env_int("MISP_RETRIES", 2)
+# consecutive failed calls after which the calls to a MISP instance fail fast, and for how many seconds
+breaker_failures: int = env_int("MISP_BREAKER_FAILURES", 5)
+breaker_reset_seconds: int = env_int("MISP_BREAKER_RESET_SECONDS", 30)
+# seconds a transform may run before it stops calling MISP and returns the entities found so far,
+# keep it below the transform timeout of the Maltego client
+transform_deadline: float = env_float("MISP_TRANSFORM_DEADLINE", 90.0)
+# entities a transform may build, and the estimated memory they may use, before its output is truncated
+max_entities: int = env_int("MISP_MAX_ENTITIES", 10000)
+max_response_mb: int = env_int("MISP_MAX_RESPONSE_MB", 64)
+# transforms a worker runs at once, the ones queued beyond it (in all, and per API key and priority class)
+# and how long they wait before being rejected
+max_in_flight: int = env_int("MISP_MAX_IN_FLIGHT", 25)
+max_queued: int = env_int("MISP_MAX_QUEUED", 50)
+max_queued_per_flow: int = env_int("MISP_MAX_QUEUED_PER_FLOW", 20)
+max_queue_wait: float = env_float("MISP_MAX_QUEUE_WAIT", 10.0)
+# share of the free slots given to each queue of interactive and of bulk transforms
+interactive_weight: int = env_int("MISP_INTERACTIVE_WEIGHT", 4)
+bulk_weight: int = env_int("MISP_BULK_WEIGHT", 1)
+# spans of the transforms appended as JSON lines to this file, and sent to this OTLP/HTTP collector
+# (e.g. http://localhost:4318/v1/traces), no export when they are empty
+trace_file: str = os.getenv("MISP_TRACE_FILE", "")
+trace_otlp_endpoint: str = os.getenv("MISP_TRACE_OTLP_ENDPOINT", "")
+# traces waiting to be sent to the collector, the others are dropped while it is slow or down
+trace_otlp_queue_size: int = env_int("MISP_TRACE_OTLP_QUEUE_SIZE", 100)
+# spans of a transform kept for the export, the time of the further spans is only added to their stage
+trace_max_spans: int = env_int("MISP_TRACE_MAX_SPANS", 1000)
+# share of the transforms run under the sampling profiler (0 to 1), their collapsed stacks are appended
+# to a file per transform in this directory; no profiling when it is not set
+profile_dir: str = os.getenv("MISP_PROFILE_DIR", "")
+profile_rate: float = env_float("MISP_PROFILE_RATE", 0.0)
+# milliseconds between two samples of the profiled transforms
+profile_interval_ms: float = env_float("MISP_PROFILE_INTERVAL_MS", 5.0)
+# token of the admin endpoints (/admin/...), sent in the X-Admin-Token header; they are disabled when it is not set
+admin_token: str = os.getenv("MISP_ADMIN_TOKEN", "")
+# file each MISP call is appended to as a JSON line (method, filters, status, size, times, results), disabled when empty
+misp_call_log: str = os.getenv("MISP_CALL_LOG", "")
+# calls slower than this are logged with all their parameters, to find the searches MISP needs indexes for
+slow_call_ms: int = env_int("MISP_SLOW_CALL_MS", 2000)
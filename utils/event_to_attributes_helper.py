@@ -21,6 +21,7 @@
 # Courtesy Christophe Vandeplas
 from utils.misp_data import (
     MISPQuery,
+    entity_budget_reached,
     tag_matches_note_prefix,
     attribute_to_entity_details,
     event_to_entity,
@@ -29,7 +30,9 @@ from utils.misp_data import (
 )
 from utils.misp_query import (
     generate_entity_details_relations,
+    search_result_items,
 )
+from utils.misp_async import AsyncMISPQuery
 
 from maltego_trx.maltego import MaltegoTransform
 from maltego_trx.entities import Hashtag
@@ -37,6 +40,44 @@ from maltego_trx.entities import Hashtag
 from typing import Optional
 
 
+def event_tags_to_entities(
+    event: dict, response: MaltegoTransform, gen_response=True
+) -> list:
+    """
+    Takes the metadata of an event, sends back its tags and returns their names
+    """
+    event_tags = []
+    for t in event.get("Tag", []):
+        event_tags.append(t["name"])
+        if t["name"].startswith("misp-galaxy"):
+            continue
+        if tag_matches_note_prefix(t["name"]):
+            continue
+        if gen_response:
+            response.addEntity(Hashtag, t["name"])
+    return event_tags
+
+
+def event_galaxies_to_entities(event: dict, response: MaltegoTransform) -> None:
+    """
+    Takes the metadata of an event and sends back its galaxy clusters
+    """
+    for g in event.get("Galaxy", []):
+        for c in g["GalaxyCluster"]:
+            galaxycluster_to_entity(c, response=response)
+
+
+def event_relations_to_entities(event: dict, response: MaltegoTransform) -> None:
+    """
+    Takes the metadata of an event and sends back its related events
+    """
+    for e in event.get("RelatedEvent", []):
+        results = generate_entity_details_relations(e)
+        if results:
+            for row in results:
+                event_to_entity(result=row, response=response)
+
+
 def gen_response_tags(
     input_val: str,
     limit: int,
@@ -51,21 +92,11 @@ def gen_response_tags(
     misp_query = MISPQuery(api_url=api_url, api_key=api_key)
 
     if input_val:
-        event_json = misp_query.event_to_transform_details(
-            input_val=input_val, limit=limit
-        )
+        event_json = misp_query.event_metadata(input_val=input_val, limit=limit)
         if event_json:
-            event_tags = []
-            if "Tag" in event_json[0]["Event"]:
-                for t in event_json[0]["Event"]["Tag"]:
-                    event_tags.append(t["name"])
-                    if t["name"].startswith("misp-galaxy"):
-                        continue
-                    if tag_matches_note_prefix(t["name"]):
-                        continue
-                    if gen_response:
-                        response.addEntity(Hashtag, t["name"])
-            return event_tags
+            return event_tags_to_entities(
+                event_json[0]["Event"], response, gen_response=gen_response
+            )
 
 
 def gen_response_galaxies(
@@ -76,39 +107,38 @@ def gen_response_galaxies(
     """
     misp_query = MISPQuery(api_url=api_url, api_key=api_key)
     if input_val:
-        event_json = misp_query.event_to_transform_details(
-            input_val=input_val, limit=limit
-        )
-    for g in event_json[0]["Event"]["Galaxy"]:
-        for c in g["GalaxyCluster"]:
-            galaxycluster_to_entity(c, response=response)
+        event_json = misp_query.event_metadata(input_val=input_val, limit=limit)
+        if event_json:
+            event_galaxies_to_entities(event_json[0]["Event"], response)
     return None
 
 
 def gen_response_attributes(
-    input_val: str, limit: int, response: MaltegoTransform, api_url: str, api_key: str
+    input_val: str,
+    limit: int,
+    response: MaltegoTransform,
+    api_url: str,
+    api_key: str,
+    attribute_filters: Optional[dict] = None,
 ) -> Optional[MaltegoTransform]:
     """
-    Takes an input value, searches for the events, and sends back attributes
+    Takes an input value, searches for the events, and sends back attributes,
+    the attribute filters from the transform settings are applied by MISP
     """
     misp_query = MISPQuery(api_url=api_url, api_key=api_key)
     if input_val:
-        event_tags = gen_response_tags(
-            input_val=input_val,
-            limit=limit,
-            response=response,
-            gen_response=False,
-            api_url=api_url,
-            api_key=api_key,
-        )
-        event_json = misp_query.event_to_transform_details(
-            input_val=input_val, limit=limit
-        )
-        if event_json:
-            for a in event_json[0]["Event"]["Attribute"]:
-                attribute_to_entity_details(
-                    a=a, response=response, event_tags=event_tags
-                )
+        # the metadata gives the event tags and the size of the event
+        event_json = misp_query.event_metadata(input_val=input_val, limit=limit)
+        if not event_json:
+            return None
+        event = event_json[0]["Event"]
+        event_tags = [t["name"] for t in event.get("Tag", [])]
+        for a in misp_query.event_attributes(
+            input_val=input_val, event=event, limit=limit, **(attribute_filters or {})
+        ):
+            if entity_budget_reached(response, limit):
+                break
+            attribute_to_entity_details(a=a, response=response, event_tags=event_tags)
     return None
 
 
@@ -120,10 +150,14 @@ def gen_response_objects(
     """
     misp_query = MISPQuery(api_url=api_url, api_key=api_key)
     if input_val:
-        event_json = misp_query.event_to_transform_details(
-            input_val=input_val, limit=limit
-        )
-        for o in event_json[0]["Event"]["Object"]:
+        event_json = misp_query.event_metadata(input_val=input_val, limit=limit)
+        if not event_json:
+            return None
+        for o in misp_query.event_objects(
+            input_val=input_val, event=event_json[0]["Event"], limit=limit
+        ):
+            if entity_budget_reached(response, limit):
+                break
             object_to_entity(
                 input_val=o, response=response, api_url=api_url, api_key=api_key
             )
@@ -138,10 +172,25 @@ def gen_response_relations(
     Takes an input value, searches for the events, and sends back attributes
     """
     misp_query = MISPQuery(api_url=api_url, api_key=api_key)
-    event_json = misp_query.event_to_transform_details(input_val=input_val, limit=limit)
-    for e in event_json[0]["Event"]["RelatedEvent"]:
-        results = generate_entity_details_relations(e)
-        if results:
-            for row in results:
-                event_to_entity(result=row, response=response)
+    event_json = misp_query.event_metadata(input_val=input_val, limit=limit)
+    if not event_json:
+        return None
+    event_relations_to_entities(event_json[0]["Event"], response)
     return None
+
+
+async def get_event_metadata_async(
+    input_val: str, limit: int, api_url: str, api_key: str
+) -> Optional[dict]:
+    """
+    Takes an input value and returns the metadata of the event, awaited on the event loop
+    """
+    if not input_val:
+        return None
+    misp_query = AsyncMISPQuery(api_url=api_url, api_key=api_key)
+    event_json = search_result_items(
+        await misp_query.event_metadata(input_val=input_val, limit=limit)
+    )
+    if not event_json:
+        return None
+    return event_json[0]["Event"]
@@ -28,12 +28,15 @@ from typing import Optional
 from maltego_trx.maltego import MaltegoTransform
 
 from utils.mappings import mapping_galaxy_icon, mapping_galaxy_type
+from utils.metrics import count_cache
+from utils.tracing import traced
 
 local_path_root = os.path.join(tempfile.gettempdir(), "MISP-maltego")
 if not os.path.exists(local_path_root):
     os.mkdir(local_path_root)
 
 
+@traced("galaxy")
 def galaxycluster_to_cluster(cluster: dict) -> dict:
     """
     Takes in a dictionary loops through the items,
@@ -158,14 +161,12 @@ def search_galaxy_cluster(keyword: str) -> any:
     Takes a string, and yields a generator item of dict
     """
     keyword = keyword.lower()
-    global galaxy_cluster_uuids
-    if not galaxy_cluster_uuids:
-        galaxy_cluster_uuids = galaxy_load_cluster_mapping()
+    clusters = galaxy_cluster_mapping()
 
     # % only at start
     if keyword.startswith("%") and not keyword.endswith("%"):
         keyword = keyword.strip("%")
-        for item in galaxy_cluster_uuids.values():
+        for item in clusters.values():
             if item["value"].lower().endswith(keyword):
                 yield item
             else:
@@ -177,7 +178,7 @@ def search_galaxy_cluster(keyword: str) -> any:
     # % only at end
     elif keyword.endswith("%") and not keyword.startswith("%"):
         keyword = keyword.strip("%")
-        for item in galaxy_cluster_uuids.values():
+        for item in clusters.values():
             if item["value"].lower().startswith(keyword):
                 yield item
             else:
@@ -189,7 +190,7 @@ def search_galaxy_cluster(keyword: str) -> any:
     # search substring assuming % at start and end
     else:
         keyword = keyword.strip("%")
-        for item in galaxy_cluster_uuids.values():
+        for item in clusters.values():
             if keyword in item["value"].lower():
                 yield item
             else:
@@ -199,6 +200,7 @@ def search_galaxy_cluster(keyword: str) -> any:
                             yield item
 
 
+@traced("galaxy")
 def galaxy_load_cluster_mapping():
     """
     Updates the local copy of galaxies json file
@@ -209,28 +211,35 @@ def galaxy_load_cluster_mapping():
     return cluster_uuids
 
 
+def galaxy_cluster_mapping() -> dict:
+    """
+    Returns the galaxy clusters by uuid, loaded from the local copy on first use
+    """
+    global galaxy_cluster_uuids
+    count_cache("galaxy_clusters", hit=bool(galaxy_cluster_uuids))
+    if not galaxy_cluster_uuids:
+        galaxy_cluster_uuids = galaxy_load_cluster_mapping()
+    return galaxy_cluster_uuids
+
+
+@traced("galaxy")
 def get_galaxy_cluster(
     uuid: str = None, tag: str = None, request_entity: dict = None
 ) -> dict:
     """
     A way to get galaxy clusters with different input value types.
     """
-    global galaxy_cluster_uuids
-    if not galaxy_cluster_uuids:
-        galaxy_cluster_uuids = galaxy_load_cluster_mapping()
+    clusters = galaxy_cluster_mapping()
+    if not uuid and not tag and request_entity:
+        # the uuid of the entity is used first, then its tag, then its name
+        uuid = request_entity["uuid"]
+        tag = request_entity["tag_name"] or request_entity["name"]
     if uuid:
-        return galaxy_cluster_uuids.get(uuid)
+        return clusters.get(uuid)
     if tag:
-        for item in galaxy_cluster_uuids.values():
+        for item in clusters.values():
             if item["tag_name"] == tag:
                 return item
-    if request_entity:
-        if request_entity["uuid"]:
-            return get_galaxy_cluster(uuid=request_entity["uuid"])
-        if request_entity["tag_name"]:
-            return get_galaxy_cluster(tag=request_entity["tag_name"])
-        if request_entity["name"]:
-            return get_galaxy_cluster(tag=request_entity["name"])
 
 
 def galaxy_to_transform(
@@ -316,17 +325,16 @@ def get_galaxies_relating(uuid: str) -> any:
     Searches the galaxy clusters file for a given uuid
     returns a string
     """
-    global galaxy_cluster_uuids
-    if not galaxy_cluster_uuids:
-        galaxy_cluster_uuids = galaxy_load_cluster_mapping()
+    clusters = galaxy_cluster_mapping()
 
-    for item in galaxy_cluster_uuids.values():
+    for item in clusters.values():
         if "related" in item:
             for related in item["related"]:
                 if related["dest-uuid"] == uuid:
                     yield item
 
 
+@traced("build")
 def galaxycluster_to_entity(
     potential_cluster: dict, response: MaltegoTransform
 ) -> MaltegoTransform:
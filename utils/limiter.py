@@ -0,0 +1,132 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the adaptive concurrency limit of the MISP calls made to each MISP instance"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from utils import config
+from utils.request_context import OutputTruncated, check_deadline, remaining_time
+from utils.tracing import span
+
+# the calls are considered slow (MISP is overloaded) when their recent latency is this many times the baseline
+latency_tolerance = 2.0
+# weight of a call in the recent latency average
+recent_weight = 0.2
+# the baseline (latency of an unloaded MISP) follows faster calls quickly and slower calls slowly,
+# so it adapts to changes in the data without following the latency while MISP is overloaded
+baseline_down_weight = 0.5
+baseline_up_weight = 0.002
+
+
+class AdaptiveLimiter:
+    """
+    Limits the concurrent calls to a MISP instance, the limit is adjusted with AIMD:
+    it grows by one for every `limit` successful calls (additive increase),
+    and is halved when calls fail or get slow (multiplicative decrease), at most once per call duration
+    so the calls that were already running when MISP slowed down do not decrease it again.
+    The latencies are tracked by kind of call, a search of large events is not compared to an object lookup.
+    """
+
+    def __init__(self, initial_limit: int, max_limit: int, min_limit: int = 1):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        # kind of call -> [recent latency, baseline latency]
+        self.latencies: dict = {}
+        self.last_decrease = 0.0
+
+    @contextmanager
+    def slot(self, kind: str = "") -> Iterator[None]:
+        """
+        Waits for a free slot, within the deadline of the transform being run,
+        and records the latency and outcome of the call made with it
+        """
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                with span("throttle", limit=int(self.limit)):
+                    while self.in_flight >= int(self.limit):
+                        # gives up at the deadline of the transform instead of waiting for MISP
+                        if not self.condition.wait(remaining_time()):
+                            check_deadline()
+            self.in_flight += 1
+        start = time.monotonic()
+        failed: Optional[bool] = True
+        try:
+            yield
+            failed = False
+        except OutputTruncated:
+            # cut short by the deadline of the transform, it tells nothing about MISP
+            failed = None
+            raise
+        finally:
+            self.release(kind, time.monotonic() - start, failed)
+
+    def release(self, kind: str, latency: float, failed: Optional[bool]) -> None:
+        with self.condition:
+            self.in_flight -= 1
+            # a call stopped by the deadline leaves the limit as it is
+            if failed is not None:
+                if failed or self.is_slow(kind, latency):
+                    self.decrease(latency)
+                elif int(self.limit) < self.max_limit:
+                    self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            self.condition.notify_all()
+
+    def is_slow(self, kind: str, latency: float) -> bool:
+        latencies = self.latencies.get(kind)
+        if latencies is None:
+            self.latencies[kind] = [latency, latency]
+            return False
+        recent, baseline = latencies
+        recent += recent_weight * (latency - recent)
+        if latency < baseline:
+            baseline += baseline_down_weight * (latency - baseline)
+        else:
+            baseline += baseline_up_weight * (latency - baseline)
+        self.latencies[kind] = [recent, baseline]
+        return recent > latency_tolerance * baseline
+
+    def decrease(self, latency: float) -> None:
+        now = time.monotonic()
+        if now - self.last_decrease < latency:
+            return
+        self.last_decrease = now
+        self.limit = max(self.limit / 2, self.min_limit)
+
+
+limiters: dict = {}
+limiters_lock = threading.Lock()
+
+
+def instance_limiter(misp_url: str) -> AdaptiveLimiter:
+    """
+    Returns the limiter of a MISP instance, shared by all the requests of the worker
+    """
+    with limiters_lock:
+        limiter = limiters.get(misp_url)
+        if limiter is None:
+            limiter = limiters[misp_url] = AdaptiveLimiter(
+                config.initial_concurrency, config.max_concurrency
+            )
+        return limiter
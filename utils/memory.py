@@ -0,0 +1,259 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the admin endpoints tracking the memory allocations of a worker with tracemalloc.
+
+The allocations are grouped by module: the files of this repository (utils/galaxy_helper.py, ...),
+the installed packages (pymisp, maltego_trx, ...) and the modules of the standard library.
+An allocation made by the standard library (json, copy, ...) is attributed to the innermost frame
+of its traceback in this repository or an installed package, the code that asked for it.
+Each gunicorn worker traces its own allocations, the endpoints report the worker answering the request.
+"""
+
+import hmac
+import itertools
+import os
+import sysconfig
+import threading
+import tracemalloc
+from collections import OrderedDict
+from functools import wraps
+from typing import Optional
+
+from flask import abort, jsonify, request
+
+from utils import config
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+stdlib_dir = sysconfig.get_paths()["stdlib"]
+package_dirs = ("site-packages", "dist-packages")
+# allocations made by tracemalloc itself
+ignored = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+)
+
+# most frames kept per allocation, enough to find the caller of any allocation of the transforms
+max_frames = 100
+# snapshots kept to be compared, the oldest are dropped
+max_snapshots = 5
+snapshots: OrderedDict = OrderedDict()
+snapshots_lock = threading.Lock()
+snapshot_ids = itertools.count(1)
+
+
+def allocation_group(filename: str) -> str:
+    """
+    Returns the module an allocation belongs to: the path of a file of this repository,
+    the name of an installed package or the path of a module of the standard library
+    """
+    path = os.path.abspath(filename)
+    parts = path.split(os.sep)
+    for package_dir in package_dirs:
+        if package_dir in parts[:-1]:
+            package = parts[parts.index(package_dir) + 1]
+            return package[:-3] if package.endswith(".py") else package
+    if path.startswith(root_dir + os.sep):
+        return os.path.relpath(path, root_dir)
+    if path.startswith(stdlib_dir + os.sep):
+        return os.path.relpath(path, stdlib_dir)
+    return filename
+
+
+def allocation_site(frame: tracemalloc.Frame) -> str:
+    return f"{allocation_group(frame.filename)}:{frame.lineno}"
+
+
+def attributed_frame(traceback: tracemalloc.Traceback) -> tracemalloc.Frame:
+    """
+    Returns the innermost frame of the traceback in a file of this repository or an installed package,
+    or the innermost frame when there is none
+    """
+    # the frames go from the oldest to the most recent
+    for frame in reversed(traceback):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(root_dir + os.sep) or any(
+            package_dir in path.split(os.sep)[:-1] for package_dir in package_dirs
+        ):
+            return frame
+    return traceback[-1]
+
+
+def allocation_key(traceback: tracemalloc.Traceback, by: str) -> str:
+    frame = attributed_frame(traceback)
+    if by == "line":
+        return allocation_site(frame)
+    return allocation_group(frame.filename)
+
+
+def take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces(ignored)
+
+
+def top_allocations(snapshot: tracemalloc.Snapshot, by: str, limit: int) -> list:
+    """
+    Returns the largest allocations of the snapshot by module, or by line with by="line"
+    """
+    groups: dict = {}
+    for s in snapshot.statistics("traceback"):
+        group = groups.setdefault(
+            allocation_key(s.traceback, by),
+            {"size": 0, "count": 0},
+        )
+        group["size"] += s.size
+        group["count"] += s.count
+    return sorted(
+        ({"site": site, **group} for site, group in groups.items()),
+        key=lambda group: group["size"],
+        reverse=True,
+    )[:limit]
+
+
+def compare_allocations(
+    first: tracemalloc.Snapshot, second: tracemalloc.Snapshot, by: str, limit: int
+) -> list:
+    """
+    Returns the allocations growing or shrinking the most from the first snapshot to the second
+    """
+    groups: dict = {}
+    for s in second.compare_to(first, "traceback"):
+        group = groups.setdefault(
+            allocation_key(s.traceback, by),
+            {"size": 0, "size_diff": 0, "count_diff": 0},
+        )
+        group["size"] += s.size
+        group["size_diff"] += s.size_diff
+        group["count_diff"] += s.count_diff
+    return sorted(
+        ({"site": site, **group} for site, group in groups.items()),
+        key=lambda group: abs(group["size_diff"]),
+        reverse=True,
+    )[:limit]
+
+
+def stored_snapshot(snapshot_id: Optional[str]) -> tracemalloc.Snapshot:
+    with snapshots_lock:
+        snapshot = snapshots.get(snapshot_id)
+    if snapshot is None:
+        abort(404, description=f"No snapshot {snapshot_id}")
+    return snapshot
+
+
+def tracing_status() -> dict:
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "pid": os.getpid(),
+        "tracing": tracemalloc.is_tracing(),
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "snapshots": list(snapshots),
+    }
+
+
+def register_memory_endpoints(app) -> None:
+    """
+    Adds the /admin/memory endpoints to the Flask application of the transform server when MISP_ADMIN_TOKEN is set
+    """
+    if not config.admin_token:
+        return
+
+    def admin(view):
+        @wraps(view)
+        def guarded(*args, **kwargs):
+            token = request.headers.get("X-Admin-Token", "")
+            if not hmac.compare_digest(token.encode(), config.admin_token.encode()):
+                abort(403)
+            return view(*args, **kwargs)
+
+        return guarded
+
+    def tracing_required() -> None:
+        if not tracemalloc.is_tracing():
+            abort(409, description="Start tracing first: POST /admin/memory/start")
+
+    def query_options() -> tuple[str, int]:
+        return (
+            request.args.get("by", "module"),
+            request.args.get("limit", 20, type=int),
+        )
+
+    @app.route("/admin/memory", methods=["GET"])
+    @admin
+    def memory_status():
+        status = tracing_status()
+        if tracemalloc.is_tracing():
+            status["top"] = top_allocations(take_snapshot(), *query_options())
+        return jsonify(status)
+
+    @app.route("/admin/memory/start", methods=["POST"])
+    @admin
+    def memory_start():
+        # frames kept per allocation, more frames cost more memory and time
+        frames = request.args.get("frames", 1, type=int)
+        if not 1 <= frames <= max_frames:
+            abort(400, description=f"frames must be between 1 and {max_frames}")
+        tracemalloc.start(frames)
+        return jsonify(tracing_status())
+
+    @app.route("/admin/memory/stop", methods=["POST"])
+    @admin
+    def memory_stop():
+        tracemalloc.stop()
+        with snapshots_lock:
+            snapshots.clear()
+        return jsonify(tracing_status())
+
+    @app.route("/admin/memory/snapshots", methods=["POST"])
+    @admin
+    def memory_snapshot():
+        tracing_required()
+        snapshot = take_snapshot()
+        with snapshots_lock:
+            snapshot_id = str(next(snapshot_ids))
+            snapshots[snapshot_id] = snapshot
+            while len(snapshots) > max_snapshots:
+                snapshots.popitem(last=False)
+        return jsonify(
+            {
+                "id": snapshot_id,
+                "pid": os.getpid(),
+                "top": top_allocations(snapshot, *query_options()),
+            }
+        )
+
+    @app.route("/admin/memory/diff", methods=["GET"])
+    @admin
+    def memory_diff():
+        """
+        Compares the snapshot ?first= to ?second=, or to the current allocations
+        """
+        first = stored_snapshot(request.args.get("first"))
+        second_id = request.args.get("second")
+        if second_id is None:
+            tracing_required()
+            second = take_snapshot()
+        else:
+            second = stored_snapshot(second_id)
+        return jsonify(
+            {
+                "pid": os.getpid(),
+                "diff": compare_allocations(first, second, *query_options()),
+            }
+        )
@@ -0,0 +1,115 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the Prometheus metrics of the transforms, the MISP calls and the caches.
+
+With several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty directory writable by the workers,
+the metrics of all the workers are then aggregated by the /metrics endpoint of any of them.
+"""
+
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+
+latency_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+size_buckets = (1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+entity_buckets = (0, 1, 5, 10, 50, 100, 500, 1_000, 5_000, 10_000)
+
+transform_requests = Counter(
+    "misp_transform_requests_total",
+    "Transform requests by registered transform name and outcome",
+    ["transform", "outcome"],
+)
+transform_duration = Histogram(
+    "misp_transform_duration_seconds",
+    "Time to run a transform",
+    ["transform"],
+    buckets=latency_buckets,
+)
+transform_entities = Histogram(
+    "misp_transform_entities",
+    "Entities returned by a transform",
+    ["transform"],
+    buckets=entity_buckets,
+)
+misp_calls = Counter(
+    "misp_calls_total",
+    "Calls made to MISP by MISPQuery operation and outcome",
+    ["operation", "outcome"],
+)
+misp_call_duration = Histogram(
+    "misp_call_duration_seconds",
+    "Time of a call to MISP, including the JSON decoding",
+    ["operation"],
+    buckets=latency_buckets,
+)
+misp_response_bytes = Histogram(
+    "misp_response_bytes",
+    "Size of the MISP responses",
+    ["operation"],
+    buckets=size_buckets,
+)
+traces_dropped = Counter(
+    "misp_traces_dropped_total",
+    "Traces not sent to the OTLP collector as its queue was full",
+)
+cache_requests = Counter(
+    "misp_cache_requests_total",
+    "Lookups of the caches and shared calls (connections, singleflight, batching, galaxy clusters) by result",
+    ["cache", "result"],
+)
+cache_evictions = Counter(
+    "misp_cache_evictions_total",
+    "Entries dropped from the bounded caches (connections) to stay within their size",
+    ["cache"],
+)
+
+
+def count_cache(cache: str, hit: bool) -> None:
+    cache_requests.labels(cache, "hit" if hit else "miss").inc()
+
+
+def metrics_output() -> tuple[bytes, str]:
+    """
+    Returns the metrics in the Prometheus text format and its content type
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def register_metrics_endpoint(app) -> None:
+    """
+    Adds the /metrics endpoint to the Flask application of the transform server
+    """
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        output, content_type = metrics_output()
+        return output, 200, {"Content-Type": content_type}
@@ -0,0 +1,327 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides an asyncio MISP client, used by the transforms run as coroutines by the ASGI entry point"""
+
+import asyncio
+import json
+import time
+from datetime import date, datetime
+from typing import Any, Optional, Union
+from urllib.parse import urljoin
+
+import httpx
+from pymisp.exceptions import MISPServerError, NoKey, NoURL
+
+from utils import config
+from utils.call_log import CallStats, current_call, log_call
+from utils.metrics import misp_call_duration, misp_calls, misp_response_bytes
+from utils.misp_connection import misp_credentials, misp_verifycert
+from utils.request_context import (
+    DeadlineExceeded,
+    OutputTruncated,
+    capped_timeout,
+    check_deadline,
+    deadline_message,
+    deadline_reached,
+)
+from utils.resilience import (
+    instance_breaker,
+    retry_delay,
+    time_left_for,
+    transient_errors,
+)
+from utils.tracing import request_headers, span
+
+# one connection pool per MISP instance, shared by all the API keys
+async_clients: dict = {}
+
+
+def async_client(misp_url: str) -> httpx.AsyncClient:
+    """
+    Returns the pooled HTTP client of a MISP instance, creating it on first use
+    """
+    client = async_clients.get(misp_url)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            verify=misp_verifycert,
+            timeout=httpx.Timeout(config.read_timeout, connect=config.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=config.async_max_connections,
+                max_keepalive_connections=config.async_max_connections,
+            ),
+        )
+        async_clients[misp_url] = client
+    return client
+
+
+async def close_async_connections() -> None:
+    """
+    Closes the pooled HTTP clients, called when the ASGI application shuts down
+    """
+    for client in async_clients.values():
+        await client.aclose()
+    async_clients.clear()
+
+
+def make_timestamp(value: Any) -> Any:
+    """
+    Converts dates to the epoch timestamps MISP expects, like PyMISP does
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(make_timestamp(v) for v in value)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, date):
+        return int(datetime.combine(value, datetime.min.time()).timestamp())
+    return value
+
+
+def make_misp_bool(value: Optional[bool]) -> Optional[int]:
+    """
+    Converts booleans to the 0/1 flags MISP expects, like PyMISP does
+    """
+    if value is None:
+        return None
+    return 1 if value else 0
+
+
+class AsyncPyMISP:
+    """
+    Asyncio counterpart of the PyMISP calls used by MISPQuery,
+    takes the same parameters and returns the same JSON results
+    """
+
+    def __init__(self, url: str, key: str):
+        if not url:
+            raise NoURL("Please provide the URL of your MISP instance.")
+        if not key:
+            raise NoKey("Please provide your authorization key.")
+        self.root_url = url
+        self.key = key.strip()
+        self.client = async_client(url)
+        self.breaker = instance_breaker(url)
+        self.headers = {
+            "Authorization": self.key,
+            "Accept": "application/json",
+            "content-type": "application/json",
+            "User-Agent": "misp_maltego_trx (asyncio)",
+        }
+
+    async def _request(
+        self, method: str, url: str, data: Optional[dict] = None, retry: bool = False
+    ) -> Union[dict, list]:
+        """
+        Calls MISP unless its circuit breaker is open, the read-only calls (retry)
+        are retried after transient errors with a jittered delay
+        """
+        if data is not None:
+            # remove None values, like PyMISP
+            data = {k: v for k, v in data.items() if v is not None}
+        attempts = 1 + (config.retries if retry else 0)
+        for attempt in range(attempts):
+            check_deadline()
+            with self.breaker.guard():
+                try:
+                    with span("misp", method=method, url=url):
+                        response = await self.client.request(
+                            method,
+                            urljoin(self.root_url, url),
+                            headers=request_headers(self.headers),
+                            content=json.dumps(data) if data is not None else None,
+                            timeout=httpx.Timeout(
+                                capped_timeout(config.read_timeout),
+                                connect=capped_timeout(config.connect_timeout),
+                            ),
+                        )
+                        result = self._check_json_response(response)
+                except transient_errors as e:
+                    if deadline_reached():
+                        # the timeout was capped to the deadline of the transform, MISP may be fine
+                        raise DeadlineExceeded(deadline_message) from e
+                    self.breaker.record_failure()
+                    delay = retry_delay(attempt)
+                    if attempt + 1 >= attempts or not time_left_for(delay):
+                        raise
+                except OutputTruncated:
+                    # stopped by the transform itself, MISP may not have been called
+                    raise
+                except Exception:
+                    # MISP answered, the error is not about its health
+                    self.breaker.record_success()
+                    raise
+                else:
+                    self.breaker.record_success()
+                    return result
+            await asyncio.sleep(delay)
+
+    def _check_json_response(self, response: httpx.Response) -> Union[dict, list]:
+        stats = current_call.get()
+        if stats is not None:
+            stats.status = response.status_code
+            stats.bytes += len(response.content)
+            try:
+                stats.server_time += response.elapsed.total_seconds()
+            except RuntimeError:
+                # only set once httpx closed the stream of the response
+                pass
+        if response.status_code >= 500:
+            raise MISPServerError(f"Error code 500:\n{response.text}")
+        if 400 <= response.status_code < 500:
+            # the server returns a json message with the error details
+            try:
+                return {"errors": (response.status_code, response.json())}
+            except ValueError as e:
+                raise MISPServerError(
+                    f"Error code {response.status_code}:\n{response.text}"
+                ) from e
+        start = time.perf_counter()
+        with span("decode", bytes=len(response.content)):
+            result = response.json()
+        if stats is not None:
+            stats.decode_time += time.perf_counter() - start
+        if isinstance(result, dict) and result.get("response") is not None:
+            result = result["response"]
+        return result
+
+    async def search(
+        self,
+        controller: str = "events",
+        limit: Optional[int] = None,
+        page: Optional[int] = None,
+        value: Any = None,
+        type_attribute: Any = None,
+        category: Any = None,
+        tags: Any = None,
+        eventid: Any = None,
+        eventinfo: Optional[str] = None,
+        with_attachments: Optional[bool] = None,
+        metadata: Optional[bool] = None,
+        timestamp: Any = None,
+        to_ids: Any = None,
+        exclude_decayed: Optional[bool] = None,
+        **kwargs,
+    ) -> Union[dict, list]:
+        """
+        Searches the events, attributes or objects controller, see PyMISP.search
+        """
+        query = {
+            **kwargs,
+            "returnFormat": "json",
+            "limit": limit,
+            "page": page,
+            "value": value,
+            "type": type_attribute,
+            "category": category,
+            "tags": tags,
+            "eventid": eventid,
+            "eventinfo": eventinfo,
+            "withAttachments": make_misp_bool(with_attachments),
+            "metadata": make_misp_bool(metadata),
+            "timestamp": make_timestamp(timestamp),
+            "to_ids": to_ids,
+            "excludeDecayed": make_misp_bool(exclude_decayed),
+        }
+        return await self._request(
+            "POST", f"{controller}/restSearch", query, retry=True
+        )
+
+    async def search_index(self, timestamp: Any = None, **kwargs) -> Union[dict, list]:
+        """
+        Searches the event index (metadata only), see PyMISP.search_index
+        """
+        query = {**kwargs, "timestamp": make_timestamp(timestamp)}
+        return await self._request("POST", "events/index", query, retry=True)
+
+    async def direct_call(self, url: str, data: Optional[dict] = None) -> Any:
+        """
+        Calls any MISP endpoint, POST when data is given, GET otherwise
+        """
+        return await self._request("POST" if data else "GET", url, data)
+
+    async def get_event(self, event_id: Union[int, str]) -> dict:
+        return await self._request("GET", f"events/view/{event_id}", retry=True)
+
+    async def get_object(self, object_id: Union[int, str]) -> dict:
+        return await self._request("GET", f"objects/view/{object_id}", retry=True)
+
+    async def get_object_template(self, template: Union[int, str]) -> dict:
+        return await self._request(
+            "GET", f"objectTemplates/view/{template}", retry=True
+        )
+
+
+def async_misp_connection(misp_url=None, misp_key=None) -> AsyncPyMISP:
+    """
+    Returns an asyncio client for the MISP instance.
+
+    Checks for environment variables first, then falls back to Maltego transform settings.
+    """
+    misp_url, misp_key = misp_credentials(misp_url, misp_key)
+    return AsyncPyMISP(url=misp_url, key=misp_key)
+
+
+class AsyncMISPQuery:
+    """
+    Asyncio counterpart of MISPQuery for the transforms run as coroutines
+    """
+
+    def __init__(self, api_url: str, api_key: str):
+        self.misp = async_misp_connection(api_url, api_key)
+
+    async def call(self, method: str, *args, operation: str = "", **kwargs):
+        """
+        Awaits an AsyncPyMISP method, recording its metrics and call log entry like MISPQuery.limited_call
+        """
+        operation = operation or method
+        stats = CallStats()
+        token = current_call.set(stats)
+        start = time.monotonic()
+        outcome = "error"
+        result = None
+        try:
+            result = await getattr(self.misp, method)(*args, **kwargs)
+            outcome = (
+                "errors" if isinstance(result, dict) and "errors" in result else "ok"
+            )
+            return result
+        except DeadlineExceeded:
+            outcome = "deadline"
+            raise
+        finally:
+            duration = time.monotonic() - start
+            current_call.reset(token)
+            misp_calls.labels(operation, outcome).inc()
+            misp_call_duration.labels(operation).observe(duration)
+            misp_response_bytes.labels(operation).observe(stats.bytes)
+            log_call(method, args, kwargs, outcome, duration, stats, result)
+
+    async def event_metadata(self, input_val: Union[int, list], limit: int) -> dict:
+        """
+        Takes an event id (or a list of ids) and returns the events without
+        their attributes and objects, only the metadata (tags, galaxies, relations)
+        """
+        return await self.call(
+            "search",
+            controller="events",
+            eventid=input_val,
+            metadata=True,
+            with_attachments=False,
+            limit=limit,
+            operation="event_metadata",
+        )
@@ -19,16 +19,82 @@
 """Module provides a function to establish MISP Instance connection"""
 
 import os
-from typing import Any
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional, Union
 from dotenv import load_dotenv  # Import for loading environment variables
 
+from maltego_trx.maltego import UIM_PARTIAL, MaltegoTransform
 from pymisp import PyMISP
-from extensions import host_global_setting, api_global_setting
+from requests.adapters import HTTPAdapter
 
+from utils import config
+from utils.call_log import current_call
+from utils.metrics import cache_evictions, count_cache
+from utils.request_context import capped_timeout
+from utils.resilience import instance_breaker, transient_errors
+from utils.tracing import RequestIdAuth, span
+from extensions import (
+    host_global_setting,
+    api_global_setting,
+    attribute_types_setting,
+    attribute_categories_setting,
+    to_ids_only_setting,
+    exclude_decayed_setting,
+    time_window_setting,
+)
 
-def misp_connection(misp_url=None, misp_key=None):
+
+# Set to True if your MISP instance has a valid SSL certificate
+misp_verifycert: bool = False
+
+
+class MISPClient(PyMISP):
     """
-    Establishes a connection to the MISP instance.
+    PyMISP accounting the status, size and times of the MISP responses and tracing their decoding,
+    its timeouts are capped to the time left to the transform making the call
+    """
+
+    @property
+    def timeout(self) -> Optional[tuple[float, float]]:
+        if self._timeout is None:
+            return None
+        connect_timeout, read_timeout = self._timeout
+        return capped_timeout(connect_timeout), capped_timeout(read_timeout)
+
+    @timeout.setter
+    def timeout(self, timeout: Optional[tuple[float, float]]) -> None:
+        # the connection is shared by the requests, the timeouts given to PyMISP are kept as is
+        self._timeout = timeout
+
+    def _check_response(self, response, *args, **kwargs):
+        stats = current_call.get()
+        if stats is not None:
+            stats.status = response.status_code
+            stats.bytes += len(response.content)
+            stats.server_time += response.elapsed.total_seconds()
+        start = time.perf_counter()
+        try:
+            with span("decode", bytes=len(response.content)):
+                return super()._check_response(response, *args, **kwargs)
+        finally:
+            if stats is not None:
+                stats.decode_time += time.perf_counter() - start
+
+
+# PyMISP connections by (url, key), connecting makes several calls to MISP so they are reused by the requests.
+# The least recently used are dropped beyond config.max_connections, their session is released
+# once the requests still using them are done
+connections: OrderedDict = OrderedDict()
+connections_lock = threading.Lock()
+
+
+def misp_credentials(misp_url=None, misp_key=None) -> tuple[Any, Any]:
+    """
+    Returns the URL and API key to connect to the MISP instance with.
 
     Checks for environment variables first, then falls back to Maltego transform settings.
     """
@@ -37,29 +103,62 @@ def misp_connection(misp_url=None, misp_key=None):
     load_dotenv()  # Load environment variables
     misp_url_env: str | None = os.getenv("MISP_URL")
     misp_key_env: str | None = os.getenv("MISP_KEY")
-    misp_verifycert: bool = (
-        False  # Set to True if your MISP instance has a valid SSL certificate
-    )
-    misp_log: bool = False
 
     # If environment variables are present, use them
     if misp_url_env and misp_key_env:
         misp_url = misp_url_env
         misp_key = misp_key_env
         print("Using MISP credentials from environment variables.")
+    return (misp_url, misp_key)
 
-    # Connect to MISP using the obtained credentials
-    try:
-        misp = PyMISP(
-            url=misp_url,
-            key=misp_key,
-            ssl=misp_verifycert,
-            debug=misp_log,
-            tool="misp_maltego_trx",
-        )
+
+def misp_connection(misp_url=None, misp_key=None):
+    """
+    Establishes a connection to the MISP instance.
+
+    Checks for environment variables first, then falls back to Maltego transform settings.
+    """
+    misp_url, misp_key = misp_credentials(misp_url, misp_key)
+    with connections_lock:
+        misp = connections.get((misp_url, misp_key))
+        if misp is not None:
+            connections.move_to_end((misp_url, misp_key))
+    count_cache("connections", hit=misp is not None)
+    if misp is not None:
+        return misp
+
+    misp_log: bool = False
+    # fail fast while the instance is known to be down, connecting would wait for the timeouts
+    breaker = instance_breaker(misp_url)
+    with breaker.guard():
+        # Connect to MISP using the obtained credentials
+        try:
+            misp = MISPClient(
+                url=misp_url,
+                key=misp_key,
+                ssl=misp_verifycert,
+                debug=misp_log,
+                tool="misp_maltego_trx",
+                # sends the request id of the transform with each call
+                auth=RequestIdAuth(),
+                timeout=(config.connect_timeout, config.read_timeout),
+                # keep a connection open for each call the limiter lets run concurrently
+                https_adapter=HTTPAdapter(pool_maxsize=config.max_concurrency),
+            )
+        except Exception as e:
+            # PyMISP wraps the connection errors
+            if isinstance(e, transient_errors) or isinstance(
+                e.__context__, transient_errors
+            ):
+                breaker.record_failure()
+            raise ValueError(f"Error connecting to MISP: {e}") from e
+        breaker.record_success()
+    with connections_lock:
+        misp = connections.setdefault((misp_url, misp_key), misp)
+        while len(connections) > max(config.max_connections, 1):
+            connections.popitem(last=False)
+            cache_evictions.labels("connections").inc()
         return misp
-    except Exception as e:
-        raise ValueError(f"Error connecting to MISP: {e}") from e
 
 
 def get_credentials_from_user(request) -> tuple[Any, Any]:
@@ -69,3 +168,47 @@ def get_credentials_from_user(request) -> tuple[Any, Any]:
     api_url = request.getTransformSetting(host_global_setting.id)
     api_key = request.getTransformSetting(api_global_setting.id)
     return (api_url, api_key)
+
+
+def get_attribute_filters_from_user(request) -> dict:
+    """
+    Helper function to get the attribute filters from the transform settings from the user,
+    returns the matching MISP search parameters
+    """
+    filters = {}
+    types = request.getTransformSetting(attribute_types_setting.id)
+    if types:
+        filters["type_attribute"] = [t.strip() for t in types.split(",") if t.strip()]
+    categories = request.getTransformSetting(attribute_categories_setting.id)
+    if categories:
+        filters["category"] = [c.strip() for c in categories.split(",") if c.strip()]
+    if str(request.getTransformSetting(to_ids_only_setting.id)).lower() == "true":
+        filters["to_ids"] = 1
+    if str(request.getTransformSetting(exclude_decayed_setting.id)).lower() == "true":
+        filters["exclude_decayed"] = True
+    return filters
+
+
+def get_time_window_from_user(
+    request, response: Optional[MaltegoTransform] = None
+) -> Optional[Union[str, datetime]]:
+    """
+    Helper function to get the search time window from the transform settings from the user,
+    either a relative window understood by MISP (e.g. 30d, 12h, 2w) or a date.
+    An invalid window is ignored, the analyst is told so in the response
+    """
+    time_window = (request.getTransformSetting(time_window_setting.id) or "").strip()
+    if not time_window:
+        return None
+    if re.fullmatch(r"\d+[smhdw]", time_window):
+        return time_window
+    try:
+        return datetime.strptime(time_window, "%Y-%m-%d")
+    except ValueError:
+        if response is not None:
+            response.addUIMessage(
+                f"Ignored the time window '{time_window}': use a number of seconds, minutes, hours, "
+                "days or weeks (e.g. 30d, 2w) or a date (YYYY-MM-DD). All the data was searched.",
+                UIM_PARTIAL,
+            )
+        return None
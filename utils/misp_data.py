@@ -18,12 +18,16 @@
 
 # Code blocks used with permission from here: https://github.com/MISP/MISP-maltego/blob/master/src/MISP_maltego/transforms/common/util.py
 # Courtesy Christophe Vandeplas
+from datetime import datetime
 from typing import Union, Optional
 
 from maltego_trx.maltego import MaltegoTransform
 from maltego_trx.entities import Hashtag, URL, Person, Phrase
 
+from utils.concurrency import run_parallel
 from utils.misp_query import MISPQuery
+from utils.request_context import budget_reached, deadline_reached
+from utils.tracing import traced
 from utils.galaxy_helper import (
     search_galaxy_cluster,
     galaxycluster_to_cluster,
@@ -36,7 +40,12 @@ tag_note_prefixes = ["tlp:", "PAP:", "de-vs:", "euci:", "fr-classif:", "nato:",
 
 
 def misp_events_idinfo(
-    input_val: str, response: MaltegoTransform, limit: int, api_url: str, api_key: str
+    input_val: str,
+    response: MaltegoTransform,
+    limit: int,
+    api_url: str,
+    api_key: str,
+    time_window: Optional[Union[str, datetime]] = None,
 ) -> MaltegoTransform:
     """
     Main helper function for the MISP id and events to entity transforms
@@ -53,6 +62,7 @@ def misp_events_idinfo(
                 response=response,
                 api_url=api_url,
                 api_key=api_key,
+                time_window=time_window,
             )
             return response
     except ValueError:
@@ -66,6 +76,7 @@ def misp_events_idinfo(
             response=response,
             api_url=api_url,
             api_key=api_key,
+            time_window=time_window,
         )
         return response
 
@@ -77,11 +88,12 @@ def parse_output(
     limit: int,
     api_url: str,
     api_key: str,
+    time_window: Optional[Union[str, datetime]] = None,
 ) -> MaltegoTransform:
     """
     Helper function to invoke the correct MISP query function
     """
-    misp_query = MISPQuery(api_url, api_key)
+    misp_query = MISPQuery(api_url, api_key, time_window=time_window)
     if "eid" in etype:
         result = misp_query.misp_query_idinfo(
             event_type="id", event_val=int(input_val), limit=limit
@@ -104,6 +116,7 @@ def parse_output(
             event_to_entity(result=row, response=response)
 
 
+@traced("build")
 def event_to_entity(result: dict, response: MaltegoTransform) -> MaltegoTransform:
     """
     Helper function that takes a dictionary and builds a Maltego Entity
@@ -153,6 +166,18 @@ def tag_to_notes(tags: dict) -> str:
     return convert_tags_to_note([])
 
 
+def entity_budget_reached(response: MaltegoTransform, limit: int) -> bool:
+    """
+    Helper function to check if the response holds as many entities as the slider allows,
+    or if the transform ran out of time or budget and must return the entities built so far
+    """
+    return (
+        (bool(limit) and len(response.entities) >= limit)
+        or deadline_reached()
+        or budget_reached()
+    )
+
+
 def tag_matches_note_prefix(tag: str) -> bool:
     """
     Helper function to check for tags
@@ -170,153 +195,162 @@ def misp_events_galaxy(
     limit: int,
     api_url: str,
     api_key: str,
+    time_window: Optional[Union[str, datetime]] = None,
 ) -> MaltegoTransform:
     """
     Main helper function to search for galaxies based on events
     """
-    misp_query = MISPQuery(api_url=api_url, api_key=api_key)
-    potential_clusters = search_galaxy_cluster(input_val)
+    misp_query = MISPQuery(api_url=api_url, api_key=api_key, time_window=time_window)
+
+    @traced("galaxy")
+    def galaxy_search() -> list:
+        return list(search_galaxy_cluster(input_val))
+
+    def attribute_search() -> list:
+        # pages are only requested from MISP until the slider limit is reached
+        return list(misp_query.attribute_search(input_val, limit=limit))
+
+    # the galaxy or tag lookup and the attribute search are independent, run them concurrently
     if "MISPGalaxy" in entity_type:
-        if potential_clusters:
-            for potential_cluster in potential_clusters:
-                galaxycluster_to_entity(potential_cluster, response=response)
+        first_step = (galaxy_search, {})
     else:
-        result = misp_query.from_hashtag(input_val)
-        if result:
-            entity = response.addEntity(Hashtag, result)
-            entity.setBookmark(1)
+        first_step = (misp_query.from_hashtag, {"value": input_val})
+    result, attributes = run_parallel(first_step, (attribute_search, {}))
 
-    attr_json = misp_query.to_attribute(input_val, limit=limit)
-    for a in attr_json["Attribute"]:
+    if "MISPGalaxy" in entity_type:
+        for potential_cluster in result:
+            galaxycluster_to_entity(potential_cluster, response=response)
+    elif result:
+        entity = response.addEntity(Hashtag, result)
+        entity.setBookmark(1)
+
+    for a in attributes:
+        if entity_budget_reached(response, limit):
+            break
         attribute_to_entity_details(a, response=response, only_self=True)
 
 
+@traced("build")
 def attribute_to_entity_details(
-    a: dict, response: MaltegoTransform, event_tags: list = [], only_self=False
+    a: dict,
+    response: MaltegoTransform,
+    event_tags: Optional[list] = None,
+    only_self=False,
 ) -> MaltegoTransform:
-    # TODO Remove the empty list default declaration
-    """
-    if event_tags:
-        return event_tags
-    else:
-        return []
-    """
     """
     Takes a dictionary, and a list, returns Maltego Entities from MISP Attributes
     """
     # prepare some attributes to a better form
     a["data"] = None  # empty the file content as we really don't need this here
-    for k, v in a.items():
-        if a["type"] == "malware-sample":
-            a["type"] = "filename|md5"
-        if (
-            a["type"] == "regkey|value"
-        ):  # LATER regkey|value => needs to be a special non-combined object
-            a["type"] = "regkey"
-
-        combined_tags = event_tags
-        if "Galaxy" in a and not only_self:
-            for g in a["Galaxy"]:
-                for c in g["GalaxyCluster"]:
-                    cluster = galaxycluster_to_cluster(c)
-                    galaxycluster_to_entity(cluster, response)
-
-        # complement the event tags with the attribute tags.
-        if "Tag" in a and not only_self:
-            for t in a["Tag"]:
-                combined_tags.append(t["name"])
-                # ignore all misp-galaxies
-                if t["name"].startswith("misp-galaxy"):
-                    continue
-                # ignore all those we add as notes
-                if tag_matches_note_prefix(t["name"]):
-                    continue
-                else:
-                    response.addEntity(Hashtag, t["name"]).setBookmark(1)
-
-        notes = convert_tags_to_note(combined_tags)
-
-        # TODO Reduce redundancies further by way of another function(s) that could generate the dictionaries
-        # Or maybe adding the a['type'] to the mapping and call the same function depending on the type,
-        # along with using if or conditions for key value pairs
-        """
-        Example in mind
-        if a["type"] in entity_type_map/mapping
-        entity_type = entity_type_map[a["type"]]
-        display_value = a.get("comment") or "Label"
-        value = format_entity_value(a["type"], a["value"])
-        response.addEntity(entity_type, value)
-        """
-        # special cases
-        if a["type"] in ("url", "uri"):
-            value_dict = {
-                "entity_type": URL,
-                "entity_value": a["value"],
-                "display_value": a["value"],
-                "display_title": a["value"],
-                "entity_note": notes,
-                "bookmark": 1,
-            }
-            attribute_to_entity(value_dict, response)
-
-        # attribute is from an object, and a relation gives better understanding of the type of attribute
-        if a.get("object_relation") and mapping_misp_to_maltego.get(
-            a["object_relation"]
-        ):
-            entity_obj = mapping_misp_to_maltego[a["object_relation"]][0]
-            value_dict = {
-                "entity_type": entity_obj,
-                "entity_value": a["value"],
-                "display_value": a.get("comment"),
-                "display_title": "Label",
-                "entity_note": notes,
-                "bookmark": 1,
-            }
-            attribute_to_entity(value_dict, response)
-
-        # combined attributes
-        elif "|" in a["type"]:
-            t_1, t_2 = a["type"].split("|")
-            v_1, v_2 = a["value"].split("|")
-
-            for t, v, display in [(t_1, v_1, "hash"), (t_2, v_2, "filename")]:
-                if t in mapping_misp_to_maltego:
-                    entity_obj = mapping_misp_to_maltego[t][0]
-                    value_dict = {
-                        "entity_type": entity_obj,
-                        "entity_value": [v, t],
-                        "display_value": display,
-                        "display_title": v,
-                        "entity_note": notes,
-                        "bookmark": 1,
-                    }
-                    attribute_to_entity(value_dict, response)
-
-        # normal attributes
-        elif a["type"] in mapping_misp_to_maltego:
-            entity_obj = mapping_misp_to_maltego[a["type"]][0]
-            value_dict = {
-                "entity_type": entity_obj,
-                "entity_value": a["value"],
-                "entity_value_type": a["type"],
-                "display_value": a.get("comment"),
-                "display_title": "Comment",
-                "entity_note": notes,
-                "bookmark": 1,
-            }
-            attribute_to_entity(value_dict, response)
-
-        else:
-            value_dict = {
-                "entity_type": Phrase,
-                "entity_value": a["value"],
-                "entity_value_type": a["type"],
-                "display_value": a.get("comment"),
-                "display_title": "Comment",
-                "entity_note": notes,
-                "bookmark": 1,
-            }
-            attribute_to_entity(value_dict, response)
+    if a["type"] == "malware-sample":
+        a["type"] = "filename|md5"
+    if (
+        a["type"] == "regkey|value"
+    ):  # LATER regkey|value => needs to be a special non-combined object
+        a["type"] = "regkey"
+
+    # copy the event tags, the attribute tags must not leak into the next attribute
+    combined_tags = list(event_tags or [])
+    if "Galaxy" in a and not only_self:
+        for g in a["Galaxy"]:
+            for c in g["GalaxyCluster"]:
+                cluster = galaxycluster_to_cluster(c)
+                galaxycluster_to_entity(cluster, response)
+
+    # complement the event tags with the attribute tags.
+    if "Tag" in a and not only_self:
+        for t in a["Tag"]:
+            combined_tags.append(t["name"])
+            # ignore all misp-galaxies
+            if t["name"].startswith("misp-galaxy"):
+                continue
+            # ignore all those we add as notes
+            if tag_matches_note_prefix(t["name"]):
+                continue
+            else:
+                response.addEntity(Hashtag, t["name"]).setBookmark(1)
+
+    notes = convert_tags_to_note(combined_tags)
+
+    # TODO Reduce redundancies further by way of another function(s) that could generate the dictionaries
+    # Or maybe adding the a['type'] to the mapping and call the same function depending on the type,
+    # along with using if or conditions for key value pairs
+    """
+    Example in mind
+    if a["type"] in entity_type_map/mapping
+    entity_type = entity_type_map[a["type"]]
+    display_value = a.get("comment") or "Label"
+    value = format_entity_value(a["type"], a["value"])
+    response.addEntity(entity_type, value)
+    """
+    # special cases
+    if a["type"] in ("url", "uri"):
+        value_dict = {
+            "entity_type": URL,
+            "entity_value": a["value"],
+            "display_value": a["value"],
+            "display_title": a["value"],
+            "entity_note": notes,
+            "bookmark": 1,
+        }
+        attribute_to_entity(value_dict, response)
+
+    # attribute is from an object, and a relation gives better understanding of the type of attribute
+    if a.get("object_relation") and mapping_misp_to_maltego.get(a["object_relation"]):
+        entity_obj = mapping_misp_to_maltego[a["object_relation"]][0]
+        value_dict = {
+            "entity_type": entity_obj,
+            "entity_value": a["value"],
+            "display_value": a.get("comment"),
+            "display_title": "Label",
+            "entity_note": notes,
+            "bookmark": 1,
+        }
+        attribute_to_entity(value_dict, response)
+
+    # combined attributes
+    elif "|" in a["type"]:
+        t_1, t_2 = a["type"].split("|")
+        v_1, v_2 = a["value"].split("|")
+
+        for t, v, display in [(t_1, v_1, "hash"), (t_2, v_2, "filename")]:
+            if t in mapping_misp_to_maltego:
+                entity_obj = mapping_misp_to_maltego[t][0]
+                value_dict = {
+                    "entity_type": entity_obj,
+                    "entity_value": [v, t],
+                    "display_value": display,
+                    "display_title": v,
+                    "entity_note": notes,
+                    "bookmark": 1,
+                }
+                attribute_to_entity(value_dict, response)
+
+    # normal attributes
+    elif a["type"] in mapping_misp_to_maltego:
+        entity_obj = mapping_misp_to_maltego[a["type"]][0]
+        value_dict = {
+            "entity_type": entity_obj,
+            "entity_value": a["value"],
+            "entity_value_type": a["type"],
+            "display_value": a.get("comment"),
+            "display_title": "Comment",
+            "entity_note": notes,
+            "bookmark": 1,
+        }
+        attribute_to_entity(value_dict, response)
+
+    else:
+        value_dict = {
+            "entity_type": Phrase,
+            "entity_value": a["value"],
+            "entity_value_type": a["type"],
+            "display_value": a.get("comment"),
+            "display_title": "Comment",
+            "entity_note": notes,
+            "bookmark": 1,
+        }
+        attribute_to_entity(value_dict, response)
 
     # return None
 
@@ -339,7 +373,7 @@ def attribute_to_entity(
         entity.addProperty(
             fieldName="type",
             displayName="Entity Value Type",
-            value=entity_result["entity_value_type"],
+            value=entity_result.get("entity_value_type"),
         )
 
 
@@ -536,6 +570,7 @@ def object_to_entity_result(o: dict, api_url: str, api_key: str) -> dict:
         return result
 
 
+@traced("build")
 def object_to_entity(
     input_val: dict, api_url: str, api_key: str, response: MaltegoTransform
 ) -> MaltegoTransform:
@@ -661,7 +696,7 @@ def object_to_attributes_helper(
                         value=name["last_name"],
                     )
                     entity.setBookmark(1)
-            for entity in object_to_relations(
+            for _ in object_to_relations(
                 o=o, e=event_json, response=response, api_url=api_url, api_key=api_key
             ):
                 pass
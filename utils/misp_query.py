@@ -17,42 +17,267 @@
  along with this program.  If not, see <https://www.gnu.org/licenses/>.
  """
 
-from typing import Union
+import copy
+import time
+from datetime import datetime
+from typing import Iterator, Optional, Union
 
 from maltego_trx.maltego import MaltegoTransform
+from utils import config
+from utils.batching import event_loader
+from utils.call_log import CallStats, current_call, log_call
+from utils.limiter import instance_limiter
+from utils.metrics import (
+    misp_call_duration,
+    misp_calls,
+    misp_response_bytes,
+)
+from utils.request_context import (
+    DeadlineExceeded,
+    OutputTruncated,
+    check_deadline,
+    deadline_message,
+    deadline_reached,
+)
+from utils.resilience import (
+    MISPRequestError,
+    idempotent_methods,
+    instance_breaker,
+    retry_delay,
+    time_left_for,
+    transient_errors,
+)
 from utils.misp_connection import misp_connection
+from utils.singleflight import call_key, shared_calls
+from utils.tracing import span
 
 # Connect to MISP using the misp_connection
 # misp = misp_connection()
 
+# number of results requested per page by the paginated searches
+search_page_size = 100
+
 
 class MISPQuery:
-    def __init__(self, api_url: str, api_key: str):
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        time_window: Optional[Union[str, datetime]] = None,
+    ):
         # Connect to MISP using the misp_connection
         self.misp = misp_connection(api_url, api_key)
+        # only return results changed within this window (e.g. "30d" or a datetime)
+        self.time_window = time_window
+
+    def call(self, method: str, *args, operation: str = "", **kwargs):
+        """
+        Calls a PyMISP method, identical calls running concurrently in this worker
+        share one MISP request and its result.
+        All the MISP calls go through here, their metrics are labelled with the MISPQuery operation
+        making them (the PyMISP method when not given).
+        """
+        key = call_key(self.misp.root_url, self.misp.key, method, args, kwargs)
+        return shared_calls.do(
+            key, self.call_with_retries, operation or method, method, *args, **kwargs
+        )
+
+    def call_with_retries(self, operation: str, method: str, *args, **kwargs):
+        """
+        Calls a PyMISP method unless the circuit breaker of the MISP instance is open,
+        searches and lookups are retried after transient errors with a jittered delay
+        when the transform has time left for it
+        """
+        breaker = instance_breaker(self.misp.root_url)
+        attempts = 1 + (config.retries if method in idempotent_methods else 0)
+        for attempt in range(attempts):
+            check_deadline()
+            with breaker.guard():
+                try:
+                    result = self.limited_call(operation, method, *args, **kwargs)
+                except transient_errors:
+                    breaker.record_failure()
+                    delay = retry_delay(attempt)
+                    if attempt + 1 >= attempts or not time_left_for(delay):
+                        raise
+                except OutputTruncated:
+                    # stopped by the transform itself, MISP may not have been called
+                    raise
+                except Exception:
+                    # MISP answered, the error is not about its health
+                    breaker.record_success()
+                    raise
+                else:
+                    breaker.record_success()
+                    return result
+            time.sleep(delay)
+
+    def limited_call(self, operation: str, method: str, *args, **kwargs):
+        """
+        Calls a PyMISP method once the concurrency limit of the MISP instance allows it
+        """
+        controller = kwargs.get("controller", "")
+        kind = f"{method} {controller}"
+        with (
+            instance_limiter(self.misp.root_url).slot(kind),
+            span("misp", method=method, controller=controller),
+        ):
+            stats = CallStats()
+            token = current_call.set(stats)
+            start = time.monotonic()
+            outcome = "error"
+            result = None
+            try:
+                result = getattr(self.misp, method)(*args, **kwargs)
+                outcome = (
+                    "errors"
+                    if isinstance(result, dict) and "errors" in result
+                    else "ok"
+                )
+                return result
+            except transient_errors as e:
+                if deadline_reached():
+                    # the timeout was capped to the deadline of the transform, MISP may be fine
+                    outcome = "deadline"
+                    raise DeadlineExceeded(deadline_message) from e
+                raise
+            finally:
+                duration = time.monotonic() - start
+                current_call.reset(token)
+                misp_calls.labels(operation, outcome).inc()
+                misp_call_duration.labels(operation).observe(duration)
+                misp_response_bytes.labels(operation).observe(stats.bytes)
+                log_call(method, args, kwargs, outcome, duration, stats, result)
+
+    def load_event(
+        self,
+        event_id: Union[int, str],
+        limit: int,
+        operation: str = "load_event",
+        **params,
+    ) -> list:
+        """
+        Takes an event id and the search parameters, and returns the events search result for this event.
+        Lookups of single events with the same parameters arriving together are fetched with one search
+        on the list of ids, a list of ids is searched as is
+        """
+        if not config.batch_window_ms or isinstance(event_id, list):
+            return search_result_items(
+                self.call(
+                    "search",
+                    controller="events",
+                    eventid=event_id,
+                    limit=limit,
+                    operation=operation,
+                    **params,
+                )
+            )
+        group = call_key(self.misp.root_url, self.misp.key, "search", (), params)
+        event = event_loader.load(
+            group,
+            str(event_id),
+            lambda ids: self.events_by_id(ids, operation=operation, **params),
+        )
+        return [event] if event else []
+
+    def events_by_id(
+        self, event_ids: list, operation: str = "events_by_id", **params
+    ) -> dict:
+        """
+        Takes a list of event ids and the search parameters, and returns the found events by id and uuid
+        """
+        result = self.call(
+            "search",
+            controller="events",
+            eventid=event_ids,
+            operation=operation,
+            **params,
+        )
+        requested = set(event_ids)
+        events = {}
+        for e in search_result_items(result):
+            event = e.get("Event", e)
+            found = False
+            for event_key in (str(event.get("id")), event.get("uuid")):
+                if event_key in requested:
+                    # an event looked up by both id and uuid is not shared between the callers
+                    events[event_key] = copy.deepcopy(e) if found else e
+                    found = True
+        return events
+
+    def time_filters(self) -> dict:
+        """
+        Returns the search parameters restricting a search to the configured time window
+        """
+        if self.time_window:
+            return {"timestamp": self.time_window}
+        return {}
+
+    def search_pages(
+        self,
+        controller: str,
+        limit: int,
+        page_size: Optional[int] = None,
+        operation: str = "search_pages",
+        **kwargs,
+    ) -> Iterator[dict]:
+        """
+        Takes a controller, a limit and the search filters, and yields the results
+        one by one while requesting them from MISP a page at a time.
+        No further pages are requested once the limit is reached, when the caller stops iterating,
+        or when the transform runs out of time.
+        """
+        page_size = page_size or search_page_size
+        if limit:
+            page_size = min(page_size, limit)
+        page = 1
+        returned = 0
+        while True:
+            result = self.call(
+                "search",
+                controller=controller,
+                limit=page_size,
+                page=page,
+                operation=operation,
+                **self.time_filters(),
+                **kwargs,
+            )
+            items = search_result_items(result)
+            for item in items:
+                yield item
+                returned += 1
+                if limit and returned >= limit:
+                    return
+            if len(items) < page_size or deadline_reached():
+                return
+            page += 1
 
     def misp_query_idinfo(
         self, event_type: str, event_val: Union[str, int], limit: int
     ) -> dict:
         """Takes an input value (could be int or str), a flag, and a limit and searches
-        events with either id or info in MISP instance with the configured settings, and returns a JSON object"""
+        events with either id or info in MISP instance with the configured settings, and returns a JSON object.
+        The event index is used as only the event metadata is needed to build the entities"""
 
         if "id" in event_type:
-            events = self.misp.search(
-                controller="events",
+            events = self.call(
+                "search_index",
                 eventid=event_val,
                 limit=limit,
-                with_attachments=False,
+                page=1,
+                operation="misp_query_idinfo",
             )
         elif "info" in event_type:
-            events = self.misp.search(
-                controller="events",
+            events = self.call(
+                "search_index",
                 eventinfo=event_val,
                 limit=limit,
-                with_attachments=False,
+                page=1,
+                operation="misp_query_idinfo",
+                **self.time_filters(),
             )
 
-        return generate_entity_details_idinfo(events)
+        return generate_entity_details_index(search_result_items(events))
 
     def misp_query_attr(
         self, event_type: str, event_val: str, limit: int
@@ -61,66 +286,197 @@ class MISPQuery:
         and searches for either galaxies or tags in MISP instance with the configured settings, and returns a JSON object"""
 
         if "galaxy" in event_type:
-            events = self.misp.search(
-                controller="events", tags=event_val, limit=limit, with_attachments=False
+            events = self.call(
+                "search",
+                controller="events",
+                tags=event_val,
+                limit=limit,
+                with_attachments=False,
+                operation="misp_query_attr",
+                **self.time_filters(),
             )
         elif "hash_or_temp" in event_type:
-            events = self.misp.search_index(tags=event_val)
+            events = self.call(
+                "search_index",
+                tags=event_val,
+                operation="misp_query_attr",
+                **self.time_filters(),
+            )
 
-        for event in events:
+        for event in search_result_items(events):
             return generate_entity_details_attr(event)
 
     def from_hashtag(self, value: str) -> str:
         """
         Takes an input searches for tags and returns the value
         """
-        result = self.misp.direct_call("tags/search", {"name": value})
-        for t in result:
+        result = self.call(
+            "direct_call", "tags/search", {"name": value}, operation="from_hashtag"
+        )
+        for t in search_result_items(result):
             # skip misp-galaxies as we have processed them earlier on
             if t["Tag"]["name"].startswith("misp-galaxy"):
                 continue
             # In this case we do not filter away those we add as notes, as people might want to pivot on it explicitly.
             return t["Tag"]["name"]
 
-    def to_attribute(self, value: str, limit: int) -> dict:
+    def get_object_template(self, val: str) -> dict:
         """
         Takes an input and returns a JSON object
         """
-        return self.misp.search(
-            controller="attributes", value=value, limit=limit, with_attachments=False
-        )
+        # MISP has no lookup of several templates, concurrent lookups of a template share one call
+        return self.call("get_object_template", val)
 
-    def get_object_template(self, val: str) -> dict:
+    def get_object(self, object_id: Union[int, str]) -> dict:
         """
-        Takes an input and returns a JSON object
+        Takes an object id and returns a JSON object
+        """
+        return self.call("get_object", object_id)
+
+    def objects_by_id(self, object_events: dict, value: str) -> list:
+        """
+        Takes the ids of objects (with the id of their event) containing an attribute with the value,
+        and returns the objects in the same order, fetched with a single search
         """
-        return self.misp.get_object_template(val)
+        result = self.call(
+            "search",
+            controller="objects",
+            eventid=sorted(set(object_events.values())),
+            value=value,
+            with_attachments=False,
+            operation="objects_by_id",
+        )
+        objects = {}
+        for o in search_result_items(result):
+            o = o.get("Object", o)
+            objects[str(o.get("id"))] = o
+        return [objects[i] for i in object_events if i in objects]
 
     def obj_to_attribute(self, event_id: int) -> dict:
         """
         Takes an input and returns a JSON object
         """
-        return self.misp.get_event(event_id)
+        return self.call("get_event", event_id, operation="obj_to_attribute")
 
-    def event_to_transform_details(self, input_val: int, limit: int) -> dict:
+    def event_to_transform_details(
+        self,
+        input_val: int,
+        limit: int,
+        operation: str = "event_to_transform_details",
+        **filters,
+    ) -> dict:
         """
-        Takes an input and returns a JSON object
+        Takes an input and returns a JSON object,
+        optional attribute filters (type_attribute, category, to_ids, exclude_decayed)
+        are passed on to MISP to only return the matching attributes
         """
-        return self.misp.search(
-            controller="events", eventid=input_val, with_attachments=False, limit=limit
+        return self.load_event(
+            input_val,
+            limit=limit,
+            operation=operation,
+            with_attachments=False,
+            **filters,
         )
 
-    def misp_value(self, event_type: str, event_val: str, limit: int) -> dict:
+    def event_is_large(self, event: dict) -> bool:
         """
-        Takes an input and returns a JSON object
+        Takes the metadata of an event and checks if it has too many attributes
+        to be fetched at once
         """
-        if "value" in event_type:
-            return self.misp.search(
-                controller="events",
-                value=event_val,
+        return int(event.get("attribute_count") or 0) > config.large_event_threshold
+
+    def event_attributes(
+        self, input_val: int, event: dict, limit: int, **filters
+    ) -> Iterator[dict]:
+        """
+        Takes an event id and its metadata, and yields the attributes of the event.
+        Large events are paged through the attributes controller so only one page is held in memory,
+        smaller events are fetched at once.
+        """
+        if self.event_is_large(event):
+            for a in self.search_pages(
+                controller="attributes",
+                limit=0,
+                page_size=config.large_event_page_size,
+                operation="event_attributes",
+                eventid=input_val,
+                with_attachments=False,
+                **filters,
+            ):
+                # attributes of objects are returned with their objects
+                if a.get("object_id", "0") == "0":
+                    yield a
+        else:
+            event_json = self.event_to_transform_details(
+                input_val=input_val,
                 limit=limit,
+                operation="event_attributes",
+                **filters,
+            )
+            if event_json:
+                yield from event_json[0]["Event"].get("Attribute", [])
+
+    def event_objects(self, input_val: int, event: dict, limit: int) -> Iterator[dict]:
+        """
+        Takes an event id and its metadata, and yields the objects of the event.
+        Large events are paged through the objects controller, smaller events are fetched at once.
+        """
+        if self.event_is_large(event):
+            for o in self.search_pages(
+                controller="objects",
+                limit=0,
+                page_size=config.large_event_page_size,
+                operation="event_objects",
+                eventid=input_val,
                 with_attachments=False,
+            ):
+                yield o.get("Object", o)
+        else:
+            event_json = self.event_to_transform_details(
+                input_val=input_val, limit=limit, operation="event_objects"
             )
+            if event_json:
+                yield from event_json[0]["Event"].get("Object", [])
+
+    def event_metadata(self, input_val: Union[int, list], limit: int) -> dict:
+        """
+        Takes an event id (or a list of ids) and returns the events without
+        their attributes and objects, only the metadata (tags, galaxies, relations)
+        """
+        return self.load_event(
+            input_val,
+            limit=limit,
+            operation="event_metadata",
+            metadata=True,
+            with_attachments=False,
+        )
+
+    def attribute_search(self, value: str, limit: int) -> Iterator[dict]:
+        """
+        Takes a value and a limit, and yields the attributes with this value a page at a time
+        """
+        return self.search_pages(
+            controller="attributes",
+            limit=limit,
+            operation="attribute_search",
+            value=value,
+            with_attachments=False,
+        )
+
+
+def search_result_items(result: Union[dict, list]) -> list:
+    """
+    Takes a search result of any controller (or the event index, or the tags search)
+    and returns the list of results, attributes are wrapped in an Attribute key.
+    MISP errors are returned as a dictionary, they raise MISPRequestError
+    """
+    if isinstance(result, list):
+        return result
+    if isinstance(result, dict):
+        if "errors" in result:
+            raise MISPRequestError(result["errors"])
+        return result.get("Attribute", [])
+    return []
 
 
 def generate_entity_details_idinfo(events: dict) -> list:
@@ -148,6 +504,27 @@ def generate_entity_details_idinfo(events: dict) -> list:
     return result_list
 
 
+def generate_entity_details_index(events: list) -> list:
+    """
+    Takes a list of events from the event index and returns a list for building an entity
+    """
+    result_list = []
+    if isinstance(events, list):
+        for event in events:
+            # the index returns the tags as EventTag entries with the Tag nested
+            event_tag = [t.get("Tag", t) for t in event.get("EventTag", [])]
+
+            result = {
+                "event_id": event.get("id"),
+                "uuid": event.get("uuid"),
+                "event_info": event.get("info"),
+                "event_tag": event_tag,
+            }
+            result_list.append(result)
+
+    return result_list
+
+
 def generate_entity_details_attr(events: dict) -> list:
     """
     Takes a dictionary and returns a list for building an entity
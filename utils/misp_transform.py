@@ -0,0 +1,155 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the base class of the MISP transforms"""
+
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from maltego_trx.maltego import (
+    UIM_PARTIAL,
+    MaltegoEntity,
+    MaltegoMsg,
+    MaltegoTransform,
+)
+from maltego_trx.transform import DiscoverableTransform
+from maltego_trx.utils import name_to_path
+
+from utils.metrics import transform_duration, transform_entities, transform_requests
+from utils.profiling import profiled_call, profiled_call_async
+from utils.request_context import (
+    BudgetExceeded,
+    OutputTruncated,
+    budget_message,
+    budget_reached,
+    charge_entities,
+    request_scope,
+)
+from utils.resilience import MISPRequestError, MISPUnavailable, transient_errors
+from utils.tracing import span
+
+# estimated memory used by an entity (object and XML output) and by each property, besides their values
+entity_overhead = 512
+property_overhead = 128
+
+
+class BudgetedEntity(MaltegoEntity):
+    """
+    Entity charging the size of its properties and notes to the budget of the transform
+    """
+
+    def addProperty(
+        self, fieldName=None, displayName=None, matchingRule="loose", value=None
+    ):
+        charge_entities(
+            property_overhead
+            + len(str(fieldName))
+            + len(str(displayName))
+            + len(str(value))
+        )
+        super().addProperty(fieldName, displayName, matchingRule, value)
+
+    def addDisplayInformation(self, content=None, title="Info"):
+        charge_entities(property_overhead + len(str(content)) + len(str(title)))
+        super().addDisplayInformation(content, title)
+
+
+class MISPResponse(MaltegoTransform):
+    """
+    Response enforcing the entity budget of the transform: once it is used no more entities are built,
+    BudgetExceeded stops the helper, which releases the MISP results it holds
+    """
+
+    def addEntity(self, type=None, value=None):
+        if budget_reached():
+            raise BudgetExceeded(budget_message)
+        entity = BudgetedEntity(type, value)
+        charge_entities(entity_overhead + len(str(type)) + len(str(value)), entities=1)
+        self.entities.append(entity)
+        return entity
+
+    def returnOutput(self):
+        with span("serialize", entities=len(self.entities)):
+            return super().returnOutput()
+
+
+class MISPTransform(DiscoverableTransform):
+    """
+    Base class of the MISP transforms, runs create_entities (or create_entities_async
+    from the ASGI entry point) and tells the analyst when MISP is unavailable
+    or did not respond, or rejected a search, instead of failing with a generic error.
+    Each run gets a deadline and an entity budget, the helpers stop at them and the output is reported as truncated.
+    In all these cases the entities built so far are still returned.
+    """
+
+    # scheduling class of the transform when the server is busy: "interactive" transforms
+    # get a larger share of the worker than the "bulk" expansions of whole events
+    priority = "interactive"
+
+    @classmethod
+    @contextmanager
+    def running(cls, response: MaltegoTransform) -> Iterator[None]:
+        """
+        Runs the body as the transform: within its request context, turning the stops and MISP failures
+        into messages to the analyst, and recording the metrics of the run
+        """
+        name = name_to_path(cls.__name__)
+        start = time.monotonic()
+        outcome = "error"
+        try:
+            with request_scope() as context:
+                try:
+                    yield
+                    outcome = "ok"
+                except OutputTruncated:
+                    pass
+                except MISPUnavailable as e:
+                    outcome = "unavailable"
+                    response.addUIMessage(str(e), UIM_PARTIAL)
+                except MISPRequestError as e:
+                    outcome = "rejected"
+                    response.addUIMessage(str(e), UIM_PARTIAL)
+                except transient_errors as e:
+                    outcome = "misp_error"
+                    response.addUIMessage(f"MISP did not respond: {e}", UIM_PARTIAL)
+            if context.truncation:
+                outcome = "truncated"
+                response.addUIMessage(context.truncation, UIM_PARTIAL)
+        finally:
+            transform_requests.labels(name, outcome).inc()
+            transform_duration.labels(name).observe(time.monotonic() - start)
+            transform_entities.labels(name).observe(len(response.entities))
+
+    @classmethod
+    def run_transform(cls, request: MaltegoMsg) -> str:
+        response = MISPResponse()
+        with cls.running(response):
+            profiled_call(
+                name_to_path(cls.__name__), cls.create_entities, request, response
+            )
+        return response.returnOutput()
+
+    @classmethod
+    async def run_transform_async(cls, request: MaltegoMsg) -> str:
+        response = MISPResponse()
+        with cls.running(response):
+            await profiled_call_async(
+                name_to_path(cls.__name__), cls.create_entities_async, request, response
+            )
+        return response.returnOutput()
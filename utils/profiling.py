@@ -0,0 +1,228 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the sampling profiler of the transforms.
+
+A sampled transform registers the frame its create_entities is called from, and so do the fan-out calls it runs
+on the thread pool. A sampler thread then periodically walks the stacks of the threads (and of the suspended greenlets
+with the gevent workers) and counts the stacks reaching a registered frame. The stacks are appended to
+<MISP_PROFILE_DIR>/<transform>.collapsed in the collapsed format read by flamegraph.pl and speedscope.
+"""
+
+import importlib
+import logging
+import os
+import random
+import sys
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from utils import config
+
+try:
+    from gevent import monkey
+    from greenlet import getcurrent
+except ImportError:
+    monkey = None
+
+log = logging.getLogger(__name__)
+
+
+def original(module: str, name: str) -> Any:
+    """
+    Returns a function of the standard library as it was before the gevent monkey patching
+    """
+    if monkey is not None:
+        return monkey.get_original(module, name)
+    return getattr(importlib.import_module(module), name)
+
+
+# the sampler must run on an OS thread to interrupt the greenlets, and must not wait on gevent primitives
+start_new_thread = original("_thread", "start_new_thread")
+allocate_lock = original("_thread", "allocate_lock")
+sleep = original("time", "sleep")
+
+
+def current_greenlet() -> Any:
+    if monkey is not None and monkey.is_module_patched("threading"):
+        return getcurrent()
+    return None
+
+
+@dataclass
+class Profile:
+    transform: str
+    # number of samples of each collapsed stack
+    stacks: Counter = field(default_factory=Counter)
+
+
+class Sampler:
+    """
+    Samples the stacks of the registered frames while there are any
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.lock = allocate_lock()
+        # frame a profiled call runs from -> its profile
+        self.roots: dict = {}
+        # greenlets running profiled calls, their stacks are not in sys._current_frames() while they are switched out
+        self.greenlets: Counter = Counter()
+        self.running = False
+
+    def enter(self, frame, profile: Profile) -> None:
+        greenlet = current_greenlet()
+        with self.lock:
+            self.roots[frame] = profile
+            if greenlet is not None:
+                self.greenlets[greenlet] += 1
+            if not self.running:
+                self.running = True
+                start_new_thread(self.run, ())
+
+    def leave(self, frame) -> None:
+        greenlet = current_greenlet()
+        with self.lock:
+            del self.roots[frame]
+            if greenlet is not None:
+                self.greenlets[greenlet] -= 1
+                if not self.greenlets[greenlet]:
+                    del self.greenlets[greenlet]
+
+    def run(self) -> None:
+        while True:
+            with self.lock:
+                if not self.roots:
+                    self.running = False
+                    return
+                frames = list(sys._current_frames().values())
+                # the running greenlet has no gr_frame, its stack is the one of its thread
+                frames += [g.gr_frame for g in self.greenlets if g.gr_frame is not None]
+                for frame in frames:
+                    self.sample(frame)
+            sleep(self.interval)
+
+    def sample(self, frame) -> None:
+        stack = []
+        while frame is not None:
+            profile = self.roots.get(frame)
+            if profile is not None:
+                stack.append(profile.transform)
+                profile.stacks[";".join(reversed(stack))] += 1
+                return
+            code = frame.f_code
+            stack.append(f"{os.path.basename(code.co_filename)}:{code.co_qualname}")
+            frame = frame.f_back
+
+
+sampler = Sampler(config.profile_interval_ms / 1000)
+# profile of the transform being run, copied into the fan-out calls
+current_profile: ContextVar[Optional[Profile]] = ContextVar(
+    "current_profile", default=None
+)
+
+
+def sampled() -> bool:
+    return (
+        bool(config.profile_dir)
+        and config.profile_rate > 0
+        and random.random() < config.profile_rate
+    )
+
+
+def call_sampled(profile: Profile, function: Callable, *args, **kwargs) -> Any:
+    frame = sys._getframe()
+    sampler.enter(frame, profile)
+    try:
+        return function(*args, **kwargs)
+    finally:
+        sampler.leave(frame)
+
+
+async def call_sampled_async(
+    profile: Profile, function: Callable, *args, **kwargs
+) -> Any:
+    # the frames of the coroutines are only on the stack while they run, not while they wait
+    frame = sys._getframe()
+    sampler.enter(frame, profile)
+    try:
+        return await function(*args, **kwargs)
+    finally:
+        sampler.leave(frame)
+
+
+def write_profile(profile: Profile) -> None:
+    """
+    Appends the stacks of the profile to the file of its transform, the repeated stacks are summed by the flame graph tools
+    """
+    with sampler.lock:
+        stacks = dict(profile.stacks)
+    if not stacks:
+        return
+    lines = "".join(f"{stack} {count}\n" for stack, count in stacks.items())
+    try:
+        os.makedirs(config.profile_dir, exist_ok=True)
+        path = os.path.join(config.profile_dir, f"{profile.transform}.collapsed")
+        with open(path, "a") as f:
+            f.write(lines)
+    except OSError as e:
+        log.warning("Could not write the profile of %s: %s", profile.transform, e)
+
+
+def profiled_call(transform: str, function: Callable, *args, **kwargs) -> Any:
+    """
+    Calls the function, under the profiler for the share of the calls set by MISP_PROFILE_RATE
+    """
+    if not sampled():
+        return function(*args, **kwargs)
+    profile = Profile(transform)
+    token = current_profile.set(profile)
+    try:
+        return call_sampled(profile, function, *args, **kwargs)
+    finally:
+        current_profile.reset(token)
+        write_profile(profile)
+
+
+async def profiled_call_async(
+    transform: str, function: Callable, *args, **kwargs
+) -> Any:
+    """
+    Awaits the coroutine function, under the profiler for the share of the calls set by MISP_PROFILE_RATE
+    """
+    if not sampled():
+        return await function(*args, **kwargs)
+    profile = Profile(transform)
+    token = current_profile.set(profile)
+    try:
+        return await call_sampled_async(profile, function, *args, **kwargs)
+    finally:
+        current_profile.reset(token)
+        write_profile(profile)
+
+
+def run_profiled(function: Callable, /, **kwargs) -> Any:
+    """
+    Runs a fan-out call of a transform, under the profiler when the transform is profiled
+    """
+    profile = current_profile.get()
+    if profile is None:
+        return function(**kwargs)
+    return call_sampled(profile, function, **kwargs)
@@ -0,0 +1,182 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the context of the transform request being run: its deadline, its entity budget
+and whether its output is truncated"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator, Optional
+
+from utils import config
+
+deadline_message = (
+    "Output truncated: the transform reached its time limit, "
+    "the entities found so far are returned."
+)
+budget_message = (
+    "Output truncated: the transform reached its entity or memory budget, "
+    "the entities found so far are returned."
+)
+
+# shortest timeout given to a MISP call made just before the deadline
+min_timeout = 0.01
+
+
+@dataclass
+class RequestContext:
+    # time.monotonic() after which no more MISP calls are made
+    deadline: float
+    max_entities: int = 0
+    max_bytes: int = 0
+    # entities built by the helpers and their estimated size
+    entities: int = 0
+    entity_bytes: int = 0
+    # message set once a helper stopped early, the transform then tells the analyst
+    truncation: Optional[str] = None
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def budget_reached(self) -> bool:
+        return (bool(self.max_entities) and self.entities >= self.max_entities) or (
+            bool(self.max_bytes) and self.entity_bytes >= self.max_bytes
+        )
+
+
+class OutputTruncated(Exception):
+    """
+    Raised to stop the helpers of a transform, the entities built so far are returned
+    """
+
+
+class DeadlineExceeded(OutputTruncated):
+    """
+    Raised instead of calling MISP once the deadline of the transform has passed
+    """
+
+
+class BudgetExceeded(OutputTruncated):
+    """
+    Raised instead of building an entity once the budget of the transform is used
+    """
+
+
+# the context is copied into the threads and tasks running the helpers of a request,
+# they share the same RequestContext
+current_request: ContextVar[Optional[RequestContext]] = ContextVar(
+    "current_request", default=None
+)
+
+
+# time.monotonic() when the server received the request, set by the admission control
+# so the time spent waiting for a slot counts towards the deadline
+request_started: ContextVar[Optional[float]] = ContextVar(
+    "request_started", default=None
+)
+
+
+@contextmanager
+def request_scope(deadline: Optional[float] = None) -> Iterator[RequestContext]:
+    """
+    Runs the code of a transform request with its context,
+    the deadline defaults to the configured transform deadline from the start of the request
+    """
+    if deadline is None:
+        started = request_started.get() or time.monotonic()
+        deadline = started + config.transform_deadline
+    context = RequestContext(
+        deadline=deadline,
+        max_entities=config.max_entities,
+        max_bytes=config.max_response_mb * 1024 * 1024,
+    )
+    token = current_request.set(context)
+    try:
+        yield context
+    finally:
+        current_request.reset(token)
+
+
+def deadline_reached() -> bool:
+    """
+    Checks if the transform being run is out of time, and marks its output as truncated if so
+    """
+    context = current_request.get()
+    if context is not None and time.monotonic() >= context.deadline:
+        context.truncation = deadline_message
+        return True
+    return False
+
+
+def remaining_time() -> Optional[float]:
+    """
+    Returns the seconds left before the deadline of the transform being run, None outside of a transform
+    """
+    context = current_request.get()
+    if context is None:
+        return None
+    return context.deadline - time.monotonic()
+
+
+def capped_timeout(timeout: float) -> float:
+    """
+    Takes the timeout of a MISP call and caps it to the time left to the transform being run
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    return max(min(timeout, remaining), min_timeout)
+
+
+def check_deadline() -> None:
+    """
+    Raises DeadlineExceeded when the transform being run is out of time
+    """
+    if deadline_reached():
+        raise DeadlineExceeded(deadline_message)
+
+
+def wait_within_deadline(event: threading.Event) -> None:
+    """
+    Waits for the event, raises DeadlineExceeded when the transform being run runs out of time first
+    """
+    while not event.wait(remaining_time()):
+        check_deadline()
+
+
+def budget_reached() -> bool:
+    """
+    Checks if the transform being run used its entity budget, and marks its output as truncated if so
+    """
+    context = current_request.get()
+    if context is not None and context.budget_reached():
+        context.truncation = budget_message
+        return True
+    return False
+
+
+def charge_entities(size: int, entities: int = 0) -> None:
+    """
+    Adds built entities and their estimated size in bytes to the budget of the transform being run
+    """
+    context = current_request.get()
+    if context is not None:
+        with context.lock:
+            context.entities += entities
+            context.entity_bytes += size
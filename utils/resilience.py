@@ -0,0 +1,179 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the retry policy and the circuit breaker of the calls to MISP"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+import httpx
+import requests
+from pymisp.exceptions import MISPServerError
+
+from utils import config
+from utils.request_context import remaining_time
+
+# errors after which MISP may answer when called again
+transient_errors = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    httpx.TransportError,
+    MISPServerError,
+)
+
+# the read-only calls that are retried, direct_call is not as it can reach any endpoint
+idempotent_methods = {
+    "search",
+    "search_index",
+    "get_event",
+    "get_object",
+    "get_object_template",
+}
+
+# the delay before a retry is drawn between 0 and base * 2^attempt seconds (full jitter), at most the cap
+retry_base_delay = 0.2
+retry_max_delay = 2.0
+
+
+def retry_delay(attempt: int) -> float:
+    """
+    Returns the seconds to wait before retrying after the given failed attempt (0 for the first)
+    """
+    return random.uniform(0, min(retry_max_delay, retry_base_delay * 2**attempt))
+
+
+def time_left_for(delay: float) -> bool:
+    """
+    Checks if the transform being run has time left to retry a call after the delay
+    """
+    remaining = remaining_time()
+    return remaining is None or remaining > delay
+
+
+class MISPUnavailable(Exception):
+    """
+    Raised instead of calling MISP while its circuit breaker is open,
+    the transforms turn it into a message to the analyst
+    """
+
+
+class MISPRequestError(Exception):
+    """
+    Raised when MISP rejects a call (authentication, permissions, invalid filters),
+    the transforms turn it into a message to the analyst instead of returning no results
+    """
+
+    def __init__(self, errors):
+        # PyMISP returns the status code and the JSON error of MISP
+        if isinstance(errors, (list, tuple)) and len(errors) == 2:
+            status, details = errors
+            if isinstance(details, dict):
+                details = details.get("message") or details.get("name") or details
+            message = f"MISP rejected the search ({status}): {details}"
+        else:
+            message = f"MISP rejected the search: {errors}"
+        super().__init__(message)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a MISP instance after consecutive failures (open), lets a single call
+    through once the reset time has passed (half open), and closes again when it succeeds
+    """
+
+    def __init__(self, misp_url: str, max_failures: int, reset_seconds: float):
+        self.misp_url = misp_url
+        self.max_failures = max_failures
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: float | None = None
+        # token of the call let through while half open, until it succeeds, fails or is released
+        self.trial: Optional[object] = None
+
+    def check(self) -> Optional[object]:
+        """
+        Raises MISPUnavailable when the instance must not be called,
+        returns a token when the call is the trial of the half open breaker
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return None
+            wait = self.opened_at + self.reset_seconds - time.monotonic()
+            if wait <= 0 and self.trial is None:
+                self.trial = object()
+                return self.trial
+        raise MISPUnavailable(
+            f"MISP ({self.misp_url}) is not responding, the transform was stopped. "
+            f"Try again in {max(int(wait), 1)} seconds."
+        )
+
+    def release_trial(self, trial: object) -> None:
+        """
+        Ends a trial that neither succeeded nor failed (interrupted, or stopped by an error
+        unrelated to the health of MISP), so the next call is let through instead
+        """
+        with self.lock:
+            if self.trial is trial:
+                self.trial = None
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Raises MISPUnavailable when the instance must not be called, otherwise runs the call,
+        the trial of the half open breaker is released however the call ends
+        """
+        trial = self.check()
+        try:
+            yield
+        finally:
+            if trial is not None:
+                self.release_trial(trial)
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = None
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.trial is not None or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+            self.trial = None
+
+
+breakers: dict = {}
+breakers_lock = threading.Lock()
+
+
+def instance_breaker(misp_url: str) -> CircuitBreaker:
+    """
+    Returns the circuit breaker of a MISP instance, shared by all the requests of the worker
+    """
+    with breakers_lock:
+        breaker = breakers.get(misp_url)
+        if breaker is None:
+            breaker = breakers[misp_url] = CircuitBreaker(
+                misp_url, config.breaker_failures, config.breaker_reset_seconds
+            )
+        return breaker
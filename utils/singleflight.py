@@ -0,0 +1,122 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the singleflight layer sharing identical in-flight MISP calls between concurrent requests"""
+
+import copy
+import hashlib
+import json
+import threading
+from typing import Any, Callable
+
+from utils.metrics import count_cache
+from utils.request_context import OutputTruncated, wait_within_deadline
+
+
+class InFlightCall:
+    """
+    A MISP call running for the first request, the requests making the same call wait for its result
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Runs a function once for all the concurrent calls with the same key.
+    The results are parsed JSON the transforms modify while building entities,
+    so every caller gets its own copy when the result is shared.
+    The call runs in the context of the first caller (its deadline), the others wait within their own deadline
+    and make the call again if the first caller ran out of time or budget.
+    """
+
+    def __init__(self, name: str):
+        # name of the layer in the cache metrics
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls: dict = {}
+
+    def do(self, key: tuple, function: Callable, *args, **kwargs) -> Any:
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = InFlightCall()
+            else:
+                call.followers += 1
+        count_cache(self.name, hit=not leader)
+        if not leader:
+            wait_within_deadline(call.done)
+            if isinstance(call.error, OutputTruncated):
+                return self.do(key, function, *args, **kwargs)
+            return self.result(call)
+
+        try:
+            call.result = function(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # no more followers can join once the call is removed,
+            # later calls with the same key start a new MISP call
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        if call.followers:
+            return copy.deepcopy(call.result)
+        return call.result
+
+    def result(self, call: InFlightCall) -> Any:
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+
+def normalized_param(value: Any) -> Any:
+    """
+    Returns a parameter of a call with its numbers as strings, MISP takes ids either way
+    """
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, (list, tuple, set)):
+        return [normalized_param(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalized_param(v) for k, v in value.items()}
+    return value
+
+
+def call_key(url: str, key: str, method: str, args: tuple, kwargs: dict) -> tuple:
+    """
+    Returns the key identifying a MISP call: the instance, the API key it runs with
+    (hashed, results depend on the permissions of the user), the method and its normalized parameters
+    """
+    key_scope = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    params = json.dumps(
+        [normalized_param(args), normalized_param(kwargs)], sort_keys=True, default=str
+    )
+    return (url, key_scope, method, params)
+
+
+# shared by all the requests of the worker
+shared_calls = SingleFlight("singleflight")
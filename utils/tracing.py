@@ -0,0 +1,357 @@
+# Author: Sangeetharaj SMB
+"""
+ Copyright (C) 2024 Maltego Technologies GmbH
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU Affero General Public License as
+ published by the Free Software Foundation, either version 3 of the
+ License, or (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU Affero General Public License for more details.
+
+ You should have received a copy of the GNU Affero General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+"""Module provides the tracing of the transforms: spans around the stages of a request (MISP calls,
+JSON decoding, entity building, galaxy lookups, XML serialization), summed by stage into the
+Server-Timing header of the response and exported as JSON lines or to an OTLP/HTTP collector.
+
+The request id of a transform is sent to MISP in the X-Request-ID header of its calls.
+"""
+
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Callable, Iterator, Optional
+
+import requests
+from requests.auth import AuthBase
+
+from utils import config
+from utils.metrics import traces_dropped
+
+log = logging.getLogger(__name__)
+
+request_id_header = "X-Request-ID"
+# request ids received from the client are kept when they are safe to forward to MISP
+request_id_pattern = re.compile(r"^[\w.-]{1,128}$")
+trace_id_pattern = re.compile(r"^[0-9a-f]{32}$")
+
+
+@dataclass
+class Span:
+    stage: str
+    span_id: str
+    parent_id: Optional[str]
+    # time.time_ns() at the start, the duration is measured with time.perf_counter_ns()
+    start: int
+    duration: int = 0
+    # time of the nested spans, not counted in the time of the stage of this span
+    child_time: int = 0
+    attributes: dict = field(default_factory=dict)
+
+
+@dataclass
+class Trace:
+    request_id: str
+    trace_id: str
+    transform: str
+    started: float = field(default_factory=time.perf_counter)
+    spans: list = field(default_factory=list)
+    # nanoseconds spent in each stage, without the nested stages
+    stages: dict = field(default_factory=dict)
+    dropped: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def finish(self, span: Span, parent: Optional[Span]) -> None:
+        with self.lock:
+            if parent is not None:
+                parent.child_time += span.duration
+            # the nested spans run in parallel threads may add up to more than their parent
+            own_time = max(0, span.duration - span.child_time)
+            self.stages[span.stage] = self.stages.get(span.stage, 0) + own_time
+            if len(self.spans) < config.trace_max_spans:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+
+# like the request context, the trace is copied into the threads and tasks of the request
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def new_id(bits: int) -> str:
+    return f"{random.getrandbits(bits):0{bits // 4}x}"
+
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Times the body as a span of the given stage of the current trace, does nothing outside of a trace
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = current_span.get()
+    current = Span(
+        stage,
+        new_id(64),
+        parent.span_id if parent is not None else None,
+        time.time_ns(),
+        attributes=attributes,
+    )
+    token = current_span.set(current)
+    start = time.perf_counter_ns()
+    try:
+        yield current
+    finally:
+        current.duration = time.perf_counter_ns() - start
+        current_span.reset(token)
+        trace.finish(current, parent)
+
+
+def traced(stage: str) -> Callable:
+    """
+    Decorator running the function in a span of the given stage
+    """
+
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if current_trace.get() is None:
+                return function(*args, **kwargs)
+            with span(stage, function=function.__name__):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current_request_id() -> Optional[str]:
+    trace = current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def request_headers(headers: dict) -> dict:
+    """
+    Returns the headers of a MISP call with the request id of the current trace
+    """
+    request_id = current_request_id()
+    if request_id is None:
+        return headers
+    return {**headers, request_id_header: request_id}
+
+
+class RequestIdAuth(AuthBase):
+    """
+    Adds the request id of the current trace to the calls of PyMISP
+    """
+
+    def __call__(self, request):
+        request_id = current_request_id()
+        if request_id is not None:
+            request.headers[request_id_header] = request_id
+        return request
+
+
+@contextmanager
+def trace_scope(
+    transform_name: str, request_id: Optional[str] = None
+) -> Iterator[Trace]:
+    """
+    Runs the body as a traced transform request, its spans are exported when it ends
+    """
+    if not request_id or not request_id_pattern.match(request_id):
+        request_id = uuid.uuid4().hex
+    # a request id sent by a tracing client is kept as the trace id, to find the trace by it
+    trace_id = request_id if trace_id_pattern.match(request_id) else uuid.uuid4().hex
+    trace = Trace(request_id, trace_id, transform_name)
+    token = current_trace.set(trace)
+    try:
+        with span("transform", transform=transform_name, request_id=request_id) as root:
+            yield trace
+            root.attributes["dropped_spans"] = trace.dropped
+    finally:
+        current_trace.reset(token)
+        export(trace)
+
+
+def server_timing(trace: Trace) -> str:
+    """
+    Returns the Server-Timing header summing the time of the request by stage, in milliseconds
+    """
+    metrics = [
+        f"{stage};dur={duration / 1e6:.1f}" for stage, duration in trace.stages.items()
+    ]
+    metrics.append(f"total;dur={(time.perf_counter() - trace.started) * 1e3:.1f}")
+    return ", ".join(metrics)
+
+
+def response_headers(trace: Trace) -> list:
+    return [
+        (request_id_header, trace.request_id),
+        ("Server-Timing", server_timing(trace)),
+    ]
+
+
+def span_record(trace: Trace, s: Span) -> dict:
+    return {
+        "trace_id": trace.trace_id,
+        "span_id": s.span_id,
+        "parent_span_id": s.parent_id,
+        "name": s.stage,
+        "start_time_unix_nano": s.start,
+        "end_time_unix_nano": s.start + s.duration,
+        "attributes": s.attributes,
+    }
+
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_payload(trace: Trace) -> dict:
+    """
+    Returns the spans of the trace in the OTLP/HTTP JSON encoding
+    """
+    spans = [
+        {
+            "traceId": trace.trace_id,
+            "spanId": s.span_id,
+            "parentSpanId": s.parent_id or "",
+            "name": s.stage,
+            "kind": 1,
+            "startTimeUnixNano": str(s.start),
+            "endTimeUnixNano": str(s.start + s.duration),
+            "attributes": [
+                {"key": key, "value": otlp_value(value)}
+                for key, value in s.attributes.items()
+            ],
+        }
+        for s in trace.spans
+    ]
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {
+                            "key": "service.name",
+                            "value": {"stringValue": "misp_maltego_trx"},
+                        }
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": "utils.tracing"}, "spans": spans}],
+            }
+        ]
+    }
+
+
+trace_file_lock = threading.Lock()
+# traces waiting to be sent to the collector, further traces are dropped while it is full (collector slow or down)
+otlp_queue: queue.Queue = queue.Queue(maxsize=config.trace_otlp_queue_size)
+# the collector is called in the background, a single thread keeps the traces in order.
+# It is started on first use, in the worker process
+otlp_sender: Optional[threading.Thread] = None
+otlp_sender_lock = threading.Lock()
+
+
+def send_otlp(payload: dict) -> None:
+    try:
+        requests.post(
+            config.trace_otlp_endpoint, json=payload, timeout=5
+        ).raise_for_status()
+    except requests.RequestException as e:
+        log.warning(
+            "Could not export the trace to %s: %s", config.trace_otlp_endpoint, e
+        )
+
+
+def send_otlp_queue() -> None:
+    while True:
+        send_otlp(otlp_queue.get())
+
+
+def queue_otlp(trace: Trace) -> None:
+    """
+    Queues the trace to be sent to the collector, or drops it when the queue is full
+    """
+    global otlp_sender
+    with otlp_sender_lock:
+        if otlp_sender is None:
+            otlp_sender = threading.Thread(
+                target=send_otlp_queue, name="otlp", daemon=True
+            )
+            otlp_sender.start()
+    if otlp_queue.full():
+        traces_dropped.inc()
+        return
+    try:
+        otlp_queue.put_nowait(otlp_payload(trace))
+    except queue.Full:
+        traces_dropped.inc()
+
+
+def export(trace: Trace) -> None:
+    """
+    Writes the spans of the trace to the configured JSON lines file and OTLP collector
+    """
+    if config.trace_file:
+        lines = "".join(
+            json.dumps(span_record(trace, s), default=str) + "\n" for s in trace.spans
+        )
+        try:
+            with trace_file_lock, open(config.trace_file, "a") as f:
+                f.write(lines)
+        except OSError as e:
+            log.warning("Could not export the trace to %s: %s", config.trace_file, e)
+    if config.trace_otlp_endpoint:
+        queue_otlp(trace)
+
+
+class TracingMiddleware:
+    """
+    WSGI middleware tracing the transform requests (POST /run/...), their response gets
+    the request id and the Server-Timing header
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if environ.get("REQUEST_METHOD") != "POST" or not path.startswith("/run/"):
+            return self.app(environ, start_response)
+
+        transform_name = path[len("/run/") :].strip("/").lower()
+        with trace_scope(transform_name, environ.get("HTTP_X_REQUEST_ID")) as trace:
+
+            def traced_start_response(status, headers, exc_info=None):
+                # the response of the transform is already serialized when it is started
+                return start_response(
+                    status, headers + response_headers(trace), exc_info
+                )
+
+            return self.app(environ, traced_start_response)